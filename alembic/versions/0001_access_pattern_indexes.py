@@ -0,0 +1,37 @@
+"""Composite indexes for the routers' access patterns
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18
+
+The tables themselves are still created by create_all at startup; this only
+adds the indexes declared in models.py to databases created before them.
+Built CONCURRENTLY so a live database keeps taking slips meanwhile.
+"""
+from alembic import op
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    ("ix_slips_slip_date_id", "slips", "slip_date, id"),
+    ("ix_slips_client_id_slip_date", "slips", "client_id, slip_date"),
+    ("ix_slips_salesman_id_slip_date", "slips", "salesman_id, slip_date"),
+    ("ix_slips_vehicle_number", "slips", "vehicle_number"),
+    ("ix_slip_details_product_id_slip_date", "slip_details", "product_id, slip_date"),
+    ("ix_payments_client_id_date", "payments", "client_id, date"),
+]
+
+
+def upgrade():
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            op.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} ({columns})")
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for name, _, _ in INDEXES:
+            op.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
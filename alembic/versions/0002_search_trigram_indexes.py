@@ -0,0 +1,35 @@
+"""pg_trgm indexes for SEARCH_BACKEND=pg
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18
+
+Only the pg search backend uses these; the default in-memory index does not
+touch them. Creating the extension needs a role allowed to do so.
+"""
+from alembic import op
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    ("ix_clients_name_trgm", "clients", "name"),
+    ("ix_clients_phone_trgm", "clients", "phone"),
+    ("ix_products_name_trgm", "products", "name"),
+    ("ix_slips_vehicle_number_trgm", "slips", "vehicle_number"),
+]
+
+
+def upgrade():
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    with op.get_context().autocommit_block():
+        for name, table, column in INDEXES:
+            op.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} USING gin ({column} gin_trgm_ops)")
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for name, _, _ in INDEXES:
+            op.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
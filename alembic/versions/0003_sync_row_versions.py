@@ -0,0 +1,38 @@
+"""row_version columns and tombstones for GET /sync
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18
+
+Existing rows get row_version 0, which a first (token-less) sync reads like
+any other; new writes are stamped with txid_current(). Adding a column with a
+constant default is a catalog-only change, the indexes are built CONCURRENTLY.
+The tombstones table itself comes from create_all.
+"""
+from alembic import op
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+TABLES = ["salesman", "clients", "products", "slips", "slip_details", "payments"]
+
+
+def upgrade():
+    for table in TABLES:
+        op.execute(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS row_version bigint NOT NULL DEFAULT 0")
+        op.execute(f"ALTER TABLE {table} ALTER COLUMN row_version SET DEFAULT txid_current()")
+    with op.get_context().autocommit_block():
+        for table in TABLES:
+            op.execute(
+                f"CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_{table}_row_version_id ON {table} (row_version, id)"
+            )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for table in TABLES:
+            op.execute(f"DROP INDEX CONCURRENTLY IF EXISTS ix_{table}_row_version_id")
+    for table in TABLES:
+        op.execute(f"ALTER TABLE {table} DROP COLUMN IF EXISTS row_version")
@@ -0,0 +1,124 @@
+"""partition slips and slip_details by slip_date month
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18
+
+A table cannot be turned into a partitioned one in place, so both are
+rebuilt: the old tables are renamed, partitioned ones are created with the
+same columns, one partition per month from the oldest slip to next month,
+the rows copied over and the old tables dropped. The id sequences move along,
+so new ids carry on where they were.
+
+Primary keys become (id, slip_date) and slip_number is unique per
+(slip_number, slip_date), as every unique key of a partitioned table has to
+contain the partition key. slip_details reference slips by (slip_id, slip_date),
+so details whose slip_date differs from their slip's are aligned first.
+
+This copies every slip and takes both tables offline while it runs: use a
+maintenance window. slip_archive itself comes from create_all.
+"""
+from alembic import op
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+SLIP_INDEXES = [
+    "CREATE INDEX ix_slips_id ON slips (id)",
+    "CREATE INDEX ix_slips_slip_number ON slips (slip_number)",
+    "CREATE INDEX ix_slips_slip_date_id ON slips (slip_date, id)",
+    "CREATE INDEX ix_slips_client_id_slip_date ON slips (client_id, slip_date)",
+    "CREATE INDEX ix_slips_salesman_id_slip_date ON slips (salesman_id, slip_date)",
+    "CREATE INDEX ix_slips_vehicle_number ON slips (vehicle_number)",
+    "CREATE INDEX ix_slips_row_version_id ON slips (row_version, id)",
+    "CREATE INDEX ix_slips_vehicle_number_trgm ON slips USING gin (vehicle_number gin_trgm_ops)",
+]
+DETAIL_INDEXES = [
+    "CREATE INDEX ix_slip_details_id ON slip_details (id)",
+    "CREATE INDEX ix_slip_details_slip_id ON slip_details (slip_id)",
+    "CREATE INDEX ix_slip_details_product_id_slip_date ON slip_details (product_id, slip_date)",
+    "CREATE INDEX ix_slip_details_row_version_id ON slip_details (row_version, id)",
+]
+
+# One partition per month of data, plus the current and the next month
+CREATE_PARTITIONS = """
+DO $$
+DECLARE
+    month date;
+BEGIN
+    FOR month IN
+        SELECT generate_series(
+            date_trunc('month', least(min(slip_date), current_date)),
+            date_trunc('month', greatest(max(slip_date), current_date)) + interval '1 month',
+            interval '1 month'
+        )::date
+        FROM slips_unpartitioned
+    LOOP
+        EXECUTE format(
+            'CREATE TABLE %I PARTITION OF slips FOR VALUES FROM (%L) TO (%L)',
+            'slips_y' || to_char(month, 'YYYY') || 'm' || to_char(month, 'MM'),
+            month, month + interval '1 month'
+        );
+        EXECUTE format(
+            'CREATE TABLE %I PARTITION OF slip_details FOR VALUES FROM (%L) TO (%L)',
+            'slip_details_y' || to_char(month, 'YYYY') || 'm' || to_char(month, 'MM'),
+            month, month + interval '1 month'
+        );
+    END LOOP;
+END $$
+"""
+
+
+def _rebuild(partitioned: bool):
+    for table in ("slip_details", "slips"):
+        op.execute(f"ALTER TABLE {table} RENAME TO {table}_unpartitioned")
+
+    partition_by = " PARTITION BY RANGE (slip_date)" if partitioned else ""
+    for table in ("slips", "slip_details"):
+        op.execute(f"CREATE TABLE {table} (LIKE {table}_unpartitioned INCLUDING DEFAULTS){partition_by}")
+    if partitioned:
+        op.execute(CREATE_PARTITIONS)
+
+    op.execute("INSERT INTO slips SELECT * FROM slips_unpartitioned")
+    op.execute(
+        "UPDATE slip_details_unpartitioned AS d SET slip_date = s.slip_date "
+        "FROM slips_unpartitioned AS s WHERE s.id = d.slip_id AND d.slip_date <> s.slip_date"
+    )
+    op.execute("INSERT INTO slip_details SELECT * FROM slip_details_unpartitioned")
+    for table in ("slips", "slip_details"):
+        op.execute(f"ALTER SEQUENCE {table}_id_seq OWNED BY {table}.id")
+    # Frees the index and constraint names for the new tables
+    op.execute("DROP TABLE slip_details_unpartitioned, slips_unpartitioned")
+
+    if partitioned:
+        op.execute("ALTER TABLE slips ADD PRIMARY KEY (id, slip_date)")
+        op.execute(
+            "ALTER TABLE slips ADD CONSTRAINT uq_slips_slip_number_slip_date UNIQUE (slip_number, slip_date)"
+        )
+        op.execute("ALTER TABLE slip_details ADD PRIMARY KEY (id, slip_date)")
+        op.execute(
+            "ALTER TABLE slip_details ADD FOREIGN KEY (slip_id, slip_date) REFERENCES slips (id, slip_date)"
+        )
+    else:
+        op.execute("ALTER TABLE slips ADD PRIMARY KEY (id)")
+        op.execute("ALTER TABLE slips ADD UNIQUE (slip_number)")
+        op.execute("ALTER TABLE slip_details ADD PRIMARY KEY (id)")
+        op.execute("ALTER TABLE slip_details ADD FOREIGN KEY (slip_id) REFERENCES slips (id)")
+    op.execute("ALTER TABLE slips ADD FOREIGN KEY (client_id) REFERENCES clients (id)")
+    op.execute("ALTER TABLE slips ADD FOREIGN KEY (salesman_id) REFERENCES salesman (id)")
+    op.execute("ALTER TABLE slip_details ADD FOREIGN KEY (product_id) REFERENCES products (id)")
+    for statement in SLIP_INDEXES + DETAIL_INDEXES:
+        op.execute(statement)
+    op.execute("ANALYZE slips")
+    op.execute("ANALYZE slip_details")
+
+
+def upgrade():
+    _rebuild(partitioned=True)
+
+
+def downgrade():
+    # Archived months stay in slip_archive
+    _rebuild(partitioned=False)
@@ -0,0 +1,43 @@
+"""slip_numbers registry keeping slip numbers unique
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18
+
+0004 had to narrow the unique key on slips.slip_number to (slip_number,
+slip_date), as slips is partitioned by month. Numbers are unique again through
+slip_numbers, one row per number handed out, which every slip references with
+a foreign key checked at commit. Existing numbers, archived ones included, are
+registered first; a number that is already on two slips is registered once
+and both slips keep it, find them with
+
+    SELECT slip_number FROM slips GROUP BY slip_number HAVING count(*) > 1
+"""
+from alembic import op
+
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute("CREATE TABLE IF NOT EXISTS slip_numbers (slip_number varchar PRIMARY KEY)")
+    op.execute(
+        "INSERT INTO slip_numbers (slip_number) "
+        "SELECT slip_number FROM slips UNION SELECT slip_number FROM slip_archive "
+        "ON CONFLICT DO NOTHING"
+    )
+    op.execute(
+        "ALTER TABLE slips ADD CONSTRAINT fk_slips_slip_number FOREIGN KEY (slip_number) "
+        "REFERENCES slip_numbers (slip_number) DEFERRABLE INITIALLY DEFERRED"
+    )
+    op.execute("ALTER TABLE slips DROP CONSTRAINT IF EXISTS uq_slips_slip_number_slip_date")
+
+
+def downgrade():
+    op.execute(
+        "ALTER TABLE slips ADD CONSTRAINT uq_slips_slip_number_slip_date UNIQUE (slip_number, slip_date)"
+    )
+    op.execute("ALTER TABLE slips DROP CONSTRAINT IF EXISTS fk_slips_slip_number")
+    op.execute("DROP TABLE IF EXISTS slip_numbers")
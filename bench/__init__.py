@@ -0,0 +1,7 @@
+"""
+Performance tooling for archie, run against a local throwaway database.
+
+    python -m bench.seed  --reset        # synthetic dataset
+    python -m bench.plans                # query plan regression check
+    python -m bench.load                 # mixed load against a running server
+"""
@@ -0,0 +1,303 @@
+"""
+Mixed-workload load driver.
+
+Runs weighted scenarios against a running server for a fixed time with N
+concurrent virtual users, then reports p50/p95/p99 latency, throughput,
+errors and SQL statements per request for each of them. Statement counts come
+from the server's /metrics before and after the run, so run the server with a
+single worker for exact numbers:
+
+    python -m bench.seed --reset
+    DB_PROFILE=bench uvicorn main:app --workers 1
+    python -m bench.load --duration 60 --concurrency 32
+    python -m bench.load --save-baseline        # store as bench/baseline.json
+    python -m bench.load --baseline bench/baseline.json   # diff, exit 1 on regression
+
+Needs httpx.
+"""
+import argparse
+import asyncio
+import json
+import random
+import re
+import time
+from datetime import date, timedelta
+
+import httpx
+
+DEFAULT_BASELINE = "bench/baseline.json"
+METRIC_LINE = re.compile(r'^http_request_sql_statements_(sum|count)\{(.*)\} (\S+)$')
+LABEL = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+
+
+class Scenario:
+    def __init__(self, name: str, weight: int, method: str, route: str, run):
+        self.name = name
+        self.weight = weight
+        self.method = method
+        self.route = route  # route template as labelled in /metrics
+        self.run = run
+        self.latencies = []
+        self.errors = 0
+
+
+class Workload:
+    """
+    Ids to pick from, sampled from the server before the run, plus what the
+    run itself creates (payments to update and delete).
+    """
+
+    def __init__(self, client: httpx.AsyncClient, clients, products, salesmen):
+        self.client = client
+        self.clients = clients
+        self.products = products
+        self.salesmen = salesmen
+        self.payments = []
+
+    def slip_body(self):
+        slip_date = date.today() - timedelta(days=random.randint(0, 30))
+        details = []
+        for product in random.sample(self.products, k=min(len(self.products), random.randint(1, 5))):
+            quantity = random.randint(1, 20)
+            rate = product.get("rate") or 100.0
+            details.append({
+                "product_id": product["id"],
+                "weight": product.get("weight"),
+                "quantity": quantity,
+                "rate": rate,
+                "amount": round(quantity * rate, 2),
+                "slip_date": slip_date.isoformat(),
+            })
+        return {
+            "slip_number": "",
+            "client_id": random.choice(self.clients)["id"],
+            "salesman_id": random.choice(self.salesmen)["id"],
+            "slip_date": slip_date.isoformat(),
+            "vehicle_number": f"MH 12 AB {random.randint(1000, 1299)}",
+            "total_amount": round(sum(detail["amount"] for detail in details), 2),
+            "slip_details": details,
+        }
+
+    async def create_slip(self):
+        return await self.client.post("/slips/", json=self.slip_body())
+
+    async def list_slips(self):
+        params = {"limit": 50}
+        if random.random() < 0.3:
+            params["client_id"] = random.choice(self.clients)["id"]
+        return await self.client.get("/slips/", params=params)
+
+    async def create_payment(self):
+        response = await self.client.post("/payments/", json={
+            "client_id": random.choice(self.clients)["id"],
+            "amount": round(random.uniform(100, 5000), 2),
+            "notes": "bench",
+        })
+        if response.status_code == 200:
+            self.payments.append(response.json()["id"])
+        return response
+
+    async def update_payment(self):
+        if not self.payments:
+            return await self.create_payment()
+        payment_id = random.choice(self.payments)
+        return await self.client.put(f"/payments/{payment_id}", json={
+            "client_id": random.choice(self.clients)["id"],
+            "amount": round(random.uniform(100, 5000), 2),
+            "notes": "bench update",
+        })
+
+    async def delete_payment(self):
+        if not self.payments:
+            return await self.create_payment()
+        payment_id = self.payments.pop(random.randrange(len(self.payments)))
+        return await self.client.delete(f"/payments/{payment_id}")
+
+    async def list_payments(self):
+        return await self.client.get("/payments/", params={"limit": 100})
+
+    async def list_clients(self):
+        return await self.client.get("/clients/")
+
+    async def list_products(self):
+        return await self.client.get("/products/")
+
+    async def client_balance(self):
+        return await self.client.get(f"/clients/{random.choice(self.clients)['id']}/balance")
+
+    async def client_statement(self):
+        return await self.client.get(f"/clients/{random.choice(self.clients)['id']}/statement", params={"limit": 100})
+
+    async def salesmen_report(self):
+        today = date.today()
+        return await self.client.get("/reports/salesmen", params={
+            "date_from": (today - timedelta(days=365)).isoformat(),
+            "date_to": today.isoformat(),
+            "group_by": "month",
+        })
+
+    async def search_clients(self):
+        name = random.choice(self.clients)["name"]
+        return await self.client.get("/search/clients", params={"q": name[:random.randint(1, len(name))]})
+
+
+def scenarios(workload: Workload):
+    return [
+        Scenario("create_slip", 20, "POST", "/slips/", workload.create_slip),
+        Scenario("list_slips", 25, "GET", "/slips/", workload.list_slips),
+        Scenario("create_payment", 8, "POST", "/payments/", workload.create_payment),
+        Scenario("update_payment", 4, "PUT", "/payments/{payment_id}", workload.update_payment),
+        Scenario("delete_payment", 2, "DELETE", "/payments/{payment_id}", workload.delete_payment),
+        Scenario("list_payments", 8, "GET", "/payments/", workload.list_payments),
+        Scenario("list_clients", 5, "GET", "/clients/", workload.list_clients),
+        Scenario("list_products", 5, "GET", "/products/", workload.list_products),
+        Scenario("client_balance", 5, "GET", "/clients/{client_id}/balance", workload.client_balance),
+        Scenario("client_statement", 4, "GET", "/clients/{client_id}/statement", workload.client_statement),
+        Scenario("salesmen_report", 2, "GET", "/reports/salesmen", workload.salesmen_report),
+        Scenario("search_clients", 12, "GET", "/search/{kind}", workload.search_clients),
+    ]
+
+
+async def sql_statements(client: httpx.AsyncClient) -> dict:
+    """
+    {(method, route): [statements sum, request count]} from /metrics.
+    """
+    totals = {}
+    response = await client.get("/metrics")
+    response.raise_for_status()
+    for line in response.text.splitlines():
+        match = METRIC_LINE.match(line)
+        if not match:
+            continue
+        kind, labels, value = match.groups()
+        labels = dict(LABEL.findall(labels))
+        entry = totals.setdefault((labels["method"], labels["route"]), [0.0, 0.0])
+        entry[0 if kind == "sum" else 1] += float(value)
+    return totals
+
+
+async def user(deadline: float, pool, weights):
+    while time.perf_counter() < deadline:
+        scenario = random.choices(pool, weights=weights)[0]
+        start = time.perf_counter()
+        try:
+            response = await scenario.run()
+            failed = response.status_code >= 400
+        except httpx.HTTPError:
+            failed = True
+        scenario.latencies.append(time.perf_counter() - start)
+        scenario.errors += failed
+
+
+def percentile(values, fraction: float) -> float:
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+async def run(args) -> dict:
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=30, limits=limits) as client:
+        samples = []
+        for path in ("/clients/", "/products/", "/salesmen/"):
+            response = await client.get(path)
+            response.raise_for_status()
+            rows = response.json()
+            if not rows:
+                raise SystemExit(f"{path} is empty, seed the database first (python -m bench.seed)")
+            samples.append(rows)
+        workload = Workload(client, *samples)
+        pool = scenarios(workload)
+        weights = [scenario.weight for scenario in pool]
+
+        before = await sql_statements(client)
+        start = time.perf_counter()
+        deadline = start + args.duration
+        await asyncio.gather(*(user(deadline, pool, weights) for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - start
+        after = await sql_statements(client)
+
+    results = {}
+    for scenario in pool:
+        key = (scenario.method, scenario.route)
+        statements, requests = after.get(key, [0.0, 0.0])
+        statements -= before.get(key, [0.0, 0.0])[0]
+        requests -= before.get(key, [0.0, 0.0])[1]
+        results[scenario.name] = {
+            "requests": len(scenario.latencies),
+            "errors": scenario.errors,
+            "rps": round(len(scenario.latencies) / elapsed, 2),
+            "p50_ms": round(percentile(scenario.latencies, 0.50) * 1000, 2),
+            "p95_ms": round(percentile(scenario.latencies, 0.95) * 1000, 2),
+            "p99_ms": round(percentile(scenario.latencies, 0.99) * 1000, 2),
+            # Scenarios sharing a route template (update/delete payment) share this figure
+            "sql_per_request": round(statements / requests, 2) if requests else None,
+        }
+    results["total"] = {
+        "requests": sum(result["requests"] for result in results.values()),
+        "errors": sum(result["errors"] for result in results.values()),
+        "rps": round(sum(len(scenario.latencies) for scenario in pool) / elapsed, 2),
+    }
+    return results
+
+
+def report(results: dict, baseline: dict | None, threshold: float) -> int:
+    """
+    Prints the results (against baseline if given); returns how many p95,
+    throughput or SQL-per-request figures are more than threshold percent worse.
+    """
+    regressions = 0
+    header = f"{'scenario':18} {'req':>7} {'err':>5} {'rps':>8} {'p50':>9} {'p95':>9} {'p99':>9} {'sql/req':>8}"
+    print(header)
+    print("-" * len(header))
+    for name, result in results.items():
+        if name == "total":
+            continue
+        line = (f"{name:18} {result['requests']:7} {result['errors']:5} {result['rps']:8.1f} "
+                f"{result['p50_ms']:9.2f} {result['p95_ms']:9.2f} {result['p99_ms']:9.2f} "
+                f"{result['sql_per_request'] if result['sql_per_request'] is not None else '-':>8}")
+        old = (baseline or {}).get(name)
+        if old:
+            notes = []
+            for key, higher_is_worse in (("p95_ms", True), ("rps", False), ("sql_per_request", True)):
+                if old.get(key) and result.get(key) is not None:
+                    change = (result[key] - old[key]) / old[key] * 100
+                    mark = " !" if (change if higher_is_worse else -change) > threshold else ""
+                    regressions += bool(mark)
+                    notes.append(f"{key} {change:+.1f}%{mark}")
+            line += "   " + ", ".join(notes)
+        print(line)
+    total = results["total"]
+    print(f"\n{total['requests']} requests, {total['errors']} errors, {total['rps']:.1f} req/s")
+    return regressions
+
+
+async def _main(args):
+    results = await run(args)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    regressions = report(results, baseline, args.threshold)
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print(f"baseline written to {args.save_baseline}")
+    if regressions:
+        print(f"{regressions} regressions over {args.threshold}%")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Drive a mixed workload against a running server")
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--duration", type=float, default=30, help="seconds")
+    parser.add_argument("--concurrency", type=int, default=16, help="virtual users")
+    parser.add_argument("--seed", type=int, default=None, help="random seed for a repeatable mix")
+    parser.add_argument("--baseline", help="compare against this results file")
+    parser.add_argument("--save-baseline", nargs="?", const=DEFAULT_BASELINE, help="write results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=10.0, help="percent worse that counts as a regression")
+    args = parser.parse_args()
+    random.seed(args.seed)
+    raise SystemExit(asyncio.run(_main(args)))
@@ -0,0 +1,172 @@
+"""
+Query plan regression check.
+
+Runs EXPLAIN on the queries behind each endpoint against a seeded database
+(see bench.seed) and fails if any of them reads one of the big tables with a
+sequential scan instead of an index. Exits non-zero on failure so it can gate
+CI next to the migrations. Scans of a partition (slips_y2026m10, see
+partitions.py) count as scans of its parent table.
+
+    python -m bench.seed --reset
+    python -m bench.plans
+"""
+import argparse
+import asyncio
+import json
+
+from sqlalchemy import select, func, tuple_, text
+from sqlalchemy.dialects import postgresql
+
+from database import engine
+from ledger import balances_query, statement_query
+from models import Slip, Payment, Clients
+from routers.slips import filter_slips
+from slip_json import slip_page_query, details_query
+
+PAGE = 51  # default GET /slips/ limit + 1
+INDEX_NODES = {"Index Scan", "Index Only Scan", "Bitmap Heap Scan"}
+
+
+def slip_page(**filters):
+    query = filter_slips(slip_page_query(), **filters)
+    return query.order_by(Slip.slip_date.desc(), Slip.id.desc()).limit(PAGE)
+
+
+def plan_checks(sample):
+    """
+    (endpoint, query, tables that must be read through an index)
+    """
+    deep_cursor = tuple_(Slip.slip_date, Slip.id) < tuple_(sample["mid_date"], sample["mid_id"])
+    return [
+        ("GET /slips/", slip_page(), {"slips"}),
+        ("GET /slips/ deep page", slip_page().where(deep_cursor), {"slips"}),
+        ("GET /slips/?client_id", slip_page(client_id=sample["client_id"]), {"slips"}),
+        ("GET /slips/?salesman_id", slip_page(salesman_id=sample["salesman_id"]), {"slips"}),
+        ("GET /slips/?vehicle_number", slip_page(vehicle_number=sample["vehicle_number"]), {"slips"}),
+        ("GET /slips/?date range", slip_page(date_from=sample["mid_date"], date_to=sample["mid_date"]), {"slips"}),
+        ("GET /slips/ details", details_query(sample["page_ids"]), {"slip_details"}),
+        ("GET /payments/", select(Payment).order_by(Payment.id.desc()).limit(100), {"payments"}),
+        ("GET /clients/{id}/balance", balances_query().where(Clients.id == sample["client_id"]), {"client_balances"}),
+        ("GET /clients/{id}/statement", statement_query(sample["client_id"], limit=PAGE), {"slips", "payments"}),
+    ]
+
+
+async def load_sample(conn):
+    """
+    Realistic parameter values taken from the data itself.
+    """
+    row = (await conn.execute(
+        select(Slip.id, Slip.slip_date, Slip.client_id, Slip.salesman_id, Slip.vehicle_number)
+        .order_by(Slip.id)
+        .offset(select(func.count()).select_from(Slip).scalar_subquery() / 2)
+        .limit(1)
+    )).one()
+    page_ids = (await conn.execute(select(Slip.id).order_by(Slip.id.desc()).limit(PAGE))).scalars().all()
+    return {
+        "mid_id": row.id,
+        "mid_date": row.slip_date,
+        "client_id": row.client_id,
+        "salesman_id": row.salesman_id,
+        "vehicle_number": row.vehicle_number,
+        "page_ids": list(page_ids),
+    }
+
+
+def plan_nodes(node):
+    yield node
+    for child in node.get("Plans", ()):
+        yield from plan_nodes(child)
+
+
+async def explain(conn, query):
+    sql = str(query.compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}))
+    raw = (await conn.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {sql}")).scalar_one()
+    plan = json.loads(raw) if isinstance(raw, str) else raw
+    return plan[0]["Plan"]
+
+
+async def load_parents(conn) -> dict:
+    """
+    {partition: parent table} for every partition in the database.
+    """
+    result = await conn.execute(text(
+        "SELECT child.relname, parent.relname FROM pg_inherits "
+        "JOIN pg_class AS child ON child.oid = pg_inherits.inhrelid "
+        "JOIN pg_class AS parent ON parent.oid = pg_inherits.inhparent"
+    ))
+    return dict(result.all())
+
+
+def problems(plan, tables, parents=None):
+    """
+    What is wrong with how plan reads tables; parents maps partitions to
+    their table (load_parents).
+    """
+    parents = parents or {}
+    nodes = list(plan_nodes(plan))
+    found = []
+    for table in sorted(tables):
+        scans = {
+            node["Node Type"] for node in nodes
+            if parents.get(node.get("Relation Name"), node.get("Relation Name")) == table
+        }
+        if "Seq Scan" in scans:
+            found.append(f"sequential scan on {table}")
+        elif not scans & INDEX_NODES:
+            found.append(f"no index access on {table}")
+    return found
+
+
+def partitioned_plan(*scans):
+    """
+    A month-partitioned GET /slips/ plan, one (node type, partition) per partition.
+    """
+    partitions = [{"Node Type": node, "Relation Name": name} for node, name in scans]
+    return {"Node Type": "Limit", "Plans": [{"Node Type": "Merge Append", "Plans": partitions}]}
+
+
+PARTITION_PARENTS = {"slips_y2026m10": "slips", "slips_y2026m09": "slips"}
+
+
+def self_check() -> list[str]:
+    """
+    problems() against canned partitioned plans, so a matcher that stops
+    seeing partitions fails loudly instead of passing everything.
+    """
+    cases = [
+        (partitioned_plan(("Index Scan", "slips_y2026m10"), ("Index Scan", "slips_y2026m09")), []),
+        (partitioned_plan(("Index Scan", "slips_y2026m10"), ("Seq Scan", "slips_y2026m09")), ["sequential scan on slips"]),
+    ]
+    return [
+        f"problems() gave {got} for a partitioned plan, expected {expected}"
+        for plan, expected in cases
+        if (got := problems(plan, {"slips"}, PARTITION_PARENTS)) != expected
+    ]
+
+
+async def run(verbose: bool = False) -> int:
+    broken = self_check()
+    for message in broken:
+        print(f"FAIL self check: {message}")
+    if broken:
+        return 1
+    failures = 0
+    async with engine.connect() as conn:
+        sample = await load_sample(conn)
+        parents = await load_parents(conn)
+        for endpoint, query, tables in plan_checks(sample):
+            plan = await explain(conn, query)
+            found = problems(plan, tables, parents)
+            status = "FAIL" if found else "ok"
+            print(f"{status:4} {endpoint}" + (f": {', '.join(found)}" if found else ""))
+            if verbose or found:
+                print(json.dumps(plan, indent=2, default=str))
+            failures += bool(found)
+    print(f"{failures} of {len(plan_checks(sample))} plan checks failed")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Assert endpoint queries use indexes")
+    parser.add_argument("--verbose", action="store_true", help="print every plan")
+    raise SystemExit(asyncio.run(run(parser.parse_args().verbose)))
@@ -0,0 +1,170 @@
+"""
+Synthetic dataset for benchmarks and plan checks.
+
+Everything is generated server side with generate_series, so a few million
+rows load in seconds. Point DATABASE_URL at a local database first: --reset
+truncates every table.
+
+    python -m bench.seed --reset --slips 200000 --details-per-slip 3
+"""
+import argparse
+import asyncio
+from dataclasses import dataclass
+from datetime import date, timedelta
+
+from sqlalchemy import text
+
+from database import engine, AsyncSessionLocal
+from ledger import rebuild_balances
+from rollups import rebuild_rollups
+from models import Base
+from partitions import create_month, lock_partitions, month_start, next_month
+
+
+@dataclass
+class Volumes:
+    clients: int = 2000
+    products: int = 200
+    salesmen: int = 50
+    slips: int = 200_000
+    details_per_slip: int = 3
+    payments: int = 100_000
+    vehicles: int = 300
+    start: date = date(2023, 1, 1)
+    days: int = 3 * 365
+
+
+STATEMENTS = [
+    """
+    INSERT INTO clients (name, phone, address)
+    SELECT 'Client ' || i, 'bench-c-' || i, 'Street ' || i
+    FROM generate_series(1, :clients) AS i
+    """,
+    """
+    INSERT INTO salesman (name, commission, phone)
+    SELECT 'Salesman ' || i, round((random() * 5)::numeric, 2), 'bench-s-' || i
+    FROM generate_series(1, :salesmen) AS i
+    """,
+    """
+    INSERT INTO products (name, weight, rate)
+    SELECT 'Product ' || i, round((1 + random() * 49)::numeric, 2), round((10 + random() * 490)::numeric, 2)
+    FROM generate_series(1, :products) AS i
+    """,
+    # Slip numbers keep the YYMMnnn shape, numbered per month in date order
+    """
+    WITH c AS (SELECT array_agg(id) AS ids FROM clients),
+         s AS (SELECT array_agg(id) AS ids FROM salesman),
+         gen AS (
+             SELECT i, CAST(:start AS date) + floor(random() * :days)::int AS d
+             FROM generate_series(1, :slips) AS i
+         ),
+         numbered AS (
+             SELECT d, (row_number() OVER (PARTITION BY date_trunc('month', d) ORDER BY d, i))::text AS seq
+             FROM gen
+         )
+    INSERT INTO slips (slip_number, client_id, salesman_id, slip_date, vehicle_number, total_amount)
+    SELECT to_char(d, 'YYMM') || lpad(seq, greatest(3, length(seq)), '0'),
+           c.ids[1 + floor(random() * array_length(c.ids, 1))::int],
+           s.ids[1 + floor(random() * array_length(s.ids, 1))::int],
+           d,
+           'VH-' || (1 + floor(random() * :vehicles))::int,
+           0
+    FROM numbered, c, s
+    """,
+    "INSERT INTO slip_numbers (slip_number) SELECT slip_number FROM slips",
+    """
+    WITH p AS (SELECT array_agg(id) AS ids FROM products)
+    INSERT INTO slip_details (slip_id, product_id, weight, quantity, rate, amount, slip_date)
+    SELECT sl.id, line.product_id, line.weight, line.quantity, line.rate, round((line.quantity * line.rate)::numeric, 2), sl.slip_date
+    FROM slips AS sl
+    CROSS JOIN generate_series(1, :details_per_slip) AS n
+    CROSS JOIN p
+    CROSS JOIN LATERAL (
+        SELECT p.ids[1 + floor(random() * array_length(p.ids, 1))::int] AS product_id,
+               round((random() * 100)::numeric, 2) AS weight,
+               (1 + floor(random() * 20)) AS quantity,
+               round((10 + random() * 490)::numeric, 2) AS rate
+        WHERE n > 0
+    ) AS line
+    """,
+    """
+    UPDATE slips SET total_amount = t.total
+    FROM (SELECT slip_id, slip_date, sum(amount) AS total FROM slip_details GROUP BY slip_id, slip_date) AS t
+    WHERE slips.id = t.slip_id AND slips.slip_date = t.slip_date
+    """,
+    """
+    WITH c AS (SELECT array_agg(id) AS ids FROM clients)
+    INSERT INTO payments (client_id, amount, notes, date)
+    SELECT c.ids[1 + floor(random() * array_length(c.ids, 1))::int],
+           round((100 + random() * 20000)::numeric, 2),
+           'bench',
+           CAST(:start AS date) + floor(random() * :days)::int
+    FROM generate_series(1, :payments) AS i, c
+    """,
+    # Let the allocator carry on after the seeded numbers
+    """
+    INSERT INTO slip_sequences (year2, month2, last_seq)
+    SELECT to_char(slip_date, 'YY'), to_char(slip_date, 'MM'), count(*)
+    FROM slips GROUP BY 1, 2
+    ON CONFLICT (year2, month2) DO UPDATE SET last_seq = excluded.last_seq
+    """,
+]
+
+
+async def reset():
+    async with engine.begin() as conn:
+        # A fresh database has nothing to truncate yet
+        await conn.run_sync(Base.metadata.create_all)
+        tables = ", ".join(table.name for table in Base.metadata.sorted_tables)
+        await conn.execute(text(f"TRUNCATE {tables} RESTART IDENTITY CASCADE"))
+
+
+async def seed(volumes: Volumes):
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await lock_partitions(conn)
+        month, end = month_start(volumes.start), volumes.start + timedelta(days=volumes.days)
+        while month <= end:
+            await create_month(conn, month)
+            month = next_month(month)
+        params = vars(volumes)
+        for statement in STATEMENTS:
+            stmt = text(statement)
+            await conn.execute(stmt, {key: params[key] for key in stmt.compile().params})
+
+    async with AsyncSessionLocal() as session:
+        await rebuild_balances(session)
+    async with AsyncSessionLocal() as session:
+        await rebuild_rollups(session)
+
+    # Fresh statistics and visibility map, otherwise plans are guesswork
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        await conn.execute(text("VACUUM ANALYZE"))
+
+
+def volume_arguments(parser: argparse.ArgumentParser):
+    defaults = Volumes()
+    for name in ("clients", "products", "salesmen", "slips", "details_per_slip", "payments", "vehicles"):
+        parser.add_argument(f"--{name.replace('_', '-')}", type=int, default=getattr(defaults, name))
+
+
+def volumes_from(args) -> Volumes:
+    return Volumes(**{
+        name: getattr(args, name)
+        for name in ("clients", "products", "salesmen", "slips", "details_per_slip", "payments", "vehicles")
+    })
+
+
+async def _main(args):
+    if args.reset:
+        await reset()
+    await seed(volumes_from(args))
+    print(f"seeded {args.slips} slips x {args.details_per_slip} details, {args.payments} payments")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Seed a local database with synthetic data")
+    parser.add_argument("--reset", action="store_true", help="truncate every table first")
+    volume_arguments(parser)
+    asyncio.run(_main(parser.parse_args()))
@@ -0,0 +1,108 @@
+"""
+Per-route SQL statement budgets.
+
+Every route declares the most statements one request may run:
+
+    @router.get("/{client_id}", response_model=ClientResponse)
+    @query_budget(2)
+    async def get_client(...):
+
+Statements are counted by the metrics.py cursor listener, dependencies
+(conditional's version lookup) included. A forgotten eager load that turns a
+list into one query per row shows up as a blown budget instead of a slow page.
+
+QUERY_BUDGET_MODE decides what happens:
+
+    warn   (default) log the request and the statements it ran on "archie.budget"
+    raise  raise QueryBudgetExceeded from the statement that went over, for tests
+    off    do nothing
+
+check_budgets() at startup complains (raise mode: refuses to start) about any
+route that has not declared a budget. query_budget(None) declares a route
+whose statement count is unbounded by design.
+"""
+import logging
+import os
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from metrics import RequestStats, current_stats, format_sql, request_end_hooks, api_routes
+
+QUERY_BUDGET_MODE = os.getenv("QUERY_BUDGET_MODE", "warn")
+UNBOUNDED = "unbounded"
+
+budget_log = logging.getLogger("archie.budget")
+
+if QUERY_BUDGET_MODE not in ("off", "warn", "raise"):
+    raise RuntimeError(f"Unknown QUERY_BUDGET_MODE {QUERY_BUDGET_MODE!r}, expected off, warn or raise")
+
+
+class QueryBudgetExceeded(RuntimeError):
+    pass
+
+
+def query_budget(statements: int | None):
+    """
+    Declares the route's budget. Goes below the route decorator, and leaves
+    the endpoint itself untouched.
+    """
+    def declare(endpoint):
+        endpoint.query_budget = UNBOUNDED if statements is None else statements
+        return endpoint
+    return declare
+
+
+def route_budget(stats: RequestStats):
+    route = stats.scope.get("route")
+    budget = getattr(getattr(route, "endpoint", None), "query_budget", None)
+    return None if budget == UNBOUNDED else budget
+
+
+def _describe(route, budget: int, stats: RequestStats) -> str:
+    methods = ",".join(sorted(getattr(route, "methods", None) or ()))
+    return (f"{methods} {getattr(route, 'path', '?')} ran {stats.statements} SQL statements, "
+            f"budget is {budget}:\n{format_sql(stats)}")
+
+
+# Registered after metrics' listener, so the statement is already counted
+@event.listens_for(Engine, "after_cursor_execute")
+def _enforce(conn, cursor, statement, parameters, context, executemany):
+    if QUERY_BUDGET_MODE != "raise":
+        return
+    stats = current_stats.get()
+    if stats is None:
+        return
+    budget = route_budget(stats)
+    if budget is not None and stats.statements > budget:
+        raise QueryBudgetExceeded(_describe(stats.scope.get("route"), budget, stats))
+
+
+def _warn(method: str, path: str, status: int, seconds: float, stats: RequestStats):
+    if QUERY_BUDGET_MODE != "warn":
+        return
+    budget = route_budget(stats)
+    if budget is not None and stats.statements > budget:
+        budget_log.warning(_describe(stats.scope.get("route"), budget, stats))
+
+
+request_end_hooks.append(_warn)
+
+
+def check_budgets(app):
+    """
+    Every API route must carry a query_budget. Call once all routes exist.
+    """
+    if QUERY_BUDGET_MODE == "off":
+        return
+    missing = [
+        f"{','.join(sorted(route.methods))} {route.path}"
+        for route in api_routes(app.routes)
+        if not hasattr(route.endpoint, "query_budget")
+    ]
+    if not missing:
+        return
+    message = "Routes without a query_budget: " + ", ".join(missing)
+    if QUERY_BUDGET_MODE == "raise":
+        raise RuntimeError(message)
+    budget_log.warning(message)
@@ -0,0 +1,65 @@
+"""
+Read-through cache for the reference lists (products, clients, salesmen).
+
+Entries are the finished JSON response bodies, so a hit costs neither SQL nor
+Pydantic. The write handlers invalidate through versions.mark_changed() after
+they commit; the name is also published on the pubsub channel so the other
+workers drop their copy.
+"""
+from fastapi import Response
+from pydantic import TypeAdapter
+
+from database import AsyncSessionLocal
+from pubsub import pubsub, RESYNC
+
+CACHE_CHANNEL = "archie_cache"
+
+
+class ReferenceCache:
+    def __init__(self):
+        self._entries = {}  # name -> response bytes
+        self._generations = {}  # name -> bumped on every invalidation
+
+    async def get(self, name: str, loader) -> bytes:
+        body = self._entries.get(name)
+        if body is not None:
+            return body
+        generation = self._generations.get(name, 0)
+        body = await loader()
+        # An invalidation that raced the load means body may already be stale
+        if self._generations.get(name, 0) == generation:
+            self._entries[name] = body
+        return body
+
+    def drop(self, name: str):
+        names = set(self._entries) | set(self._generations) if name == RESYNC else {name}
+        for key in names:
+            self._generations[key] = self._generations.get(key, 0) + 1
+            self._entries.pop(key, None)
+
+    async def invalidate(self, name: str):
+        self.drop(name)
+        await pubsub.publish(CACHE_CHANNEL, name)
+
+
+reference_cache = ReferenceCache()
+pubsub.subscribe(CACHE_CHANNEL, reference_cache.drop)
+
+
+def list_adapter(schema):
+    return TypeAdapter(list[schema])
+
+
+async def cached_list_response(name: str, query, adapter) -> Response:
+    """
+    Returns the cached body for name, loading it with query on a miss.
+    Misses always load from the primary; a lagging replica could otherwise
+    put pre-write data back into the cache right after an invalidation.
+    """
+    async def load():
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(query)
+        rows = adapter.validate_python(result.scalars().all(), from_attributes=True)
+        return adapter.dump_json(rows)
+
+    return Response(content=await reference_cache.get(name, load), media_type="application/json")
@@ -0,0 +1,185 @@
+"""
+Slip validation and pricing against a hot in-memory catalog.
+
+Slip creation runs every slip through prepare_slips() before its transaction
+starts. A slip that points at a missing client, salesman or product is turned
+away there, before a slip number is allocated or the slip_sequences row is
+locked, instead of failing on a foreign key at flush time.
+
+The catalog holds the client and salesman ids and every product's rate. It is
+loaded from the primary in one query on first use and dropped per table when
+versions.mark_changed() invalidates the reference cache; it listens on the
+same pubsub channel, so every worker follows. Ids the catalog does not know
+are looked up in one query before a slip is rejected, so a row created a
+moment ago on another worker is never refused.
+
+SLIP_RATE_POLICY decides what happens to the figures the client sent:
+
+    reject (default)  store them as sent, but turn the slip away (400) when a
+                      line's amount is not quantity * rate or total_amount is
+                      not the amounts plus transport_charges, naming the figure
+    recompute         overwrite amount and total_amount with those sums
+    catalog           the same, with the product's own rate where it has one
+    trust             store the figures as sent; ids are still checked
+
+recompute and catalog change what the client sent without telling it; the
+response carries the stored figures.
+"""
+import asyncio
+import os
+
+from sqlalchemy import select, literal, union_all, Float
+
+from cache import CACHE_CHANNEL
+from database import AsyncSessionLocal
+from models import Clients, Product, Salesman
+from pubsub import pubsub, RESYNC
+
+SLIP_RATE_POLICY = os.getenv("SLIP_RATE_POLICY", "reject")
+PRICE_TOLERANCE = 0.005  # figures are kept to the paisa
+
+if SLIP_RATE_POLICY not in ("reject", "recompute", "catalog", "trust"):
+    raise RuntimeError(
+        f"Unknown SLIP_RATE_POLICY {SLIP_RATE_POLICY!r}, expected reject, recompute, catalog or trust"
+    )
+
+# Status codes of prepare_slips() errors
+MISSING_REFERENCE = 422
+PRICE_MISMATCH = 400
+
+# table -> (model, value kept per id)
+SOURCES = {
+    "clients": (Clients, literal(None, Float)),
+    "salesman": (Salesman, literal(None, Float)),
+    "products": (Product, Product.rate),
+}
+
+
+async def load_catalog(ids: dict) -> dict:
+    """
+    {table: {id: value}} for {table: ids to look for, or None for all}, in one query.
+    """
+    branches = []
+    for table, wanted in ids.items():
+        model, value = SOURCES[table]
+        branch = select(literal(table).label("source"), model.id, value.label("value"))
+        if wanted is not None:
+            branch = branch.where(model.id.in_(wanted))
+        branches.append(branch)
+    found = {table: {} for table in ids}
+    async with AsyncSessionLocal() as session:
+        for table, row_id, value in (await session.execute(union_all(*branches))).all():
+            found[table][row_id] = value
+    return found
+
+
+class Catalog:
+    def __init__(self):
+        self._tables = {}  # table -> {id: value}
+        self._generations = {}  # table -> bumped on every drop
+        self._lock = asyncio.Lock()
+
+    def drop(self, name: str):
+        names = set(SOURCES) if name == RESYNC else {name} & set(SOURCES)
+        for table in names:
+            self._generations[table] = self._generations.get(table, 0) + 1
+            self._tables.pop(table, None)
+
+    async def tables(self) -> dict:
+        """
+        Every table's {id: value}, loading the ones that were dropped.
+        """
+        # Copies, a drop while the caller awaits must not pull a table from under it
+        if len(self._tables) == len(SOURCES):
+            return dict(self._tables)
+        async with self._lock:
+            missing = [table for table in SOURCES if table not in self._tables]
+            if not missing:
+                return dict(self._tables)
+            generations = {table: self._generations.get(table, 0) for table in missing}
+            loaded = await load_catalog({table: None for table in missing})
+            for table in missing:
+                # A drop that raced the load means it may already be stale; use it once, don't keep it
+                if self._generations.get(table, 0) == generations[table]:
+                    self._tables[table] = loaded[table]
+            return {**self._tables, **loaded}
+
+
+catalog = Catalog()
+pubsub.subscribe(CACHE_CHANNEL, catalog.drop)
+
+
+def price_slip(slip, rates: dict):
+    """
+    The slip (SlipCreate) with its amounts and total worked out per
+    SLIP_RATE_POLICY; rates is {product_id: catalog rate}.
+    """
+    if SLIP_RATE_POLICY in ("trust", "reject"):
+        return slip
+    details = []
+    total = slip.transport_charges or 0.0
+    for detail in slip.slip_details:
+        rate = detail.rate
+        if SLIP_RATE_POLICY == "catalog" and rates.get(detail.product_id) is not None:
+            rate = rates[detail.product_id]
+        amount = round(detail.quantity * rate, 2)
+        total += amount + (detail.transport_charges or 0.0)
+        details.append(detail.model_copy(update={"rate": rate, "amount": amount}))
+    return slip.model_copy(update={"slip_details": details, "total_amount": round(total, 2)})
+
+
+def price_mismatch(slip):
+    """
+    What is wrong with the slip's figures (SlipCreate), or None when every
+    amount is quantity * rate and total_amount adds up.
+    """
+    total = slip.transport_charges or 0.0
+    for index, detail in enumerate(slip.slip_details):
+        amount = round(detail.quantity * detail.rate, 2)
+        if abs(detail.amount - amount) > PRICE_TOLERANCE:
+            return f"slip_details[{index}].amount is {detail.amount}, quantity * rate is {amount}"
+        total += detail.amount + (detail.transport_charges or 0.0)
+    total = round(total, 2)
+    if abs(slip.total_amount - total) > PRICE_TOLERANCE:
+        return f"total_amount is {slip.total_amount}, the amounts and transport charges add up to {total}"
+    return None
+
+
+async def prepare_slips(slips: list):
+    """
+    Checks and prices a batch of SlipCreate before any transaction. Returns
+    ({index: (status code, error)} for the slips that reference something
+    missing (MISSING_REFERENCE) or whose figures don't add up under the reject
+    policy (PRICE_MISMATCH), [priced slip, or None where there is an error]).
+    """
+    tables = await catalog.tables()
+    wanted = {
+        "clients": {slip.client_id for slip in slips},
+        "salesman": {slip.salesman_id for slip in slips},
+        "products": {detail.product_id for slip in slips for detail in slip.slip_details},
+    }
+    unknown = {table: ids - tables[table].keys() for table, ids in wanted.items()}
+    unknown = {table: ids for table, ids in unknown.items() if ids}
+    found = await load_catalog(unknown) if unknown else {}
+
+    def known(table: str, row_id: int) -> bool:
+        return row_id in tables[table] or row_id in found.get(table, ())
+
+    rates = tables["products"]
+    if found.get("products"):
+        rates = {**rates, **found["products"]}
+
+    errors = {}
+    priced = []
+    for index, slip in enumerate(slips):
+        missing = [d.product_id for d in slip.slip_details if not known("products", d.product_id)]
+        if not known("clients", slip.client_id):
+            errors[index] = (MISSING_REFERENCE, f"Client {slip.client_id} not found")
+        elif not known("salesman", slip.salesman_id):
+            errors[index] = (MISSING_REFERENCE, f"Salesman {slip.salesman_id} not found")
+        elif missing:
+            errors[index] = (MISSING_REFERENCE, f"Product {missing[0]} not found")
+        elif SLIP_RATE_POLICY == "reject" and (mismatch := price_mismatch(slip)):
+            errors[index] = (PRICE_MISMATCH, mismatch)
+        priced.append(None if index in errors else price_slip(slip, rates))
+    return errors, priced
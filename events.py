@@ -0,0 +1,141 @@
+"""
+Live events for dashboards (/ws/events and /events/stream).
+
+Write handlers call publish_events() after their commit with compact dicts
+such as {"type": "slip.created", "id": ..., "client_id": ..., ...}. They go
+out on EVENTS_CHANNEL, so every uvicorn worker hears them through pubsub and
+hands them to its own subscribers.
+
+Each subscriber has a queue of at most EVENT_QUEUE_SIZE events. A consumer
+that falls that far behind is cut off with an "overflow" event instead of
+letting its backlog grow; it should reconnect and refetch. A pubsub RESYNC
+reaches every subscriber as a "resync" event for the same reason.
+"""
+import asyncio
+import json
+import os
+from typing import Optional
+
+from pubsub import pubsub, RESYNC
+
+EVENTS_CHANNEL = "archie_events"
+EVENT_QUEUE_SIZE = int(os.getenv("EVENT_QUEUE_SIZE", "100"))
+EVENT_MAX_SUBSCRIBERS = int(os.getenv("EVENT_MAX_SUBSCRIBERS", "500"))  # per worker
+EVENT_HEARTBEAT_SECONDS = 15
+NOTIFY_BATCH = 20  # events per notification, pg_notify payloads stop at 8000 bytes
+
+
+class Subscription:
+    def __init__(self, client_id: Optional[int] = None, salesman_id: Optional[int] = None):
+        self.client_id = client_id
+        self.salesman_id = salesman_id
+        self.queue = asyncio.Queue()  # bounded by offer()
+        self.closed = False
+
+    def wants(self, event: dict) -> bool:
+        if self.client_id is not None and self.client_id not in (
+            event.get("client_id"), event.get("previous_client_id")
+        ):
+            return False
+        if self.salesman_id is not None and event.get("salesman_id") != self.salesman_id:
+            return False
+        return True
+
+    def offer(self, event: dict):
+        if self.closed:
+            return
+        if self.queue.qsize() >= EVENT_QUEUE_SIZE:
+            self.close({"type": "overflow"})
+        else:
+            self.queue.put_nowait(event)
+
+    def close(self, last: dict | None = None):
+        """
+        Ends the subscription; last (if any) is the final event it gets.
+        """
+        self.closed = True
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        if last is not None:
+            self.queue.put_nowait(last)
+        self.queue.put_nowait(None)
+
+    async def next(self, timeout: float = EVENT_HEARTBEAT_SECONDS):
+        """
+        The next event, {} after timeout seconds of silence (send a heartbeat),
+        or None once the subscription is over.
+        """
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return {}
+
+
+class EventHub:
+    def __init__(self):
+        self._subscribers = set()
+
+    def subscribe(self, client_id: Optional[int] = None, salesman_id: Optional[int] = None) -> Subscription:
+        """
+        Raises OverflowError when this worker already has EVENT_MAX_SUBSCRIBERS.
+        """
+        if len(self._subscribers) >= EVENT_MAX_SUBSCRIBERS:
+            raise OverflowError("Too many event subscribers")
+        subscription = Subscription(client_id, salesman_id)
+        self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        self._subscribers.discard(subscription)
+
+    def receive(self, payload: str):
+        if payload == RESYNC:
+            events = [{"type": "resync"}]
+        else:
+            events = json.loads(payload)
+        for subscription in list(self._subscribers):
+            for event in events:
+                if event["type"] == "resync" or subscription.wants(event):
+                    subscription.offer(event)
+
+    def close_all(self):
+        for subscription in list(self._subscribers):
+            subscription.close()
+        self._subscribers.clear()
+
+
+event_hub = EventHub()
+pubsub.subscribe(EVENTS_CHANNEL, event_hub.receive)
+
+
+async def publish_events(*events: dict):
+    """
+    Broadcasts events to every worker's subscribers. Call after the commit.
+    """
+    for start in range(0, len(events), NOTIFY_BATCH):
+        batch = events[start:start + NOTIFY_BATCH]
+        await pubsub.publish(EVENTS_CHANNEL, json.dumps(batch, default=str, separators=(",", ":")))
+
+
+def slip_event(kind: str, slip_id: int, slip_number: str, slip) -> dict:
+    return {
+        "type": f"slip.{kind}",
+        "id": slip_id,
+        "slip_number": slip_number,
+        "client_id": slip.client_id,
+        "salesman_id": slip.salesman_id,
+        "slip_date": slip.slip_date,
+        "vehicle_number": slip.vehicle_number,
+        "total_amount": slip.total_amount,
+    }
+
+
+def payment_event(kind: str, payment: dict, previous_client_id: Optional[int] = None) -> dict:
+    event = {"type": f"payment.{kind}", "id": payment["id"], "client_id": payment["client_id"]}
+    if "amount" in payment:
+        event["amount"] = payment["amount"]
+    if "date" in payment:
+        event["date"] = payment["date"]
+    if previous_client_id is not None and previous_client_id != payment["client_id"]:
+        event["previous_client_id"] = previous_client_id
+    return event
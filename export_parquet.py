@@ -0,0 +1,282 @@
+"""
+Columnar export of sales data for analytics.
+
+Writes three datasets as Parquet, one file per month, in a Hive style layout
+that pandas, pyarrow, DuckDB and Spark read as a partitioned dataset:
+
+    exports/slips/month=2026-10/part-0.parquet          one row per slip
+    exports/slip_details/month=2026-10/part-0.parquet   one row per line, with
+                                                        slip, client, salesman
+                                                        and product names
+    exports/payments/month=2026-10/part-0.parquet
+    exports/manifest.json
+
+Runs are incremental: every month's row count and highest row_version (see
+sync.py) are compared with manifest.json and only months that differ are
+written again. Renaming a client or product does not touch the rows that
+mention it, use --full to refresh the names everywhere. Months archived out
+of slips (partitions.py) keep the files exported before.
+
+Rows are streamed from a server-side cursor in batches of EXPORT_BATCH_ROWS
+and written as Parquet row groups, so memory stays bounded by the batch, not
+the month. Files are written next to their final name and renamed into place.
+
+    python export_parquet.py run --out exports
+    python export_parquet.py run --out exports --dataset payments --full
+    python export_parquet.py status --out exports   # what a run would write
+
+Needs pyarrow, which the API itself does not.
+"""
+import argparse
+import asyncio
+import json
+import os
+from datetime import date, datetime, timezone
+
+from sqlalchemy import select, func, and_
+
+from database import read_sessionmaker
+from models import Slip, SlipDetail, Payment, Product, Clients, Salesman
+from partitions import next_month
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # only needed to write files
+    pa = pq = None
+
+EXPORT_BATCH_ROWS = int(os.getenv("EXPORT_BATCH_ROWS", "50000"))
+MANIFEST = "manifest.json"
+
+
+def _schemas():
+    return {
+        "slips": pa.schema([
+            ("id", pa.int32()),
+            ("slip_number", pa.string()),
+            ("slip_date", pa.date32()),
+            ("client_id", pa.int32()),
+            ("client_name", pa.string()),
+            ("salesman_id", pa.int32()),
+            ("salesman_name", pa.string()),
+            ("vehicle_number", pa.string()),
+            ("total_amount", pa.float64()),
+        ]),
+        "slip_details": pa.schema([
+            ("id", pa.int32()),
+            ("slip_id", pa.int32()),
+            ("slip_number", pa.string()),
+            ("slip_date", pa.date32()),
+            ("client_id", pa.int32()),
+            ("client_name", pa.string()),
+            ("salesman_id", pa.int32()),
+            ("salesman_name", pa.string()),
+            ("vehicle_number", pa.string()),
+            ("product_id", pa.int32()),
+            ("product_name", pa.string()),
+            ("weight", pa.float64()),
+            ("quantity", pa.float64()),
+            ("rate", pa.float64()),
+            ("amount", pa.float64()),
+        ]),
+        "payments": pa.schema([
+            ("id", pa.int32()),
+            ("date", pa.date32()),
+            ("client_id", pa.int32()),
+            ("client_name", pa.string()),
+            ("amount", pa.float64()),
+            ("notes", pa.string()),
+        ]),
+    }
+
+
+def slips_query(month: date):
+    return (
+        select(
+            Slip.id,
+            Slip.slip_number,
+            Slip.slip_date,
+            Slip.client_id,
+            Clients.name.label("client_name"),
+            Slip.salesman_id,
+            Salesman.name.label("salesman_name"),
+            Slip.vehicle_number,
+            Slip.total_amount,
+        )
+        .join(Clients, Clients.id == Slip.client_id)
+        .join(Salesman, Salesman.id == Slip.salesman_id)
+        .where(Slip.slip_date >= month, Slip.slip_date < next_month(month))
+        .order_by(Slip.slip_date, Slip.id)
+    )
+
+
+def slip_details_query(month: date):
+    return (
+        select(
+            SlipDetail.id,
+            SlipDetail.slip_id,
+            Slip.slip_number,
+            SlipDetail.slip_date,
+            Slip.client_id,
+            Clients.name.label("client_name"),
+            Slip.salesman_id,
+            Salesman.name.label("salesman_name"),
+            Slip.vehicle_number,
+            SlipDetail.product_id,
+            Product.name.label("product_name"),
+            SlipDetail.weight,
+            SlipDetail.quantity,
+            SlipDetail.rate,
+            SlipDetail.amount,
+        )
+        .join(Slip, and_(Slip.id == SlipDetail.slip_id, Slip.slip_date == SlipDetail.slip_date))
+        .join(Clients, Clients.id == Slip.client_id)
+        .join(Salesman, Salesman.id == Slip.salesman_id)
+        .outerjoin(Product, Product.id == SlipDetail.product_id)
+        .where(SlipDetail.slip_date >= month, SlipDetail.slip_date < next_month(month))
+        .order_by(SlipDetail.slip_date, SlipDetail.slip_id, SlipDetail.id)
+    )
+
+
+def payments_query(month: date):
+    return (
+        select(
+            Payment.id,
+            Payment.date,
+            Payment.client_id,
+            Clients.name.label("client_name"),
+            Payment.amount,
+            Payment.notes,
+        )
+        .join(Clients, Clients.id == Payment.client_id)
+        .where(Payment.date >= month, Payment.date < next_month(month))
+        .order_by(Payment.date, Payment.id)
+    )
+
+
+# dataset -> (model, day column, month query)
+DATASETS = {
+    "slips": (Slip, Slip.slip_date, slips_query),
+    "slip_details": (SlipDetail, SlipDetail.slip_date, slip_details_query),
+    "payments": (Payment, Payment.date, payments_query),
+}
+
+
+def month_label(month: date) -> str:
+    return f"{month:%Y-%m}"
+
+
+def month_path(out: str, dataset: str, month: date) -> str:
+    return os.path.join(out, dataset, f"month={month_label(month)}", "part-0.parquet")
+
+
+def load_manifest(out: str) -> dict:
+    try:
+        with open(os.path.join(out, MANIFEST)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"datasets": {}}
+
+
+def save_manifest(out: str, manifest: dict):
+    path = os.path.join(out, MANIFEST)
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+
+async def month_fingerprints(session, dataset: str) -> dict:
+    """
+    {YYYY-MM: {"rows": n, "row_version": highest}} for every month with rows.
+    """
+    model, day, _ = DATASETS[dataset]
+    month = func.date_trunc("month", day)
+    result = await session.execute(
+        select(month.label("month"), func.count().label("rows"), func.max(model.row_version).label("row_version"))
+        .group_by(month)
+    )
+    return {
+        month_label(row.month): {"rows": row.rows, "row_version": row.row_version}
+        for row in result.all()
+    }
+
+
+def stale_months(fingerprints: dict, exported: dict, full: bool = False) -> list[str]:
+    stale = []
+    for label, fingerprint in sorted(fingerprints.items()):
+        previous = exported.get(label, {})
+        if full or any(previous.get(key) != value for key, value in fingerprint.items()):
+            stale.append(label)
+    return stale
+
+
+async def write_month(session, dataset: str, month: date, path: str, schema, compression: str) -> int:
+    """
+    Streams one month into a Parquet file, a row group per batch. Returns the row count.
+    """
+    query = DATASETS[dataset][2](month)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    rows = 0
+    result = await session.stream(query.execution_options(yield_per=EXPORT_BATCH_ROWS))
+    with pq.ParquetWriter(path + ".tmp", schema, compression=compression) as writer:
+        async for batch in result.partitions():
+            writer.write_batch(pa.RecordBatch.from_pylist([dict(row._mapping) for row in batch], schema=schema))
+            rows += len(batch)
+    os.replace(path + ".tmp", path)
+    return rows
+
+
+async def export(out: str, datasets: list[str], full: bool = False, compression: str = "zstd", dry_run: bool = False):
+    """
+    Brings out up to date; returns [(dataset, month, rows)] written (or, with
+    dry_run, that would be written).
+    """
+    if pa is None and not dry_run:
+        raise RuntimeError("pyarrow is not installed: pip install pyarrow")
+    schemas = _schemas() if not dry_run else {}
+    manifest = load_manifest(out)
+    written = []
+    async with read_sessionmaker()() as session:
+        for dataset in datasets:
+            exported = manifest["datasets"].setdefault(dataset, {})
+            fingerprints = await month_fingerprints(session, dataset)
+            for label in stale_months(fingerprints, exported, full):
+                if dry_run:
+                    written.append((dataset, label, fingerprints[label]["rows"]))
+                    continue
+                month = date.fromisoformat(f"{label}-01")
+                rows = await write_month(
+                    session, dataset, month, month_path(out, dataset, month), schemas[dataset], compression
+                )
+                # The fingerprint read before the rows: a change in between shows up next run
+                exported[label] = {
+                    **fingerprints[label],
+                    "exported_rows": rows,
+                    "exported_at": datetime.now(timezone.utc).isoformat(),
+                }
+                save_manifest(out, manifest)
+                written.append((dataset, label, rows))
+    return written
+
+
+async def _main(args):
+    written = await export(
+        args.out, args.dataset or list(DATASETS), full=args.full,
+        compression=args.compression, dry_run=args.command == "status",
+    )
+    for dataset, label, rows in written:
+        print(f"{dataset:13} {label}  {rows} rows")
+    verb = "to write" if args.command == "status" else "written"
+    print(f"{len(written)} months {verb}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Parquet export of slips, slip details and payments")
+    sub = parser.add_subparsers(dest="command", required=True)
+    for name, help_text in (("run", "write new and changed months"), ("status", "list the months a run would write")):
+        command = sub.add_parser(name, help=help_text)
+        command.add_argument("--out", default="exports", help="output directory")
+        command.add_argument("--dataset", action="append", choices=list(DATASETS), help="repeatable, default all")
+        command.add_argument("--full", action="store_true", help="rewrite every month")
+        command.add_argument("--compression", default="zstd", help="parquet codec")
+    asyncio.run(_main(parser.parse_args()))
@@ -0,0 +1,189 @@
+"""
+Idempotency-Key support for POST /slips/ and POST /payments/.
+
+A client that may retry (the tablets on a flaky network) sends a key of its
+choosing, a UUID per logical request, in the Idempotency-Key header. The
+first request with a key runs and its response is kept in idempotency_keys;
+a retry with the same key gets that response back, with an
+Idempotent-Replayed: true header, without allocating a slip number or
+inserting anything. Requests without the header behave as before.
+
+The key is claimed and answered in the endpoint's own transaction:
+
+    async with session.begin():
+        if claim and not await claim.take(session):
+            return             # answered before, idempotent() replays it
+        ... the write ...
+        await claim.answer(session, response)
+
+so the key row commits together with the slip or payment, or not at all. A
+duplicate that arrives while the first request's transaction is open waits
+on the key's primary key and then finds the stored response; a request that
+fails leaves no key behind and can be retried as is. Duplicates on the same
+worker don't take a connection to wait, they wait for the first request's
+response in memory.
+
+Reusing a key for a different request body is a 422. Keys are scoped by
+route and kept for IDEMPOTENCY_TTL_HOURS, after which the key can be used
+again; expired rows are removed with
+
+    python idempotency.py purge
+"""
+import argparse
+import asyncio
+import hashlib
+import os
+
+from fastapi import HTTPException
+from fastapi.responses import Response
+from sqlalchemy import select, update, delete, func
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import IdempotencyKey
+
+IDEMPOTENCY_TTL_HOURS = int(os.getenv("IDEMPOTENCY_TTL_HOURS", "24"))
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+REPLAYED_HEADER = "Idempotent-Replayed"
+MAX_KEY_LENGTH = 255
+
+# (scope, key) -> (request hash, future of (status, body)) for requests running on this worker
+_inflight = {}
+
+
+def _expired(hours: int = IDEMPOTENCY_TTL_HOURS):
+    return IdempotencyKey.created_at < func.now() - func.make_interval(0, 0, 0, 0, hours)
+
+
+def request_hash(payload) -> str:
+    return hashlib.sha256(payload.model_dump_json().encode()).hexdigest()
+
+
+def _reused():
+    return HTTPException(422, f"{IDEMPOTENCY_HEADER} was already used for a different request")
+
+
+class Claim:
+    """
+    One request's key, taken and answered inside the write's transaction.
+    """
+
+    def __init__(self, scope: str, key: str, fingerprint: str):
+        self.scope = scope
+        self.key = key
+        self.fingerprint = fingerprint
+        self.replayed = False
+        self.stored = None  # (status, body) once answered or found
+
+    def _where(self):
+        return (IdempotencyKey.scope == self.scope, IdempotencyKey.key == self.key)
+
+    async def take(self, session: AsyncSession) -> bool:
+        """
+        True when this request owns the key and goes ahead. False when it was
+        answered before; the answer is in stored. Blocks while another
+        transaction holds the key.
+        """
+        stmt = insert(IdempotencyKey).values(scope=self.scope, key=self.key, request_hash=self.fingerprint)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["scope", "key"],
+            set_={"request_hash": stmt.excluded.request_hash, "created_at": func.now(), "status_code": None, "response": None},
+            where=_expired(),
+        ).returning(IdempotencyKey.key)
+        if (await session.execute(stmt)).first() is not None:
+            return True
+        held = (await session.execute(
+            select(IdempotencyKey.request_hash, IdempotencyKey.status_code, IdempotencyKey.response)
+            .where(*self._where())
+        )).one_or_none()
+        if held is None or held.status_code is None:  # purged in between
+            raise HTTPException(409, "Retry the request", headers={"Retry-After": "1"})
+        if held.request_hash != self.fingerprint:
+            raise _reused()
+        self.replayed = True
+        self.stored = (held.status_code, held.response)
+        return False
+
+    async def answer(self, session: AsyncSession, response, status_code: int = 200):
+        """
+        Stores the response (a pydantic model) with the key, in the same transaction.
+        """
+        body = response.model_dump_json().encode()
+        await session.execute(
+            update(IdempotencyKey).where(*self._where()).values(status_code=status_code, response=body)
+        )
+        self.stored = (status_code, body)
+
+
+def replay(status_code: int, body: bytes) -> Response:
+    return Response(body, status_code=status_code, media_type="application/json", headers={REPLAYED_HEADER: "true"})
+
+
+def _retrieved(future: asyncio.Future):
+    # Nobody may be waiting: don't let asyncio complain about an unread exception
+    if not future.cancelled():
+        future.exception()
+
+
+async def idempotent(scope: str, key: str | None, payload, run):
+    """
+    Runs run(claim) at most once per (scope, key) and payload. run is the
+    endpoint's own body; it takes the claim in its transaction and answers
+    it before committing. Without a key it gets None and its return value
+    is the response.
+    """
+    if key is None:
+        return await run(None)
+    if not key or len(key) > MAX_KEY_LENGTH:
+        raise HTTPException(400, f"{IDEMPOTENCY_HEADER} must be 1 to {MAX_KEY_LENGTH} characters")
+    fingerprint = request_hash(payload)
+
+    running = _inflight.get((scope, key))
+    if running is not None:
+        if running[0] != fingerprint:
+            raise _reused()
+        return replay(*await asyncio.shield(running[1]))
+
+    future = asyncio.get_running_loop().create_future()
+    future.add_done_callback(_retrieved)
+    _inflight[(scope, key)] = (fingerprint, future)
+    try:
+        claim = Claim(scope, key, fingerprint)
+        await run(claim)
+        if claim.stored is None:
+            raise RuntimeError(f"{scope} returned without answering its idempotency claim")
+        future.set_result(claim.stored)
+        if claim.replayed:
+            return replay(*claim.stored)
+        status_code, body = claim.stored
+        return Response(body, status_code=status_code, media_type="application/json")
+    except Exception as exc:
+        if not future.done():
+            future.set_exception(exc)
+        raise
+    finally:
+        if not future.done():
+            future.cancel()
+        _inflight.pop((scope, key), None)
+
+
+async def purge_keys(session: AsyncSession, hours: int = IDEMPOTENCY_TTL_HOURS) -> int:
+    async with session.begin():
+        result = await session.execute(delete(IdempotencyKey).where(_expired(hours)))
+    return result.rowcount
+
+
+async def _main(args):
+    from database import AsyncSessionLocal
+
+    async with AsyncSessionLocal() as session:
+        purged = await purge_keys(session, args.hours)
+    print(f"{purged} idempotency keys purged")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Idempotency key maintenance")
+    sub = parser.add_subparsers(dest="command", required=True)
+    purge = sub.add_parser("purge", help="drop keys past the retention")
+    purge.add_argument("--hours", type=int, default=IDEMPOTENCY_TTL_HOURS)
+    asyncio.run(_main(parser.parse_args()))
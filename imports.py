@@ -0,0 +1,251 @@
+"""
+Bulk CSV import for clients, products and salesmen.
+
+POST /clients/import, /products/import and /salesmen/import take a CSV upload
+(multipart field "file") whose header row names the columns, in any order.
+The upload is parsed as it streams in and COPY'd into a temporary staging
+table, then checked and merged with set-based statements, so a file of any
+size costs the same handful of round trips:
+
+    1. COPY into import_rows: the row number, every column as text, and an
+       error already set for records with the wrong number of fields
+    2. one UPDATE marks the remaining bad rows (missing name, not a number,
+       a number too large or too small for double precision, unknown product
+       id, a key repeated further down the file)
+    3. one INSERT ... ON CONFLICT (or UPDATE + INSERT for products) merges
+       the good rows and returns them
+    4. one SELECT reads the errors back
+
+Clients and salesmen are matched on phone like POST /salesmen/: a known phone
+updates that row, no phone always inserts, and when a phone repeats the last
+row wins. Products have no natural key: rows with an id update that product,
+rows without one insert a new product. Columns missing from the file are left
+alone on update.
+
+Bad rows are skipped and reported by data row number (the header is not
+counted), the rest of the file is imported in one transaction. Only a file
+that cannot be read at all (unknown columns, no name column, not UTF-8, an
+unterminated quote) is rejected as a whole, with ImportFileError.
+"""
+import codecs
+import csv
+import io
+import os
+from typing import NamedTuple
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+IMPORT_CHUNK_BYTES = 64 * 1024
+IMPORT_MAX_ERRORS = int(os.getenv("IMPORT_MAX_ERRORS", "1000"))  # reported, all bad rows are skipped
+STAGING = "import_rows"
+
+NUMBER = r"^\s*[-+]?(\d+\.?\d*|\.\d+)([eE][-+]?\d{1,3})?\s*$"
+# What double precision holds (a little inside it); outside, the CAST would fail the whole file
+NUMBER_RANGE = ("1e-307", "1e308")
+INTEGER = r"^\s*\d{1,9}\s*$"
+CASTS = {"text": None, "number": "double precision", "integer": "integer"}
+
+
+class ImportFileError(ValueError):
+    pass
+
+
+class ImportSpec(NamedTuple):
+    table: str
+    columns: dict  # CSV column -> "text", "number" or "integer"
+    key: str  # phone: upsert on it; id: update by id, insert without
+    required: tuple = ("name",)
+
+
+CLIENT_IMPORT = ImportSpec("clients", {"name": "text", "phone": "text", "address": "text"}, key="phone")
+PRODUCT_IMPORT = ImportSpec("products", {"id": "integer", "name": "text", "weight": "number", "rate": "number"}, key="id")
+SALESMAN_IMPORT = ImportSpec("salesman", {"name": "text", "phone": "text", "commission": "number"}, key="phone")
+
+
+def value_sql(spec: ImportSpec, column: str, alias: str = STAGING) -> str:
+    """
+    The staged text as the column's type; blank is NULL.
+    """
+    value = f"nullif(btrim({alias}.{column}), '')"
+    cast = CASTS[spec.columns[column]]
+    return f"CAST({value} AS {cast})" if cast else value
+
+
+async def _records(upload):
+    """
+    Yields (record number, fields) for every CSV record, the header being
+    record 0, reading the upload IMPORT_CHUNK_BYTES at a time. A record may
+    span lines inside quotes; it is complete once its quotes balance.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    number = -1
+    tail = pending = ""
+    while True:
+        chunk = await upload.read(IMPORT_CHUNK_BYTES)
+        try:
+            tail += decoder.decode(chunk, final=not chunk)
+        except UnicodeDecodeError:
+            raise ImportFileError("File is not UTF-8 text")
+        lines = tail.split("\n")
+        tail = lines.pop() if chunk else ""
+        if not chunk:
+            lines = [line for line in lines if line]
+        for line in lines:
+            pending += line + "\n"
+            if pending.count('"') % 2:
+                continue  # newline inside a quoted field
+            record, pending = pending, ""
+            if not record.strip():
+                continue
+            number += 1
+            yield number, next(csv.reader(io.StringIO(record)))
+        if not chunk:
+            break
+    if pending:
+        raise ImportFileError(f"Unterminated quoted field after data row {number}")
+
+
+def _header(fields: list[str], spec: ImportSpec) -> list[str]:
+    header = [field.strip().lower() for field in fields]
+    unknown = [column for column in header if column not in spec.columns]
+    if unknown:
+        raise ImportFileError(f"Unknown column {unknown[0]!r}, expected some of {', '.join(spec.columns)}")
+    if len(set(header)) != len(header):
+        raise ImportFileError("Repeated column in the header")
+    missing = [column for column in spec.required if column not in header]
+    if missing:
+        raise ImportFileError(f"Missing column {missing[0]!r}")
+    return header
+
+
+def _checks(spec: ImportSpec, header: list[str]) -> list[tuple[str, str]]:
+    """
+    (condition, error) pairs, in order; the first that holds is the row's error.
+    """
+    checks = []
+    for column in header:
+        kind = spec.columns[column]
+        if column in spec.required:
+            checks.append((f"nullif(btrim({column}), '') IS NULL", f"{column} is required"))
+        if kind != "text":
+            pattern = NUMBER if kind == "number" else INTEGER
+            checks.append((
+                f"nullif(btrim({column}), '') IS NOT NULL AND {column} !~ '{pattern}'",
+                f"{column} is not {'a number' if kind == 'number' else 'a valid id'}",
+            ))
+        if kind == "number":
+            # Only reached once the pattern matched, so the numeric cast is safe
+            value = f"CAST(nullif(btrim({column}), '') AS numeric)"
+            low, high = NUMBER_RANGE
+            checks.append((
+                f"{value} <> 0 AND abs({value}) NOT BETWEEN {low} AND {high}",
+                f"{column} is out of range",
+            ))
+    if spec.key == "id" and "id" in header:
+        checks.append((
+            f"nullif(btrim(id), '') IS NOT NULL AND NOT EXISTS "
+            f"(SELECT 1 FROM {spec.table} AS t WHERE t.id = {value_sql(spec, 'id')})",
+            f"no {spec.table} row with this id",
+        ))
+    return checks
+
+
+def _merge_sql(spec: ImportSpec, header: list[str]) -> str:
+    """
+    Merges the good rows; returns the written rows plus "inserted".
+    Every update restamps row_version for GET /sync.
+    """
+    data = [column for column in header if column != "id"]
+    values = ", ".join(value_sql(spec, column) for column in data)
+    good = f"{STAGING}.error IS NULL"
+
+    if spec.key == "phone":
+        updates = ", ".join(f"{column} = excluded.{column}" for column in data if column != "phone")
+        return (
+            f"INSERT INTO {spec.table} ({', '.join(data)}) "
+            f"SELECT {values} FROM {STAGING} WHERE {good} ORDER BY row_number "
+            f"ON CONFLICT (phone) DO UPDATE SET {updates}, row_version = txid_current() "
+            f"RETURNING {spec.table}.*, (xmax = 0) AS inserted"
+        )
+
+    has_id = "id" in header
+    insert = (
+        f"INSERT INTO {spec.table} ({', '.join(data)}) "
+        f"SELECT {values} FROM {STAGING} WHERE {good}"
+        + (" AND nullif(btrim(id), '') IS NULL" if has_id else "")
+        + f" ORDER BY row_number RETURNING {spec.table}.*, true AS inserted"
+    )
+    if not has_id:
+        return insert
+    updates = ", ".join(f"{column} = {value_sql(spec, column)}" for column in data)
+    return (
+        f"WITH updated AS ("
+        f"UPDATE {spec.table} AS t SET {updates}, row_version = txid_current() FROM {STAGING} "
+        f"WHERE {good} AND t.id = {value_sql(spec, 'id')} RETURNING t.*, false AS inserted"
+        f"), created AS ({insert}) "
+        f"SELECT * FROM updated UNION ALL SELECT * FROM created"
+    )
+
+
+async def import_csv(session: AsyncSession, spec: ImportSpec, upload):
+    """
+    Imports an uploaded CSV (anything with an async read(size)) into
+    spec.table and commits. Returns (report, written rows as dicts); the
+    report has rows, inserted, updated, failed and the first
+    IMPORT_MAX_ERRORS errors.
+    """
+    records = _records(upload)
+    first = await anext(records, None)
+    if first is None:
+        raise ImportFileError("Empty file")
+    header = _header(first[1], spec)
+    counted = {"rows": 0}
+
+    async def staged():
+        async for row_number, fields in records:
+            counted["rows"] = row_number
+            if len(fields) != len(header):
+                yield (row_number, *([None] * len(header)), f"expected {len(header)} fields, got {len(fields)}")
+            else:
+                yield (row_number, *fields, None)
+
+    async with session.begin():
+        columns = ", ".join(f"{column} text" for column in header)
+        await session.execute(text(
+            f"CREATE TEMP TABLE {STAGING} (row_number integer PRIMARY KEY, {columns}, error text) ON COMMIT DROP"
+        ))
+        # COPY on the session's own connection, so it is part of the transaction
+        raw = await (await session.connection()).get_raw_connection()
+        await raw.driver_connection.copy_records_to_table(
+            STAGING, records=staged(), columns=["row_number", *header, "error"]
+        )
+
+        checks = _checks(spec, header)
+        if checks:
+            cases = " ".join(f"WHEN {condition} THEN '{error}'" for condition, error in checks)
+            await session.execute(text(f"UPDATE {STAGING} SET error = CASE {cases} END WHERE error IS NULL"))
+        if spec.key in header:
+            # ON CONFLICT cannot touch a row twice in one statement: the last occurrence wins
+            await session.execute(text(
+                f"UPDATE {STAGING} SET error = '{spec.key} repeated on row ' || later.last_row "
+                f"FROM (SELECT row_number, max(row_number) OVER (PARTITION BY {value_sql(spec, spec.key, 's')}) AS last_row "
+                f"      FROM {STAGING} AS s WHERE s.error IS NULL AND nullif(btrim(s.{spec.key}), '') IS NOT NULL) AS later "
+                f"WHERE {STAGING}.row_number = later.row_number AND later.row_number <> later.last_row"
+            ))
+
+        written = [dict(row) for row in (await session.execute(text(_merge_sql(spec, header)))).mappings()]
+        errors = (await session.execute(text(
+            f"SELECT row_number, error, count(*) OVER () AS failed FROM {STAGING} "
+            f"WHERE error IS NOT NULL ORDER BY row_number LIMIT {IMPORT_MAX_ERRORS}"
+        ))).all()
+
+    inserted = sum(1 for row in written if row.pop("inserted"))
+    report = {
+        "rows": counted["rows"],
+        "inserted": inserted,
+        "updated": len(written) - inserted,
+        "failed": errors[0].failed if errors else 0,
+        "errors": [{"row": row.row_number, "error": row.error} for row in errors],
+    }
+    return report, written
@@ -0,0 +1,270 @@
+"""
+Client balance ledger.
+
+client_balances holds one row per client with the running billed/paid totals.
+The routers call into here inside the same transaction that writes the slip or
+payment, so the aggregate never drifts from the rows it summarises.
+
+Rebuild or check the aggregates from scratch with:
+
+    python ledger.py rebuild           # recompute and overwrite
+    python ledger.py rebuild --check   # only report mismatches
+
+Run a rebuild once after the table is first created to seed it from history.
+"""
+import argparse
+import asyncio
+
+from sqlalchemy import select, func, text, literal, tuple_, union_all
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import Clients, ClientBalance, Payment, Slip, SlipArchive
+
+# Float columns, so compare with a little slack
+TOLERANCE = 0.005
+
+
+async def apply_balance_deltas(session: AsyncSession, deltas: dict):
+    """
+    Adds {client_id: (billed_delta, paid_delta)} onto the running balances
+    with a single upsert. Must be called inside the caller's transaction.
+    """
+    rows = [
+        {"client_id": client_id, "billed": billed, "paid": paid}
+        for client_id, (billed, paid) in sorted(deltas.items())  # stable lock order
+        if billed or paid
+    ]
+    if not rows:
+        return
+    stmt = insert(ClientBalance).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[ClientBalance.client_id],
+        set_={
+            "billed": ClientBalance.billed + stmt.excluded.billed,
+            "paid": ClientBalance.paid + stmt.excluded.paid,
+        },
+    )
+    await session.execute(stmt)
+
+
+async def record_billed(session: AsyncSession, client_id: int, amount: float):
+    await apply_balance_deltas(session, {client_id: (amount, 0.0)})
+
+
+async def record_paid(session: AsyncSession, client_id: int, amount: float):
+    await apply_balance_deltas(session, {client_id: (0.0, amount)})
+
+
+def balances_query():
+    # Clients without a ledger row yet simply owe nothing
+    return (
+        select(
+            Clients.id.label("client_id"),
+            func.coalesce(ClientBalance.billed, 0.0).label("billed"),
+            func.coalesce(ClientBalance.paid, 0.0).label("paid"),
+            func.coalesce(ClientBalance.outstanding, 0.0).label("outstanding"),
+        )
+        .outerjoin(ClientBalance, ClientBalance.client_id == Clients.id)
+    )
+
+
+async def get_balance(session: AsyncSession, client_id: int):
+    result = await session.execute(balances_query().where(Clients.id == client_id))
+    row = result.mappings().first()
+    return dict(row) if row else None
+
+
+async def get_balances(session: AsyncSession, client_ids: list[int] | None = None):
+    query = balances_query()
+    if client_ids:
+        query = query.where(Clients.id.in_(client_ids))
+    result = await session.execute(query.order_by(Clients.id))
+    return [dict(row) for row in result.mappings()]
+
+
+# Statement entries on the same day: slips (debits) before payments (credits)
+SLIP_ENTRY, PAYMENT_ENTRY = 0, 1
+STATEMENT_COLUMNS = ["date", "kind", "id", "reference", "debit", "credit", "balance"]
+
+
+def opening_balance(client_id: int, date_from=None):
+    """
+    Scalar subquery: what the client owed before date_from (0 without one).
+    Archived months count too.
+    """
+    if date_from is None:
+        return literal(0.0)
+    billed, archived = (
+        select(func.coalesce(func.sum(model.total_amount), 0.0))
+        .where(model.client_id == client_id, model.slip_date < date_from)
+        .scalar_subquery()
+        for model in (Slip, SlipArchive)
+    )
+    paid = (
+        select(func.coalesce(func.sum(Payment.amount), 0.0))
+        .where(Payment.client_id == client_id, Payment.date < date_from)
+        .scalar_subquery()
+    )
+    return billed + archived - paid
+
+
+def statement_query(client_id: int, date_from=None, date_to=None, after=None, limit: int | None = None):
+    """
+    A client's slips (archived months included) and payments in
+    (date, seq, id) order with the running balance, opening balance included,
+    as one query.
+
+    after is (date, seq, id, balance) of the last entry already seen; the
+    entries after it continue from that balance instead of summing history
+    again, so every page costs the same. limit is pushed into every branch.
+    """
+    branches = []
+    for seq, model, day, columns in (
+        (SLIP_ENTRY, Slip, Slip.slip_date,
+         [literal("slip").label("kind"), Slip.slip_number.label("reference"),
+          Slip.total_amount.label("debit"), literal(0.0).label("credit")]),
+        # Archived slips keep their ids, so (date, seq, id) stays unique across both
+        (SLIP_ENTRY, SlipArchive, SlipArchive.slip_date,
+         [literal("slip").label("kind"), SlipArchive.slip_number.label("reference"),
+          SlipArchive.total_amount.label("debit"), literal(0.0).label("credit")]),
+        (PAYMENT_ENTRY, Payment, Payment.date,
+         [literal("payment").label("kind"), Payment.notes.label("reference"),
+          literal(0.0).label("debit"), Payment.amount.label("credit")]),
+    ):
+        branch = (
+            select(day.label("date"), literal(seq).label("seq"), model.id.label("id"), *columns)
+            .where(model.client_id == client_id)
+        )
+        if date_from is not None:
+            branch = branch.where(day >= date_from)
+        if date_to is not None:
+            branch = branch.where(day <= date_to)
+        if after is not None:
+            # (day, seq, id) > after, spelled so the (client_id, day) indexes apply
+            last_date, last_seq, last_id = after[:3]
+            if seq > last_seq:
+                branch = branch.where(day >= last_date)
+            elif seq == last_seq:
+                branch = branch.where(tuple_(day, model.id) > tuple_(last_date, last_id))
+            else:
+                branch = branch.where(day > last_date)
+        if limit is not None:
+            branch = branch.order_by(day, model.id).limit(limit)
+        branches.append(branch)
+
+    entries = union_all(*branches).subquery("entries")
+    opening = literal(float(after[3])) if after is not None else opening_balance(client_id, date_from)
+    order = (entries.c.date, entries.c.seq, entries.c.id)
+    running = func.sum(entries.c.debit - entries.c.credit).over(order_by=order, rows=(None, 0))
+    query = (
+        select(
+            entries.c.date,
+            entries.c.seq,
+            entries.c.kind,
+            entries.c.id,
+            entries.c.reference,
+            entries.c.debit,
+            entries.c.credit,
+            (opening + running).label("balance"),
+            opening.label("opening"),
+        )
+        .order_by(*order)
+    )
+    return query.limit(limit) if limit is not None else query
+
+
+async def get_opening_balance(session: AsyncSession, client_id: int, date_from=None) -> float:
+    return (await session.execute(select(opening_balance(client_id, date_from)))).scalar_one()
+
+
+def recomputed_query():
+    slips = union_all(
+        select(Slip.client_id, Slip.total_amount),
+        select(SlipArchive.client_id, SlipArchive.total_amount),
+    ).subquery()
+    billed = (
+        select(slips.c.client_id, func.sum(slips.c.total_amount).label("billed"))
+        .group_by(slips.c.client_id)
+        .subquery()
+    )
+    paid = (
+        select(Payment.client_id, func.sum(Payment.amount).label("paid"))
+        .group_by(Payment.client_id)
+        .subquery()
+    )
+    return (
+        select(
+            Clients.id.label("client_id"),
+            func.coalesce(billed.c.billed, 0.0).label("billed"),
+            func.coalesce(paid.c.paid, 0.0).label("paid"),
+        )
+        .outerjoin(billed, billed.c.client_id == Clients.id)
+        .outerjoin(paid, paid.c.client_id == Clients.id)
+    )
+
+
+async def rebuild_balances(session: AsyncSession, apply: bool = True) -> list[dict]:
+    """
+    Recomputes every client's totals from slips and payments and compares them
+    with the live ledger. Returns the mismatches; when apply is set the ledger
+    is overwritten with the recomputed values in the same transaction.
+    """
+    async with session.begin():
+        # Writers queue behind this lock, so the recomputation and the
+        # overwrite see exactly the same set of slips and payments.
+        await session.execute(text("LOCK TABLE client_balances IN EXCLUSIVE MODE"))
+
+        recomputed = recomputed_query().subquery()
+        result = await session.execute(
+            select(
+                recomputed.c.client_id,
+                recomputed.c.billed,
+                recomputed.c.paid,
+                func.coalesce(ClientBalance.billed, 0.0).label("live_billed"),
+                func.coalesce(ClientBalance.paid, 0.0).label("live_paid"),
+            ).outerjoin(ClientBalance, ClientBalance.client_id == recomputed.c.client_id)
+        )
+        mismatches = [
+            dict(row)
+            for row in result.mappings()
+            if abs(row["billed"] - row["live_billed"]) > TOLERANCE
+            or abs(row["paid"] - row["live_paid"]) > TOLERANCE
+        ]
+
+        if apply and mismatches:
+            stmt = insert(ClientBalance).from_select(
+                ["client_id", "billed", "paid"], recomputed_query()
+            )
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[ClientBalance.client_id],
+                set_={"billed": stmt.excluded.billed, "paid": stmt.excluded.paid},
+            )
+            await session.execute(stmt)
+
+    return mismatches
+
+
+async def _main(args):
+    from database import AsyncSessionLocal
+
+    async with AsyncSessionLocal() as session:
+        mismatches = await rebuild_balances(session, apply=not args.check)
+
+    for row in mismatches:
+        print(
+            f"client {row['client_id']}: "
+            f"billed {row['live_billed']:.2f} -> {row['billed']:.2f}, "
+            f"paid {row['live_paid']:.2f} -> {row['paid']:.2f}"
+        )
+    action = "found" if args.check else "fixed"
+    print(f"{len(mismatches)} mismatched balances {action}")
+    return 1 if args.check and mismatches else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Client balance ledger maintenance")
+    sub = parser.add_subparsers(dest="command", required=True)
+    rebuild = sub.add_parser("rebuild", help="recompute balances from slips and payments")
+    rebuild.add_argument("--check", action="store_true", help="report mismatches without fixing them")
+    raise SystemExit(asyncio.run(_main(parser.parse_args())))
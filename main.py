@@ -1,13 +1,26 @@
-from fastapi import FastAPI, Depends, HTTPException,Path
+from fastapi import FastAPI, Depends, HTTPException,Path, UploadFile, File
+from fastapi.responses import PlainTextResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from models import Base, Salesman
-from schemas import SalesmanCreate, SalesmanResponse
-from database import AsyncSessionLocal, engine
+from schemas import SalesmanCreate, SalesmanResponse, ImportReport
+from database import engine, get_session, read_your_writes_middleware, pool_status
+from metrics import metrics_middleware, instrument_routes, render as render_metrics
+from budget import query_budget, check_budgets
 from contextlib import asynccontextmanager
+from cache import cached_list_response, list_adapter
+from versions import mark_changed, conditional, etag_middleware
+from writes import upsert_returning, update_returning, delete_returning
+from pubsub import pubsub
+from search import search_indexes
+from sync import record_deleted
+from events import event_hub
+from imports import import_csv, ImportFileError, SALESMAN_IMPORT
+from partitions import slip_partitions, next_month
+from datetime import date
 
 from fastapi.middleware.cors import CORSMiddleware
-from routers import clients_router,products_router,slips_router,payments_router# Importing the clients router
+from routers import clients_router,products_router,slips_router,payments_router,internal_router,reports_router,search_router,sync_router,events_router# Importing the clients router
 
 
 
@@ -17,9 +30,14 @@ async def lifespan(app: FastAPI):
     # Startup code
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+    await slip_partitions.ensure(date.today(), next_month(date.today()))  # slips' month partitions
+    await pubsub.start()  # cross-worker cache invalidation
+    search_indexes.warm()  # typeahead indexes load in the background
     yield  # Application runs here
     # Shutdown code (optional)
     # (e.g., close connections or cleanup)
+    event_hub.close_all()  # ends any event streams still open
+    await pubsub.stop()
 
 app = FastAPI(lifespan=lifespan)
 app.add_middleware(
@@ -29,73 +47,93 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
-# Dependency
-async def get_session():
-    async with AsyncSessionLocal() as session:
-        yield session
+app.middleware("http")(etag_middleware)  # ETag/Last-Modified on conditional GETs
+app.middleware("http")(read_your_writes_middleware)  # keeps a writer's reads on the primary
+app.middleware("http")(metrics_middleware)  # outermost, so it times everything below
+salesmen_adapter = list_adapter(SalesmanResponse)
 
 @app.post("/salesmen/", response_model=SalesmanResponse)
+@query_budget(2)
 async def create_salesman(salesman: SalesmanCreate, session: AsyncSession = Depends(get_session)):
-    if salesman.phone:
-        result = await session.execute(select(Salesman).filter(Salesman.phone == salesman.phone))
-        existing_salesman = result.scalars().first()
-
-        if existing_salesman:
-            # Update existing record
-            existing_salesman.name = salesman.name
-            existing_salesman.commission = salesman.commission
-            # phone stays the same since it is unique and matched
-            await session.commit()
-            await session.refresh(existing_salesman)
-            return existing_salesman
-
-    # If no existing salesman with this phone, create new
-    db_salesman = Salesman(**salesman.model_dump())
-    session.add(db_salesman)
+    # Same phone updates the existing record (phone stays, it is what matched),
+    # otherwise a new salesman is created. A NULL phone never conflicts.
+    db_salesman = await upsert_returning(
+        session, Salesman, salesman.model_dump(),
+        conflict=["phone"], update_columns=["name", "commission"],
+    )
     await session.commit()
-    await session.refresh(db_salesman)
+    await mark_changed(session, "salesman")
     return db_salesman
 
-@app.get("/salesmen/", response_model=list[SalesmanResponse])
-async def get_salesmen(session: AsyncSession = Depends(get_session)):
-    result = await session.execute(select(Salesman))
-    return result.scalars().all()
+@app.post("/salesmen/import", response_model=ImportReport)
+@query_budget(6)  # staging table, checks, merge, errors, version bump; COPY is not counted
+async def import_salesmen(file: UploadFile = File(...), session: AsyncSession = Depends(get_session)):
+    """
+    Creates or updates salesmen from a CSV upload, matched on phone like
+    create_salesman; see imports.py for the format.
+    """
+    try:
+        report, written = await import_csv(session, SALESMAN_IMPORT, file)
+    except ImportFileError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    if written:
+        await mark_changed(session, "salesman")
+    return report
+
+@app.get("/salesmen/", response_model=list[SalesmanResponse], dependencies=[conditional("salesman")])
+@query_budget(2)
+async def get_salesmen():
+    return await cached_list_response("salesman", select(Salesman), salesmen_adapter)
 
 @app.put("/salesmen/{salesman_id}", response_model=SalesmanResponse)
+@query_budget(2)
 async def update_salesman(
     salesman_update: SalesmanCreate,
     salesman_id: int = Path(..., title="The ID of the salesman to update"),
     
     session: AsyncSession = Depends(get_session),
 ):
-    result = await session.execute(select(Salesman).filter(Salesman.id == salesman_id))
-    db_salesman = result.scalars().first()
+    db_salesman = await update_returning(session, Salesman, salesman_id, salesman_update.model_dump())
     if not db_salesman:
         raise HTTPException(status_code=404, detail="Salesman not found")
-    
-    db_salesman.name = salesman_update.name
-    db_salesman.commission = salesman_update.commission
-    db_salesman.phone = salesman_update.phone
     await session.commit()
-    await session.refresh(db_salesman)
+    await mark_changed(session, "salesman")
     return db_salesman
 
 
 @app.delete("/salesmen/{salesman_id}")
+@query_budget(3)
 async def delete_salesman(
     salesman_id: int = Path(..., title="The ID of the salesman to delete"),
     session: AsyncSession = Depends(get_session),
 ):
-    result = await session.execute(select(Salesman).filter(Salesman.id == salesman_id))
-    db_salesman = result.scalars().first()
-    if not db_salesman:
+    deleted = await delete_returning(session, Salesman, salesman_id)
+    if not deleted:
         raise HTTPException(status_code=404, detail="Salesman not found")
-    
-    await session.delete(db_salesman)
+    await record_deleted(session, "salesman", salesman_id)
     await session.commit()
+    await mark_changed(session, "salesman")
     return {"detail": "Salesman deleted successfully"}
 
 app.include_router(clients_router)  # Include the clients router
 app.include_router(products_router)  # Include the clients router
 app.include_router(slips_router)  # Include the clients router
-app.include_router(payments_router)  # Include the payments router
\ No newline at end of file
+app.include_router(payments_router)  # Include the payments router
+app.include_router(internal_router)  # /internal/pool
+app.include_router(reports_router)  # /reports
+app.include_router(search_router)  # /search
+app.include_router(sync_router)  # /sync
+app.include_router(events_router)  # /events/stream, /ws/events
+
+
+@app.get("/metrics", include_in_schema=False)
+@query_budget(0)
+async def get_metrics():
+    """
+    Prometheus text format, for this worker only (see metrics.py).
+    """
+    return PlainTextResponse(render_metrics(pool_status()), media_type="text/plain; version=0.0.4")
+
+
+instrument_routes(app)  # after every route is registered
+check_budgets(app)
\ No newline at end of file
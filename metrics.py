@@ -0,0 +1,266 @@
+"""
+Per-request instrumentation, exposed at GET /metrics in Prometheus text format.
+
+metrics_middleware gives every request a RequestStats through a contextvar.
+SQLAlchemy cursor events add each statement's count, time and rows to it,
+database.TimedQueuePool adds pool waits, and instrument_routes() marks when
+the endpoint returned, so what FastAPI spends after that (response_model
+validation and JSON rendering) is the serialization time.
+
+Numbers are per worker since startup; Prometheus scrapes whichever worker
+answers, the pid label tells them apart.
+
+SLOW_REQUEST_MS > 0 also logs every request slower than that, with the SQL it
+ran, on the "archie.slow" logger. Other per-request checks (budget.py) hook
+in through request_end_hooks.
+"""
+import functools
+import logging
+import os
+import time
+from contextvars import ContextVar
+
+from fastapi import Request
+from fastapi.routing import APIRoute
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "0"))
+SLOW_REQUEST_MAX_STATEMENTS = 50
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+slow_log = logging.getLogger("archie.slow")
+
+
+class RequestStats:
+    """
+    Mutable on purpose: BaseHTTPMiddleware runs the endpoint in a copied
+    context, so the middleware only sees what is added to this object.
+    """
+
+    def __init__(self, scope: dict | None = None):
+        self.scope = scope or {}  # the ASGI scope; "route" appears once routing is done
+        self.statements = 0
+        self.db_seconds = 0.0
+        self.rows = 0
+        self.pool_wait = 0.0
+        self.serialize_seconds = 0.0
+        self.endpoint_done = None
+        self.sql = []  # (seconds, statement), the first SLOW_REQUEST_MAX_STATEMENTS only
+
+
+current_stats: ContextVar[RequestStats | None] = ContextVar("current_stats", default=None)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.total += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+
+class RouteMetrics:
+    def __init__(self):
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.statements = Histogram(STATEMENT_BUCKETS)
+        self.statuses = {}
+        self.db_seconds = 0.0
+        self.rows = 0
+        self.serialize_seconds = 0.0
+        self.pool_wait = 0.0
+
+
+routes = {}  # (method, route path) -> RouteMetrics
+request_end_hooks = []  # callables(method, path, status, seconds, stats)
+
+
+# Cursor events fire for every engine, replicas included
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    stats = current_stats.get()
+    if stats is None:
+        return
+    stats.statements += 1
+    stats.db_seconds += elapsed
+    stats.rows += max(cursor.rowcount or 0, 0)
+    if len(stats.sql) < SLOW_REQUEST_MAX_STATEMENTS:
+        stats.sql.append((elapsed, statement))
+
+
+def record_pool_wait(seconds: float):
+    stats = current_stats.get()
+    if stats is not None:
+        stats.pool_wait += seconds
+
+
+def record_serialize(seconds: float):
+    """
+    For handlers that encode their own body (slip_json.json_response).
+    """
+    stats = current_stats.get()
+    if stats is not None:
+        stats.serialize_seconds += seconds
+
+
+def api_routes(routes):
+    """
+    Every APIRoute, including the ones of included routers: newer FastAPI
+    keeps an included router as a single entry of app.routes instead of
+    copying its routes in.
+    """
+    for route in routes:
+        if isinstance(route, APIRoute):
+            yield route
+        elif getattr(route, "original_router", None) is not None:
+            yield from api_routes(route.original_router.routes)
+
+
+def instrument_routes(app):
+    """
+    Wraps every endpoint so the request knows when the handler proper ended.
+    Call once all routers are included.
+    """
+    for route in api_routes(app.routes):
+        if getattr(route.endpoint, "_instrumented", False):
+            continue
+        endpoint = route.endpoint
+
+        @functools.wraps(endpoint)
+        async def timed(*args, _endpoint=endpoint, **kwargs):
+            try:
+                return await _endpoint(*args, **kwargs)
+            finally:
+                stats = current_stats.get()
+                if stats is not None:
+                    stats.endpoint_done = time.perf_counter()
+
+        timed._instrumented = True
+        # Included routers build their handler from route.endpoint on first use
+        route.endpoint = timed
+        route.dependant.call = timed
+
+
+async def metrics_middleware(request: Request, call_next):
+    stats = RequestStats(request.scope)
+    token = current_stats.set(stats)
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        end = time.perf_counter()
+        current_stats.reset(token)
+        if stats.endpoint_done is not None:
+            stats.serialize_seconds += end - stats.endpoint_done
+        route = request.scope.get("route")
+        path = getattr(route, "path", None) or "unmatched"  # raw paths would explode the label set
+        observe(request.method, path, status, end - start, stats)
+        for hook in request_end_hooks:
+            hook(request.method, path, status, end - start, stats)
+
+
+def observe(method: str, path: str, status: int, seconds: float, stats: RequestStats):
+    metrics = routes.get((method, path))
+    if metrics is None:
+        metrics = routes[(method, path)] = RouteMetrics()
+    metrics.latency.observe(seconds)
+    metrics.statements.observe(stats.statements)
+    metrics.statuses[status] = metrics.statuses.get(status, 0) + 1
+    metrics.db_seconds += stats.db_seconds
+    metrics.rows += stats.rows
+    metrics.serialize_seconds += stats.serialize_seconds
+    metrics.pool_wait += stats.pool_wait
+
+    if SLOW_REQUEST_MS and seconds * 1000 >= SLOW_REQUEST_MS:
+        slow_log.warning(
+            "%s %s %s took %.1f ms: %d statements, %.1f ms in the database, %.1f ms serializing, "
+            "%.1f ms waiting for the pool\n%s",
+            method, path, status, seconds * 1000, stats.statements, stats.db_seconds * 1000,
+            stats.serialize_seconds * 1000, stats.pool_wait * 1000, format_sql(stats),
+        )
+
+
+def format_sql(stats: RequestStats) -> str:
+    lines = [f"{elapsed * 1000:8.2f} ms  {' '.join(statement.split())}" for elapsed, statement in stats.sql]
+    if stats.statements > len(stats.sql):
+        lines.append(f"... and {stats.statements - len(stats.sql)} more")
+    return "\n".join(lines)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(**labels) -> str:
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+def _histogram(lines, name: str, histogram: Histogram, **labels):
+    for bound, count in zip(histogram.buckets, histogram.counts):
+        lines.append(f"{name}_bucket{_labels(**labels, le=bound)} {count}")
+    lines.append(f"{name}_bucket{_labels(**labels, le='+Inf')} {histogram.count}")
+    lines.append(f"{name}_sum{_labels(**labels)} {histogram.total}")
+    lines.append(f"{name}_count{_labels(**labels)} {histogram.count}")
+
+
+def render(pool: dict) -> str:
+    """
+    Everything in Prometheus text exposition format; pool is database.pool_status().
+    """
+    pid = pool["pid"]
+    lines = []
+    families = [
+        ("http_request_duration_seconds", "histogram", "Request latency."),
+        ("http_request_sql_statements", "histogram", "SQL statements per request."),
+        ("http_requests_total", "counter", "Requests by status."),
+        ("http_request_db_seconds_total", "counter", "Time spent executing SQL."),
+        ("http_request_db_rows_total", "counter", "Rows returned or affected by SQL."),
+        ("http_request_serialize_seconds_total", "counter", "Time spent encoding responses."),
+        ("http_request_pool_wait_seconds_total", "counter", "Time spent waiting for a pooled connection."),
+    ]
+    for name, kind, help_text in families:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for (method, path), metrics in sorted(routes.items()):
+            labels = {"pid": pid, "method": method, "route": path}
+            if name == "http_request_duration_seconds":
+                _histogram(lines, name, metrics.latency, **labels)
+            elif name == "http_request_sql_statements":
+                _histogram(lines, name, metrics.statements, **labels)
+            elif name == "http_requests_total":
+                for status, count in sorted(metrics.statuses.items()):
+                    lines.append(f"{name}{_labels(**labels, status=status)} {count}")
+            else:
+                value = {
+                    "http_request_db_seconds_total": metrics.db_seconds,
+                    "http_request_db_rows_total": metrics.rows,
+                    "http_request_serialize_seconds_total": metrics.serialize_seconds,
+                    "http_request_pool_wait_seconds_total": metrics.pool_wait,
+                }[name]
+                lines.append(f"{name}{_labels(**labels)} {value}")
+
+    for key, kind in (
+        ("pool_size", "gauge"), ("checked_out", "gauge"), ("idle", "gauge"), ("overflow", "gauge"),
+        ("checkouts", "counter"), ("timeouts", "counter"),
+    ):
+        name = f"db_pool_{key}" + ("_total" if kind == "counter" else "")
+        lines.append(f"# TYPE {name} {kind}")
+        lines.append(f"{name}{_labels(pid=pid)} {pool[key]}")
+    return "\n".join(lines) + "\n"
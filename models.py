@@ -1,4 +1,5 @@
-from sqlalchemy import Column, Integer, String, Float,Column, Date, ForeignKey
+from sqlalchemy import Column, Integer, String, Float,Column, Date, ForeignKey, Computed, BigInteger, DateTime, func, Index, text, ForeignKeyConstraint, LargeBinary
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import relationship
 from sqlalchemy.orm import declarative_base
 import datetime
@@ -8,12 +9,26 @@ import datetime
 
 Base = declarative_base()
 
+
+def row_version():
+    """
+    Id of the transaction that last wrote the row, for GET /sync (see sync.py).
+    The server default covers raw SQL inserts too; ORM and Core updates
+    (and writes.upsert_returning) restamp it.
+    """
+    return Column(BigInteger, nullable=False, server_default=text("txid_current()"), onupdate=func.txid_current())
+
 class Salesman(Base):
     __tablename__ = "salesman"
     id = Column(Integer, primary_key=True, index=True, autoincrement=True)
     name = Column(String, nullable=False)
     commission = Column(Float, nullable=True)
     phone = Column(String, nullable=True,unique=True)
+    row_version = row_version()
+
+    __table_args__ = (
+        Index("ix_salesman_row_version_id", "row_version", "id"),
+    )
 
 class Clients(Base):
     __tablename__ = "clients"
@@ -21,6 +36,11 @@ class Clients(Base):
     name = Column(String, nullable=False)
     phone = Column(String, nullable=True, unique=True)
     address = Column(String, nullable=True)
+    row_version = row_version()
+
+    __table_args__ = (
+        Index("ix_clients_row_version_id", "row_version", "id"),
+    )
 
     def __repr__(self):
         return f"<Client(name={self.name}, phone={self.phone}, address={self.address})>"
@@ -31,39 +51,105 @@ class Product(Base):
     name = Column(String, nullable=False)
     weight = Column(Float, nullable=True)
     rate = Column(Float, nullable=True)
-    
+    row_version = row_version()
+
+    __table_args__ = (
+        Index("ix_products_row_version_id", "row_version", "id"),
+    )
 
 
 
+class SlipNumber(Base):
+    """
+    Every slip number ever handed out. slips is partitioned by month and can
+    only have unique keys that include slip_date, so this primary key is what
+    keeps slip numbers unique; rows stay when slips are deleted or archived.
+    """
+    __tablename__ = "slip_numbers"
+
+    slip_number = Column(String, primary_key=True)
+
+
 class Slip(Base):
     __tablename__ = "slips"
     id = Column(Integer, primary_key=True, index=True, autoincrement=True)
-    slip_number = Column(String, unique=True, nullable=False, index=True)
+    # Checked at commit, so the slip and its slip_numbers row can go in either order
+    slip_number = Column(
+        String,
+        ForeignKey("slip_numbers.slip_number", name="fk_slips_slip_number", deferrable=True, initially="DEFERRED"),
+        nullable=False,
+        index=True,
+    )
     client_id = Column(Integer, ForeignKey("clients.id"), nullable=False)
     salesman_id = Column(Integer, ForeignKey("salesman.id"), nullable=False)
-    slip_date = Column(Date, nullable=False)
+    slip_date = Column(Date, primary_key=True)  # partition key, so part of every unique key
     vehicle_number = Column(String, nullable=True)
     total_amount = Column(Float, nullable=False)
+    row_version = row_version()
     slip_details = relationship("SlipDetail", back_populates="slip", cascade="all, delete-orphan")
     client = relationship("Clients")
     salesman = relationship("Salesman")
 
+    # Access paths of the routers; existing databases get them from alembic.
+    # One partition per month, created by partitions.py.
+    __table_args__ = (
+        Index("ix_slips_slip_date_id", "slip_date", "id"),  # GET /slips/ keyset order
+        Index("ix_slips_client_id_slip_date", "client_id", "slip_date"),
+        Index("ix_slips_salesman_id_slip_date", "salesman_id", "slip_date"),
+        Index("ix_slips_vehicle_number", "vehicle_number"),
+        Index("ix_slips_row_version_id", "row_version", "id"),  # GET /sync
+        {"postgresql_partition_by": "RANGE (slip_date)"},
+    )
+
 class SlipDetail(Base):
     __tablename__ = "slip_details"
 
     id = Column(Integer, primary_key=True, index=True, autoincrement=True)
-    slip_id = Column(Integer, ForeignKey("slips.id"), nullable=False, index=True)  # FK to slips
+    slip_id = Column(Integer, nullable=False, index=True)  # FK to slips, with slip_date
     product_id = Column(Integer, ForeignKey("products.id"), nullable=False)
     weight = Column(Float, nullable=True)
     quantity = Column(Float, nullable=False)
     rate = Column(Float, nullable=False)
     amount = Column(Float, nullable=False)
-    slip_date = Column(Date, nullable=False)  # typically same as Slip.slip_date but stored here too
+    slip_date = Column(Date, primary_key=True)  # always the slip's own date: the partition key
+    row_version = row_version()
 
     # Relationships to access linked data
     slip = relationship("Slip", back_populates="slip_details")
     product = relationship("Product")
 
+    __table_args__ = (
+        ForeignKeyConstraint(["slip_id", "slip_date"], ["slips.id", "slips.slip_date"]),
+        Index("ix_slip_details_product_id_slip_date", "product_id", "slip_date"),
+        Index("ix_slip_details_row_version_id", "row_version", "id"),
+        {"postgresql_partition_by": "RANGE (slip_date)"},
+    )
+
+
+class SlipArchive(Base):
+    """
+    Slips of archived months, one row per slip with its details inlined
+    (see partitions.py). Ids are the original slip ids.
+    """
+    __tablename__ = "slip_archive"
+
+    id = Column(Integer, primary_key=True)
+    slip_number = Column(String, nullable=False)
+    client_id = Column(Integer, ForeignKey("clients.id"), nullable=False)
+    salesman_id = Column(Integer, ForeignKey("salesman.id"), nullable=False)
+    slip_date = Column(Date, nullable=False)
+    vehicle_number = Column(String, nullable=True)
+    total_amount = Column(Float, nullable=False)
+    quantity = Column(Float, nullable=False, default=0.0)  # sums of the details, for the rollups
+    weight = Column(Float, nullable=False, default=0.0)
+    details = Column(JSONB, nullable=False)  # [{id, product_id, weight, quantity, rate, amount}, ...]
+    archived_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+
+    __table_args__ = (
+        Index("ix_slip_archive_client_id_slip_date", "client_id", "slip_date"),
+        Index("ix_slip_archive_slip_date", "slip_date"),
+    )
+
 
 class SlipSequence(Base):
     __tablename__ = "slip_sequences"
@@ -83,5 +169,97 @@ class Payment(Base):
     amount = Column(Float, nullable=False)
     notes = Column(String, nullable=True)
     date = Column(Date, default=datetime.date.today, nullable=False)
+    row_version = row_version()
 
     client = relationship("Clients")  # Optional, for ORM navigation if needed
+
+    __table_args__ = (
+        Index("ix_payments_client_id_date", "client_id", "date"),
+        Index("ix_payments_row_version_id", "row_version", "id"),
+    )
+
+
+class ClientBalance(Base):
+    """
+    Running per-client totals, kept in step with slips and payments by ledger.py.
+    """
+    __tablename__ = "client_balances"
+
+    client_id = Column(Integer, ForeignKey("clients.id", ondelete="CASCADE"), primary_key=True)
+    billed = Column(Float, nullable=False, default=0.0)
+    paid = Column(Float, nullable=False, default=0.0)
+    outstanding = Column(Float, Computed("billed - paid"))
+
+
+class SalesmanDailySales(Base):
+    """
+    Per salesman per day totals of slips, maintained by rollups.py.
+    """
+    __tablename__ = "salesman_daily_sales"
+
+    day = Column(Date, primary_key=True)
+    salesman_id = Column(Integer, ForeignKey("salesman.id", ondelete="CASCADE"), primary_key=True)
+    slips = Column(Integer, nullable=False, default=0)
+    total_amount = Column(Float, nullable=False, default=0.0)
+    quantity = Column(Float, nullable=False, default=0.0)
+    weight = Column(Float, nullable=False, default=0.0)
+
+
+class ProductDailySales(Base):
+    """
+    Per product per day totals of slip lines, maintained by rollups.py.
+    """
+    __tablename__ = "product_daily_sales"
+
+    day = Column(Date, primary_key=True)
+    product_id = Column(Integer, ForeignKey("products.id", ondelete="CASCADE"), primary_key=True)
+    lines = Column(Integer, nullable=False, default=0)
+    quantity = Column(Float, nullable=False, default=0.0)
+    weight = Column(Float, nullable=False, default=0.0)
+    amount = Column(Float, nullable=False, default=0.0)
+
+
+class TableVersion(Base):
+    """
+    Change counter per table, bumped after every committed write (see versions.py).
+    """
+    __tablename__ = "table_versions"
+
+    name = Column(String, primary_key=True)
+    version = Column(BigInteger, nullable=False, default=1)
+    updated_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+
+
+class Tombstone(Base):
+    """
+    One row per deleted synced row, so GET /sync can tell clients to drop it.
+    """
+    __tablename__ = "tombstones"
+
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    entity = Column(String, nullable=False)  # table name
+    row_id = Column(Integer, nullable=False)
+    row_version = row_version()
+    deleted_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+
+    __table_args__ = (
+        Index("ix_tombstones_row_version_id", "row_version", "id"),
+        Index("ix_tombstones_deleted_at", "deleted_at"),
+    )
+
+
+class IdempotencyKey(Base):
+    """
+    The response to a POST sent with an Idempotency-Key, replayed on retries
+    (see idempotency.py).
+    """
+    __tablename__ = "idempotency_keys"
+
+    scope = Column(String, primary_key=True)  # route, e.g. "POST /slips/"
+    key = Column(String, primary_key=True)
+    request_hash = Column(String(64), nullable=False)  # sha256 of the request body
+    status_code = Column(Integer, nullable=True)  # set before the write's transaction commits
+    response = Column(LargeBinary, nullable=True)
+    created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+
+    __table_args__ = (Index("ix_idempotency_keys_created_at", "created_at"),)
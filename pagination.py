@@ -0,0 +1,25 @@
+import base64
+import json
+
+
+# Opaque cursor tokens for keyset pagination.
+# A cursor is just the sort key of the last row on the page, packed so the
+# frontend can pass it back untouched.
+def encode_cursor(*values) -> str:
+    raw = json.dumps(list(values), default=str, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(token: str) -> list:
+    """
+    Returns the values packed by encode_cursor.
+    Raises ValueError for anything that is not a cursor we produced.
+    """
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except Exception as exc:
+        raise ValueError("Invalid cursor") from exc
+    if not isinstance(values, list):
+        raise ValueError("Invalid cursor")
+    return values
@@ -0,0 +1,193 @@
+"""
+Month partitions of slips and slip_details.
+
+Both tables are partitioned by RANGE (slip_date), one partition per calendar
+month: slips_y2026m10 and slip_details_y2026m10. Details always carry their
+slip's date, (slip_id, slip_date) references slips (id, slip_date), so a slip
+and its details share a month and a query bounded by slip_date only touches
+the partitions of those months.
+
+Partitions are created on first use. Slip creation calls
+slip_partitions.ensure() with the dates it is about to insert; a month this
+worker has not seen yet is created (IF NOT EXISTS) in a short transaction of
+its own, so the slip transaction never holds the DDL locks. Startup creates
+the current and the next month ahead of time, so normally only backdated
+slips take that path.
+
+Closed months can be archived: their slips move to slip_archive, one compact
+row per slip with the details inlined as JSONB, and both partitions are
+dropped. Workers still count an archived month as created; a backdated slip
+for it fails on the missing partition, and slip creation then forgets the
+month and retries once, which creates it again. The ledger, client statements and rollups read slip_archive next to
+slips, so balances and reports do not change; slip lists, the export and
+GET /sync only show live months.
+
+    python partitions.py list
+    python partitions.py ensure 2027-01        # create a month ahead of time
+    python partitions.py archive 2023-01       # months before the current one only
+"""
+import argparse
+import asyncio
+from datetime import date, timedelta
+
+from sqlalchemy import text
+
+from database import engine
+
+PARTITIONED = ("slips", "slip_details")  # referenced table first
+LOCK_KEY = "slip_partitions"  # advisory lock shared by every worker's DDL
+
+
+def month_start(day: date) -> date:
+    return day.replace(day=1)
+
+
+def next_month(day: date) -> date:
+    return (month_start(day) + timedelta(days=32)).replace(day=1)
+
+
+def partition_name(table: str, month: date) -> str:
+    return f"{table}_y{month:%Y}m{month:%m}"
+
+
+def parse_month(value: str) -> date:
+    """
+    YYYY-MM, as taken on the command line.
+    """
+    try:
+        return date.fromisoformat(f"{value}-01")
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected YYYY-MM, got {value!r}")
+
+
+async def create_month(conn, month: date):
+    """
+    Creates the month's partitions of both tables if they are missing.
+    Run inside a transaction holding the LOCK_KEY advisory lock.
+    """
+    for table in PARTITIONED:
+        await conn.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {partition_name(table, month)} PARTITION OF {table} "
+            f"FOR VALUES FROM ('{month.isoformat()}') TO ('{next_month(month).isoformat()}')"
+        ))
+
+
+async def lock_partitions(conn):
+    # Two workers racing on CREATE TABLE IF NOT EXISTS can still collide in the catalog
+    await conn.execute(text("SELECT pg_advisory_xact_lock(hashtext(:key))"), {"key": LOCK_KEY})
+
+
+class SlipPartitions:
+    """
+    Remembers which months exist so the hot path is a set lookup.
+    """
+
+    def __init__(self):
+        self._known = set()
+        self._lock = asyncio.Lock()
+
+    async def ensure(self, *days: date):
+        months = {month_start(day) for day in days} - self._known
+        if not months:
+            return
+        async with self._lock:
+            months -= self._known
+            if not months:
+                return
+            async with engine.begin() as conn:
+                await lock_partitions(conn)
+                for month in sorted(months):
+                    await create_month(conn, month)
+            self._known.update(months)
+
+    def forget(self, month: date):
+        self._known.discard(month_start(month))
+
+
+slip_partitions = SlipPartitions()
+
+
+def missing_partition(exc) -> bool:
+    """
+    Whether a DBAPIError is an insert into a month without a partition, which
+    happens when another process archived a month this worker still knows.
+    """
+    return "no partition of relation" in str(getattr(exc, "orig", exc))
+
+
+async def list_months(conn) -> list[tuple[str, str]]:
+    """
+    (partition, bounds) of every slips partition, oldest first.
+    """
+    result = await conn.execute(text(
+        "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) "
+        "FROM pg_inherits AS i JOIN pg_class AS c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = 'slips'::regclass ORDER BY c.relname"
+    ))
+    return [tuple(row) for row in result.all()]
+
+
+async def archive_month(month: date) -> int:
+    """
+    Moves a closed month's slips into slip_archive and drops its partitions,
+    in one transaction. Returns the number of slips archived.
+    """
+    month = month_start(month)
+    if month >= month_start(date.today()):
+        raise ValueError(f"{month:%Y-%m} is not closed yet")
+    slips, details = (partition_name(table, month) for table in PARTITIONED)
+
+    async with engine.begin() as conn:
+        await lock_partitions(conn)
+        exists = await conn.execute(text("SELECT to_regclass(:name)"), {"name": slips})
+        if exists.scalar_one() is None:
+            return 0
+        result = await conn.execute(text(f"""
+            INSERT INTO slip_archive (id, slip_number, client_id, salesman_id, slip_date,
+                                      vehicle_number, total_amount, quantity, weight, details)
+            SELECT s.id, s.slip_number, s.client_id, s.salesman_id, s.slip_date,
+                   s.vehicle_number, s.total_amount,
+                   coalesce(sum(d.quantity), 0), coalesce(sum(coalesce(d.weight, 0)), 0),
+                   coalesce(
+                       jsonb_agg(jsonb_build_object(
+                           'id', d.id, 'product_id', d.product_id, 'weight', d.weight,
+                           'quantity', d.quantity, 'rate', d.rate, 'amount', d.amount
+                       ) ORDER BY d.id) FILTER (WHERE d.id IS NOT NULL),
+                       '[]'::jsonb
+                   )
+            FROM {slips} AS s
+            LEFT JOIN {details} AS d ON d.slip_id = s.id AND d.slip_date = s.slip_date
+            GROUP BY s.id, s.slip_date
+        """))
+        archived = result.rowcount
+        # Referencing side first; a referenced partition has to be detached before it can go
+        await conn.execute(text(f"DROP TABLE {details}"))
+        await conn.execute(text(f"ALTER TABLE slips DETACH PARTITION {slips}"))
+        await conn.execute(text(f"DROP TABLE {slips}"))
+
+    slip_partitions.forget(month)
+    return archived
+
+
+async def _main(args):
+    if args.command == "list":
+        async with engine.connect() as conn:
+            for name, bounds in await list_months(conn):
+                print(f"{name}  {bounds}")
+    elif args.command == "ensure":
+        await slip_partitions.ensure(args.month)
+        print(f"{partition_name('slips', args.month)} ready")
+    else:
+        archived = await archive_month(args.month)
+        print(f"{archived} slips of {args.month:%Y-%m} archived")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Monthly slip partitions")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("list", help="show the live month partitions")
+    ensure = sub.add_parser("ensure", help="create a month's partitions")
+    ensure.add_argument("month", type=parse_month, help="YYYY-MM")
+    archive = sub.add_parser("archive", help="move a closed month into slip_archive")
+    archive.add_argument("month", type=parse_month, help="YYYY-MM")
+    asyncio.run(_main(parser.parse_args()))
@@ -0,0 +1,102 @@
+"""
+Cross-worker notifications.
+
+PUBSUB_BACKEND picks how a message reaches the other uvicorn workers:
+
+    local  (default) in-process only, enough for a single worker
+    pg     Postgres LISTEN/NOTIFY over one dedicated asyncpg connection per worker
+
+Handlers are plain callables taking the payload string. If the pg connection
+drops, every handler gets RESYNC once it is back, since anything published in
+between was missed.
+"""
+import asyncio
+import logging
+import os
+
+import asyncpg
+
+from database import engine
+
+PUBSUB_BACKEND = os.getenv("PUBSUB_BACKEND", "local")
+RECONNECT_SECONDS = 5
+RESYNC = "*"
+
+logger = logging.getLogger(__name__)
+
+
+class PubSub:
+    def __init__(self, backend: str):
+        self.backend = backend
+        self._handlers = {}  # channel -> [callback]
+        self._conn = None
+        self._send_lock = asyncio.Lock()
+        self._reconnect_task = None
+
+    def subscribe(self, channel: str, callback):
+        self._handlers.setdefault(channel, []).append(callback)
+        if self._conn is not None:
+            asyncio.get_running_loop().create_task(self._conn.add_listener(channel, self._on_notify))
+
+    async def start(self):
+        if self.backend != "pg":
+            return
+        # plain asyncpg DSN, without the SQLAlchemy-only query options
+        dsn = engine.url.set(drivername="postgresql", query={}).render_as_string(hide_password=False)
+        conn = await asyncpg.connect(dsn)
+        for channel in self._handlers:
+            await conn.add_listener(channel, self._on_notify)
+        conn.add_termination_listener(self._on_terminate)
+        self._conn = conn
+
+    async def stop(self):
+        if self._reconnect_task is not None:
+            self._reconnect_task.cancel()
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            await conn.close()
+
+    def _on_notify(self, connection, pid, channel, payload):
+        self._dispatch(channel, payload)
+
+    def _on_terminate(self, connection):
+        if connection is not self._conn:
+            return
+        logger.warning("pubsub connection lost, reconnecting")
+        self._conn = None
+        self._reconnect_task = asyncio.get_running_loop().create_task(self._reconnect())
+
+    async def _reconnect(self):
+        while self._conn is None:
+            try:
+                await self.start()
+            except (OSError, asyncpg.PostgresError):
+                await asyncio.sleep(RECONNECT_SECONDS)
+        for channel in self._handlers:
+            self._dispatch(channel, RESYNC)
+
+    def _dispatch(self, channel: str, payload: str):
+        for callback in self._handlers.get(channel, ()):
+            try:
+                callback(payload)
+            except Exception:
+                logger.exception("pubsub handler failed on %s", channel)
+
+    async def publish(self, channel: str, payload: str):
+        """
+        Delivers payload to every subscriber of channel, in every worker.
+        Call it after the commit the message is about.
+        """
+        if self._conn is None:
+            self._dispatch(channel, payload)
+            return
+        try:
+            async with self._send_lock:
+                await self._conn.execute("SELECT pg_notify($1, $2)", channel, payload)
+        except (OSError, asyncpg.PostgresError):
+            # At least keep this worker right, the reconnect will resync the others
+            logger.exception("pubsub publish failed on %s", channel)
+            self._dispatch(channel, payload)
+
+
+pubsub = PubSub(PUBSUB_BACKEND)
@@ -0,0 +1,183 @@
+"""
+Daily sales rollups behind /reports.
+
+salesman_daily_sales and product_daily_sales hold one row per day per
+salesman/product. Slip creation adds to them in its own transaction, so a
+multi-year report reads a few thousand rollup rows instead of every slip
+detail ever written.
+
+Backfill or repair them from slips, slip_details and slip_archive with:
+
+    python rollups.py rebuild
+"""
+import argparse
+import asyncio
+
+from sqlalchemy import select, func, text, column, true, union_all, Integer, Float
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import Slip, SlipDetail, SlipArchive, SalesmanDailySales, ProductDailySales
+
+
+async def record_slips(session: AsyncSession, slips):
+    """
+    Adds freshly inserted slips (SlipCreate) onto the daily rollups with one
+    upsert per table. Must be called inside the slip transaction.
+    """
+    by_salesman = {}
+    by_product = {}
+    for slip in slips:
+        row = by_salesman.setdefault(
+            (slip.slip_date, slip.salesman_id),
+            {"slips": 0, "total_amount": 0.0, "quantity": 0.0, "weight": 0.0},
+        )
+        row["slips"] += 1
+        row["total_amount"] += slip.total_amount
+        for detail in slip.slip_details:
+            row["quantity"] += detail.quantity
+            row["weight"] += detail.weight or 0.0
+            line = by_product.setdefault(
+                (detail.slip_date, detail.product_id),
+                {"lines": 0, "quantity": 0.0, "weight": 0.0, "amount": 0.0},
+            )
+            line["lines"] += 1
+            line["quantity"] += detail.quantity
+            line["weight"] += detail.weight or 0.0
+            line["amount"] += detail.amount
+
+    # sorted keys give every transaction the same lock order
+    if by_salesman:
+        stmt = insert(SalesmanDailySales).values([
+            {"day": day, "salesman_id": salesman_id, **totals}
+            for (day, salesman_id), totals in sorted(by_salesman.items())
+        ])
+        await session.execute(_accumulate(stmt, SalesmanDailySales, ["slips", "total_amount", "quantity", "weight"]))
+    if by_product:
+        stmt = insert(ProductDailySales).values([
+            {"day": day, "product_id": product_id, **totals}
+            for (day, product_id), totals in sorted(by_product.items())
+        ])
+        await session.execute(_accumulate(stmt, ProductDailySales, ["lines", "quantity", "weight", "amount"]))
+
+
+def _accumulate(stmt, model, columns):
+    keys = [column.name for column in model.__table__.primary_key]
+    return stmt.on_conflict_do_update(
+        index_elements=keys,
+        set_={column: getattr(model, column) + stmt.excluded[column] for column in columns},
+    )
+
+
+async def rebuild_rollups(session: AsyncSession):
+    """
+    Recomputes both rollup tables from scratch in one transaction, archived
+    months included.
+    """
+    detail_totals = (
+        select(
+            SlipDetail.slip_id,
+            SlipDetail.slip_date,
+            func.sum(SlipDetail.quantity).label("quantity"),
+            func.sum(func.coalesce(SlipDetail.weight, 0.0)).label("weight"),
+        )
+        .group_by(SlipDetail.slip_id, SlipDetail.slip_date)
+        .subquery()
+    )
+    slips = union_all(
+        select(
+            Slip.slip_date,
+            Slip.salesman_id,
+            Slip.total_amount,
+            func.coalesce(detail_totals.c.quantity, 0.0).label("quantity"),
+            func.coalesce(detail_totals.c.weight, 0.0).label("weight"),
+        ).outerjoin(
+            detail_totals,
+            (detail_totals.c.slip_id == Slip.id) & (detail_totals.c.slip_date == Slip.slip_date),
+        ),
+        select(
+            SlipArchive.slip_date,
+            SlipArchive.salesman_id,
+            SlipArchive.total_amount,
+            SlipArchive.quantity,
+            SlipArchive.weight,
+        ),
+    ).subquery()
+    salesman_rows = (
+        select(
+            slips.c.slip_date,
+            slips.c.salesman_id,
+            func.count(),
+            func.sum(slips.c.total_amount),
+            func.sum(slips.c.quantity),
+            func.sum(slips.c.weight),
+        )
+        .group_by(slips.c.slip_date, slips.c.salesman_id)
+    )
+
+    archived_lines = func.jsonb_to_recordset(SlipArchive.details).table_valued(
+        column("product_id", Integer),
+        column("quantity", Float),
+        column("weight", Float),
+        column("amount", Float),
+    ).render_derived(with_types=True).lateral("line")
+    lines = union_all(
+        select(
+            SlipDetail.slip_date,
+            SlipDetail.product_id,
+            SlipDetail.quantity,
+            func.coalesce(SlipDetail.weight, 0.0).label("weight"),
+            SlipDetail.amount,
+        ),
+        select(
+            SlipArchive.slip_date,
+            archived_lines.c.product_id,
+            archived_lines.c.quantity,
+            func.coalesce(archived_lines.c.weight, 0.0),
+            archived_lines.c.amount,
+        ).join(archived_lines, true()),
+    ).subquery()
+    product_rows = (
+        select(
+            lines.c.slip_date,
+            lines.c.product_id,
+            func.count(),
+            func.sum(lines.c.quantity),
+            func.sum(lines.c.weight),
+            func.sum(lines.c.amount),
+        )
+        .group_by(lines.c.slip_date, lines.c.product_id)
+    )
+
+    async with session.begin():
+        # New slips wait for the rebuild instead of adding onto rows it is replacing
+        await session.execute(text(
+            "LOCK TABLE salesman_daily_sales, product_daily_sales IN EXCLUSIVE MODE"
+        ))
+        await session.execute(text("DELETE FROM salesman_daily_sales"))
+        await session.execute(text("DELETE FROM product_daily_sales"))
+        await session.execute(
+            insert(SalesmanDailySales).from_select(
+                ["day", "salesman_id", "slips", "total_amount", "quantity", "weight"], salesman_rows
+            )
+        )
+        await session.execute(
+            insert(ProductDailySales).from_select(
+                ["day", "product_id", "lines", "quantity", "weight", "amount"], product_rows
+            )
+        )
+
+
+async def _main(args):
+    from database import AsyncSessionLocal
+
+    async with AsyncSessionLocal() as session:
+        await rebuild_rollups(session)
+    print("rollups rebuilt")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Daily sales rollup maintenance")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("rebuild", help="recompute the rollups from slips, slip_details and slip_archive")
+    asyncio.run(_main(parser.parse_args()))
@@ -2,5 +2,10 @@ from .clients import router as clients_router
 from .products import router as products_router
 from .slips import router as slips_router
 from .payments import router as payments_router
+from .internal import router as internal_router
+from .reports import router as reports_router
+from .search import router as search_router
+from .sync import router as sync_router
+from .events import router as events_router
 # add more routers as your app grows
 #from .salesmen import router as salesmen_router
\ No newline at end of file
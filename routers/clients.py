@@ -1,35 +1,173 @@
-from fastapi import APIRouter, Depends, HTTPException
+import csv
+import io
+from datetime import date
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, UploadFile, File
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from models import Clients
-from schemas import ClientCreate, ClientResponse
-from database import AsyncSessionLocal  # adjust as per your code
+from schemas import ClientCreate, ClientResponse, ClientBalanceResponse, ClientStatement, ImportReport
+from database import get_session, get_read_session, read_sessionmaker
+from pagination import encode_cursor, decode_cursor
+from ledger import get_balance, get_balances, statement_query, get_opening_balance, STATEMENT_COLUMNS
+from cache import cached_list_response, list_adapter
+from versions import mark_changed, conditional
+from writes import insert_returning, update_returning, delete_returning
+from search import search_indexes
+from sync import record_deleted
+from budget import query_budget
+from imports import import_csv, ImportFileError, CLIENT_IMPORT
 
 router = APIRouter(prefix="/clients", tags=["clients"])
-
-# Dependency
-async def get_session():
-    async with AsyncSessionLocal() as session:
-        yield session
+clients_adapter = list_adapter(ClientResponse)
 
 # CREATE
 @router.post("/", response_model=ClientResponse)
+@query_budget(2)
 async def create_client(client: ClientCreate, session: AsyncSession = Depends(get_session)):
-    db_client = Clients(**client.model_dump())  # For Pydantic v2+
-    session.add(db_client)
+    db_client = await insert_returning(session, Clients, client.model_dump())  # For Pydantic v2+
     await session.commit()
-    await session.refresh(db_client)
+    await mark_changed(session, "clients")
+    await search_indexes.put("clients", db_client)
     return db_client
 
+# IMPORT
+@router.post("/import", response_model=ImportReport)
+@query_budget(6)  # staging table, checks, merge, errors, version bump; COPY is not counted
+async def import_clients(file: UploadFile = File(...), session: AsyncSession = Depends(get_session)):
+    """
+    Creates or updates clients from a CSV upload, see imports.py for the format.
+    """
+    try:
+        report, written = await import_csv(session, CLIENT_IMPORT, file)
+    except ImportFileError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    if written:
+        await mark_changed(session, "clients")
+        await search_indexes.put("clients", *written)
+    return report
+
 # READ ALL
-@router.get("/", response_model=list[ClientResponse])
-async def get_clients(session: AsyncSession = Depends(get_session)):
-    result = await session.execute(select(Clients))
-    return result.scalars().all()
+@router.get("/", response_model=list[ClientResponse], dependencies=[conditional("clients")])
+@query_budget(2)
+async def get_clients():
+    return await cached_list_response("clients", select(Clients), clients_adapter)
+
+# BALANCES (declared before /{client_id} so "balances" is not read as an id)
+@router.get("/balances", response_model=list[ClientBalanceResponse], dependencies=[conditional("clients", "client_balances")])
+@query_budget(2)
+async def get_client_balances(
+    ids: list[int] | None = Query(None, description="Limit to these client ids"),
+    session: AsyncSession = Depends(get_read_session)
+):
+    return await get_balances(session, ids)
+
+@router.get("/{client_id}/balance", response_model=ClientBalanceResponse, dependencies=[conditional("clients", "client_balances")])
+@query_budget(2)
+async def get_client_balance(client_id: int, session: AsyncSession = Depends(get_read_session)):
+    balance = await get_balance(session, client_id)
+    if not balance:
+        raise HTTPException(status_code=404, detail="Client not found")
+    return balance
+
+# STATEMENT
+STATEMENT_BATCH_SIZE = 1000
+
+
+def _csv(rows) -> str:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    return buffer.getvalue()
+
+
+def _statement_row(row):
+    return [row.date, row.kind, row.id, row.reference, row.debit, row.credit, row.balance]
+
+
+async def stream_statement(session_factory, client_id: int, date_from, date_to):
+    """
+    The whole statement as CSV from a server-side cursor, opening balance first.
+    """
+    async with session_factory() as session:
+        yield _csv([STATEMENT_COLUMNS])
+        query = statement_query(client_id, date_from, date_to)
+        result = await session.stream(query.execution_options(yield_per=STATEMENT_BATCH_SIZE))
+        opening = None
+        async for rows in result.partitions():
+            if opening is None:
+                opening = rows[0].opening
+                yield _csv([[date_from, "opening", "", "", "", "", opening]])
+            yield _csv(_statement_row(row) for row in rows)
+        if opening is None:
+            opening = await get_opening_balance(session, client_id, date_from)
+            yield _csv([[date_from, "opening", "", "", "", "", opening]])
+
+
+@router.get("/{client_id}/statement", response_model=ClientStatement, dependencies=[conditional("clients", "slips", "payments")])
+@query_budget(4)
+async def get_client_statement(
+    request: Request,
+    client_id: int,
+    date_from: Optional[date] = Query(None, alias="from"),
+    date_to: Optional[date] = Query(None, alias="to"),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    limit: int = Query(100, ge=1, le=1000),
+    fmt: str = Query("json", alias="format", pattern="^(json|csv)$"),
+    session: AsyncSession = Depends(get_read_session)
+):
+    """
+    Slips (debits) and payments (credits) in date order with the running
+    balance. JSON is keyset paginated; format=csv streams the whole range.
+    """
+    found = await session.execute(select(Clients.id).where(Clients.id == client_id))
+    if found.scalar() is None:
+        raise HTTPException(status_code=404, detail="Client not found")
+
+    if fmt == "csv":
+        return StreamingResponse(
+            stream_statement(read_sessionmaker(request), client_id, date_from, date_to),
+            media_type="text/csv",
+            headers={"Content-Disposition": f'attachment; filename="statement-{client_id}.csv"'},
+        )
+
+    after = None
+    if cursor:
+        try:
+            last_date, last_seq, last_id, balance = decode_cursor(cursor)
+            after = (date.fromisoformat(last_date), int(last_seq), int(last_id), float(balance))
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    # One extra row tells us whether there is a next page.
+    result = await session.execute(statement_query(client_id, date_from, date_to, after, limit + 1))
+    rows = result.all()
+    if rows:
+        opening = rows[0].opening
+    elif after is not None:
+        opening = after[3]
+    else:
+        opening = await get_opening_balance(session, client_id, date_from)
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(last.date.isoformat(), last.seq, last.id, last.balance)
+
+    return {
+        "client_id": client_id,
+        "date_from": date_from,
+        "date_to": date_to,
+        "opening_balance": opening,
+        "entries": [dict(row._mapping) for row in rows],
+        "next_cursor": next_cursor,
+    }
 
 # READ ONE
-@router.get("/{client_id}", response_model=ClientResponse)
-async def get_client(client_id: int, session: AsyncSession = Depends(get_session)):
+@router.get("/{client_id}", response_model=ClientResponse, dependencies=[conditional("clients")])
+@query_budget(2)
+async def get_client(client_id: int, session: AsyncSession = Depends(get_read_session)):
     result = await session.execute(select(Clients).filter(Clients.id == client_id))
     client = result.scalars().first()
     if not client:
@@ -38,29 +176,29 @@ async def get_client(client_id: int, session: AsyncSession = Depends(get_session
 
 # UPDATE
 @router.put("/{client_id}", response_model=ClientResponse)
+@query_budget(2)
 async def update_client(
     client_id: int,
     client_update: ClientCreate,
     session: AsyncSession = Depends(get_session)
 ):
-    result = await session.execute(select(Clients).filter(Clients.id == client_id))
-    db_client = result.scalars().first()
+    db_client = await update_returning(session, Clients, client_id, client_update.model_dump())
     if not db_client:
         raise HTTPException(status_code=404, detail="Client not found")
-    db_client.name = client_update.name
-    db_client.phone = client_update.phone
-    db_client.address = client_update.address
     await session.commit()
-    await session.refresh(db_client)
+    await mark_changed(session, "clients")
+    await search_indexes.put("clients", db_client)
     return db_client
 
 # DELETE
 @router.delete("/{client_id}")
+@query_budget(3)
 async def delete_client(client_id: int, session: AsyncSession = Depends(get_session)):
-    result = await session.execute(select(Clients).filter(Clients.id == client_id))
-    db_client = result.scalars().first()
-    if not db_client:
+    deleted = await delete_returning(session, Clients, client_id)
+    if not deleted:
         raise HTTPException(status_code=404, detail="Client not found")
-    await session.delete(db_client)
+    await record_deleted(session, "clients", client_id)
     await session.commit()
+    await mark_changed(session, "clients", "client_balances")
+    await search_indexes.remove("clients", client_id)
     return {"detail": "Client deleted successfully"}
@@ -0,0 +1,75 @@
+import json
+from typing import Optional
+from fastapi import APIRouter, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+from events import event_hub
+from budget import query_budget
+
+router = APIRouter(tags=["events"])
+
+
+def _dumps(event: dict) -> str:
+    return json.dumps(event, default=str, separators=(",", ":"))
+
+
+async def sse_stream(request: Request, subscription):
+    try:
+        yield ": connected\n\n"
+        while True:
+            event = await subscription.next()
+            if event is None:
+                break
+            if await request.is_disconnected():
+                break
+            if not event:
+                yield ": ping\n\n"  # keeps proxies from timing the stream out
+                continue
+            yield f"event: {event['type']}\ndata: {_dumps(event)}\n\n"
+    finally:
+        event_hub.unsubscribe(subscription)
+
+
+@router.get("/events/stream")
+@query_budget(0)
+async def stream_events(request: Request, client_id: Optional[int] = None, salesman_id: Optional[int] = None):
+    """
+    Server-sent events for created/updated/deleted slips and payments,
+    optionally only those of one client and/or salesman. An "overflow" or
+    "resync" event means some were missed: refetch, then reconnect.
+    """
+    try:
+        subscription = event_hub.subscribe(client_id, salesman_id)
+    except OverflowError as exc:
+        raise HTTPException(status_code=503, detail=str(exc))
+    return StreamingResponse(
+        sse_stream(request, subscription),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.websocket("/ws/events")
+async def websocket_events(websocket: WebSocket, client_id: Optional[int] = None, salesman_id: Optional[int] = None):
+    """
+    Same events as /events/stream, one JSON text frame each.
+    """
+    try:
+        subscription = event_hub.subscribe(client_id, salesman_id)
+    except OverflowError:
+        await websocket.close(code=1013)  # try again later
+        return
+    await websocket.accept()
+    try:
+        while True:
+            event = await subscription.next()
+            if event is None:
+                break
+            if not event:
+                await websocket.send_text(_dumps({"type": "ping"}))
+                continue
+            await websocket.send_text(_dumps(event))
+        await websocket.close()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        event_hub.unsubscribe(subscription)
@@ -0,0 +1,16 @@
+from fastapi import APIRouter
+from database import pool_status
+from budget import query_budget
+
+router = APIRouter(prefix="/internal", tags=["internal"])
+
+@router.get("/pool")
+@query_budget(0)
+async def get_pool_status():
+    """
+    Connection pool of the worker that answers: checked out and idle
+    connections, overflow in use, and how long checkouts have waited.
+    Each uvicorn worker has its own pool, so multiply by the worker count
+    when sizing against max_connections.
+    """
+    return pool_status()
@@ -1,18 +1,22 @@
-from fastapi import APIRouter, Depends, HTTPException,Query,Path
+from fastapi import APIRouter, Depends, HTTPException,Query,Path, Header
+from typing import Optional
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from models import Payment,Clients
 from schemas import PaymentCreate, PaymentResponse
-from database import AsyncSessionLocal
+from database import get_session, get_read_session
 from sqlalchemy.orm import selectinload
+from ledger import record_paid, apply_balance_deltas
+from versions import mark_changed, conditional
+from writes import insert_returning, update_returning, delete_returning
+from sync import record_deleted
+from events import publish_events, payment_event
+from budget import query_budget
+from idempotency import idempotent, IDEMPOTENCY_HEADER
 
 
 router = APIRouter(prefix="/payments", tags=["payments"])
 
-async def get_session():
-    async with AsyncSessionLocal() as session:
-        yield session
-
 # @router.post("/", response_model=PaymentResponse)
 # async def create_payment(payment: PaymentCreate, session: AsyncSession = Depends(get_session)):
 #     db_payment = Payment(**payment.model_dump())
@@ -31,25 +35,40 @@ async def get_session():
 #     return db_payment_with_client
 
 @router.post("/", response_model=PaymentResponse)
-async def create_payment(payment: PaymentCreate, session: AsyncSession = Depends(get_session)):
-    db_payment = Payment(**payment.model_dump())
-    session.add(db_payment)
-    await session.commit()
-    await session.refresh(db_payment)
+@query_budget(5)  # idempotency claim and answer, insert, ledger, version bump
+async def create_payment(
+    payment: PaymentCreate,
+    session: AsyncSession = Depends(get_session),
+    idempotency_key: Optional[str] = Header(None, alias=IDEMPOTENCY_HEADER),
+):
+    return await idempotent(
+        "POST /payments/", idempotency_key, payment, lambda claim: _create_payment(payment, session, claim)
+    )
 
-    # Eager load client
-    result = await session.execute(
-        select(Payment)
-        .options(selectinload(Payment.client))
-        .where(Payment.id == db_payment.id)
+
+async def _create_payment(payment: PaymentCreate, session: AsyncSession, claim=None):
+    # A replayed key inserts nothing; see idempotency.py
+    if claim is not None and not await claim.take(session):
+        await session.commit()
+        return None
+    # Insert and the nested client come back from one statement
+    db_payment = await insert_returning(
+        session, Payment, payment.model_dump(), nested={"client": (Clients, "client_id")}
     )
-    db_payment_with_client = result.scalar_one()
-    return db_payment_with_client  # This ensures `client` is present
+    await record_paid(session, payment.client_id, payment.amount)
+    if claim is not None:
+        # Stored with the payment, in the same commit
+        await claim.answer(session, PaymentResponse.model_validate(db_payment, from_attributes=True))
+    await session.commit()
+    await mark_changed(session, "payments", "client_balances")
+    await publish_events(payment_event("created", db_payment))
+    return db_payment
 
-@router.get("/", response_model=list[PaymentResponse])
+@router.get("/", response_model=list[PaymentResponse], dependencies=[conditional("payments", "clients")])
+@query_budget(3)
 async def get_payments(
     limit: int = Query(100, ge=1, le=500),  # default 100, min 1, max 500
-    session: AsyncSession = Depends(get_session)
+    session: AsyncSession = Depends(get_read_session)
 ):
     result = await session.execute(
         select(Payment)
@@ -61,43 +80,46 @@ async def get_payments(
     return payments
 
 @router.delete("/{payment_id}")
+@query_budget(4)
 async def delete_payment(payment_id: int, session: AsyncSession = Depends(get_session)):
-    result = await session.execute(select(Payment).where(Payment.id == payment_id))
-    payment = result.scalar_one_or_none()
+    payment = await delete_returning(session, Payment, payment_id, columns=("id", "client_id", "amount"))
     if not payment:
         raise HTTPException(status_code=404, detail="Payment not found")
-    await session.delete(payment)
+    await record_paid(session, payment["client_id"], -payment["amount"])
+    await record_deleted(session, "payments", payment_id)
     await session.commit()
+    await mark_changed(session, "payments", "client_balances")
+    await publish_events(payment_event("deleted", payment))
     return {"detail": "Payment deleted"}
 
 
 @router.put("/{payment_id}", response_model=PaymentResponse)
+@query_budget(3)
 async def update_payment(
     payment_id: int = Path(..., description="ID of the payment to update"),
     payment_update: PaymentCreate = None,   # or make a separate PaymentUpdate schema
     session: AsyncSession = Depends(get_session)
 ):
-    # Fetch payment
-    result = await session.execute(select(Payment).where(Payment.id == payment_id))
-    db_payment = result.scalar_one_or_none()
-
+    # Update only fields provided; the old client/amount and the nested
+    # client come back from the same statement
+    update_data = payment_update.model_dump(exclude_unset=True)
+    db_payment = await update_returning(
+        session, Payment, payment_id, update_data,
+        nested={"client": (Clients, "client_id")},
+        previous=("client_id", "amount"),
+    )
     if not db_payment:
         raise HTTPException(status_code=404, detail="Payment not found")
+    old_client_id = db_payment.pop("old_client_id")
+    old_amount = db_payment.pop("old_amount")
 
-    # Update only fields provided
-    update_data = payment_update.model_dump(exclude_unset=True)
-    for key, value in update_data.items():
-        setattr(db_payment, key, value)
+    # Move the payment off the old client/amount and onto the new one
+    deltas = {old_client_id: (0.0, -old_amount)}
+    billed, paid = deltas.get(db_payment["client_id"], (0.0, 0.0))
+    deltas[db_payment["client_id"]] = (billed, paid + db_payment["amount"])
+    await apply_balance_deltas(session, deltas)
 
     await session.commit()
-    await session.refresh(db_payment)
-
-    # Eager load client for response
-    result = await session.execute(
-        select(Payment)
-        .options(selectinload(Payment.client))
-        .where(Payment.id == db_payment.id)
-    )
-    updated_payment = result.scalar_one()
-
-    return updated_payment
+    await mark_changed(session, "payments", "client_balances")
+    await publish_events(payment_event("updated", db_payment, old_client_id))
+    return db_payment
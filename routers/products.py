@@ -1,31 +1,53 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from models import Product
-from schemas import ProductCreate, ProductResponse
-from database import AsyncSessionLocal
+from schemas import ProductCreate, ProductResponse, ImportReport
+from database import get_session, get_read_session
+from cache import cached_list_response, list_adapter
+from versions import mark_changed, conditional
+from writes import insert_returning, update_returning, delete_returning
+from search import search_indexes
+from sync import record_deleted
+from budget import query_budget
+from imports import import_csv, ImportFileError, PRODUCT_IMPORT
 
 router = APIRouter(prefix="/products", tags=["products"])
-
-async def get_session():
-    async with AsyncSessionLocal() as session:
-        yield session
+products_adapter = list_adapter(ProductResponse)
 
 @router.post("/", response_model=ProductResponse)
+@query_budget(2)
 async def create_product(product: ProductCreate, session: AsyncSession = Depends(get_session)):
-    db_product = Product(**product.model_dump())
-    session.add(db_product)
+    db_product = await insert_returning(session, Product, product.model_dump())
     await session.commit()
-    await session.refresh(db_product)
+    await mark_changed(session, "products")
+    await search_indexes.put("products", db_product)
     return db_product
 
-@router.get("/", response_model=list[ProductResponse])
-async def get_products(session: AsyncSession = Depends(get_session)):
-    result = await session.execute(select(Product))
-    return result.scalars().all()
+# IMPORT
+@router.post("/import", response_model=ImportReport)
+@query_budget(6)  # staging table, checks, merge, errors, version bump; COPY is not counted
+async def import_products(file: UploadFile = File(...), session: AsyncSession = Depends(get_session)):
+    """
+    Creates or updates products from a CSV upload, see imports.py for the format.
+    """
+    try:
+        report, written = await import_csv(session, PRODUCT_IMPORT, file)
+    except ImportFileError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    if written:
+        await mark_changed(session, "products")
+        await search_indexes.put("products", *written)
+    return report
+
+@router.get("/", response_model=list[ProductResponse], dependencies=[conditional("products")])
+@query_budget(2)
+async def get_products():
+    return await cached_list_response("products", select(Product), products_adapter)
 
-@router.get("/{product_id}", response_model=ProductResponse)
-async def get_product(product_id: int, session: AsyncSession = Depends(get_session)):
+@router.get("/{product_id}", response_model=ProductResponse, dependencies=[conditional("products")])
+@query_budget(2)
+async def get_product(product_id: int, session: AsyncSession = Depends(get_read_session)):
     result = await session.execute(select(Product).filter(Product.id == product_id))
     product = result.scalars().first()
     if not product:
@@ -33,24 +55,24 @@ async def get_product(product_id: int, session: AsyncSession = Depends(get_sessi
     return product
 
 @router.put("/{product_id}", response_model=ProductResponse)
+@query_budget(2)
 async def update_product(product_id: int, product_update: ProductCreate, session: AsyncSession = Depends(get_session)):
-    result = await session.execute(select(Product).filter(Product.id == product_id))
-    db_product = result.scalars().first()
+    db_product = await update_returning(session, Product, product_id, product_update.model_dump())
     if not db_product:
         raise HTTPException(status_code=404, detail="Product not found")
-    db_product.name = product_update.name
-    db_product.weight = product_update.weight
-    db_product.rate = product_update.rate
     await session.commit()
-    await session.refresh(db_product)
+    await mark_changed(session, "products")
+    await search_indexes.put("products", db_product)
     return db_product
 
 @router.delete("/{product_id}")
+@query_budget(3)
 async def delete_product(product_id: int, session: AsyncSession = Depends(get_session)):
-    result = await session.execute(select(Product).filter(Product.id == product_id))
-    db_product = result.scalars().first()
-    if not db_product:
+    deleted = await delete_returning(session, Product, product_id)
+    if not deleted:
         raise HTTPException(status_code=404, detail="Product not found")
-    await session.delete(db_product)
+    await record_deleted(session, "products", product_id)
     await session.commit()
+    await mark_changed(session, "products")
+    await search_indexes.remove("products", product_id)
     return {"detail": "Product deleted successfully"}
@@ -0,0 +1,100 @@
+from datetime import date
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import select, func, cast, Date
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import Salesman, Product, SalesmanDailySales, ProductDailySales
+from schemas import SalesmanReportRow, ProductReportRow
+from database import get_read_session
+from versions import conditional
+from budget import query_budget
+
+router = APIRouter(prefix="/reports", tags=["reports"])
+
+# Both reports read the daily rollups (see rollups.py), never slip_details
+PERIOD_PATTERN = "^(day|week|month)$"
+
+
+def period_of(day_column, group_by: str):
+    if group_by == "day":
+        return day_column
+    # weeks start on Monday, as in Postgres
+    return cast(func.date_trunc(group_by, day_column), Date)
+
+
+def check_range(date_from: date, date_to: date):
+    if date_from > date_to:
+        raise HTTPException(status_code=400, detail="date_from is after date_to")
+
+
+@router.get("/salesmen", response_model=list[SalesmanReportRow], dependencies=[conditional("slips", "salesman")])
+@query_budget(2)
+async def salesmen_report(
+    date_from: date,
+    date_to: date,
+    group_by: str = Query("day", pattern=PERIOD_PATTERN),
+    salesman_id: Optional[int] = None,
+    session: AsyncSession = Depends(get_read_session)
+):
+    """
+    Sales per salesman per period. Commission is Salesman.commission taken as
+    a percentage of the slip totals.
+    """
+    check_range(date_from, date_to)
+    period = period_of(SalesmanDailySales.day, group_by).label("period")
+    total = func.sum(SalesmanDailySales.total_amount)
+    query = (
+        select(
+            period,
+            Salesman.id.label("salesman_id"),
+            Salesman.name.label("salesman_name"),
+            func.sum(SalesmanDailySales.slips).label("slips"),
+            total.label("total_amount"),
+            func.sum(SalesmanDailySales.quantity).label("quantity"),
+            func.sum(SalesmanDailySales.weight).label("weight"),
+            (total * func.coalesce(Salesman.commission, 0.0) / 100).label("commission"),
+        )
+        .join(Salesman, Salesman.id == SalesmanDailySales.salesman_id)
+        .where(SalesmanDailySales.day.between(date_from, date_to))
+        .group_by(period, Salesman.id)
+        .order_by(period, Salesman.id)
+    )
+    if salesman_id is not None:
+        query = query.where(SalesmanDailySales.salesman_id == salesman_id)
+    result = await session.execute(query)
+    return result.mappings().all()
+
+
+@router.get("/products", response_model=list[ProductReportRow], dependencies=[conditional("slips", "products")])
+@query_budget(2)
+async def products_report(
+    date_from: date,
+    date_to: date,
+    group_by: str = Query("day", pattern=PERIOD_PATTERN),
+    product_id: Optional[int] = None,
+    session: AsyncSession = Depends(get_read_session)
+):
+    """
+    Quantity, weight and amount sold per product per period.
+    """
+    check_range(date_from, date_to)
+    period = period_of(ProductDailySales.day, group_by).label("period")
+    query = (
+        select(
+            period,
+            Product.id.label("product_id"),
+            Product.name.label("product_name"),
+            func.sum(ProductDailySales.lines).label("lines"),
+            func.sum(ProductDailySales.quantity).label("quantity"),
+            func.sum(ProductDailySales.weight).label("weight"),
+            func.sum(ProductDailySales.amount).label("amount"),
+        )
+        .join(Product, Product.id == ProductDailySales.product_id)
+        .where(ProductDailySales.day.between(date_from, date_to))
+        .group_by(period, Product.id)
+        .order_by(period, Product.id)
+    )
+    if product_id is not None:
+        query = query.where(ProductDailySales.product_id == product_id)
+    result = await session.execute(query)
+    return result.mappings().all()
@@ -0,0 +1,23 @@
+from fastapi import APIRouter, Depends, Path, Query
+from sqlalchemy.ext.asyncio import AsyncSession
+from schemas import SearchHit
+from database import get_read_session
+from search import search, SEARCH_LIMIT
+from budget import query_budget
+
+router = APIRouter(prefix="/search", tags=["search"])
+
+
+@router.get("/{kind}", response_model=list[SearchHit])
+@query_budget(1)
+async def search_kind(
+    kind: str = Path(..., pattern="^(clients|products|vehicles)$"),
+    q: str = Query(..., min_length=1, max_length=100),
+    limit: int = Query(SEARCH_LIMIT, ge=1, le=50),
+    session: AsyncSession = Depends(get_read_session)
+):
+    """
+    Ranked typeahead matches: exact, then prefix, then word prefix, then
+    trigram similarity. Clients match on name and phone.
+    """
+    return await search(kind, q, limit, session)
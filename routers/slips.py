@@ -1,102 +1,108 @@
 
+import csv
+import io
 import json
-from fastapi import APIRouter, Depends,Query, HTTPException
+from fastapi import APIRouter, Depends,Query, HTTPException, Request, Header
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from models import Slip, SlipDetail, SlipSequence
-from schemas import SlipCreate, SlipResponse
-from database import AsyncSessionLocal
-from sqlalchemy import select, func
-from datetime import datetime
-from sqlalchemy.future import select
+from typing import Optional
+from models import Slip, SlipDetail, Product, Clients, Salesman
+from schemas import SlipCreate, SlipResponse, SlipPage, SlipBulkResponse
+from database import get_session, get_read_session, read_sessionmaker
+from pagination import encode_cursor, decode_cursor
+from ledger import record_billed, apply_balance_deltas
+from slip_numbers import allocator, month_key, register_numbers
+from partitions import slip_partitions, missing_partition
+from rollups import record_slips
+from catalog import prepare_slips
+from idempotency import idempotent, IDEMPOTENCY_HEADER
+from search import search_indexes, SEARCH_BACKEND
+from events import publish_events, slip_event
+from versions import mark_changed, conditional
+from slip_json import slip_page_query, slip_dicts, json_response
+from sqlalchemy import select, tuple_
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import DBAPIError
+from datetime import datetime, date
 from sqlalchemy import distinct
 from sqlalchemy.orm import selectinload
+from budget import query_budget
 
 
 router = APIRouter(prefix="/slips", tags=["slips"])
 
-async def get_session():
-    async with AsyncSessionLocal() as session:
-        yield session
-from sqlalchemy.future import select
-from sqlalchemy.exc import NoResultFound
-from sqlalchemy.ext.asyncio import AsyncSession
+async def prepared_slip(slip: SlipCreate) -> SlipCreate:
+    # Checked and priced before the transaction, see catalog.py
+    errors, (priced,) = await prepare_slips([slip])
+    if errors:
+        status_code, error = errors[0]
+        raise HTTPException(status_code=status_code, detail=error)
+    return priced
 
 async def get_next_slip_number(session: AsyncSession, slip_date):
-    year2 = slip_date.strftime("%y")
-    month2 = slip_date.strftime("%m")
-    # Lock the row for this (year2, month2), or create it if not exists.
-    # Start a subtransaction for safety
-    result = await session.execute(
-        select(SlipSequence).where(
-            SlipSequence.year2 == year2,
-            SlipSequence.month2 == month2
-        ).with_for_update()
-    )
-    seq_row = result.scalar_one_or_none()
+    # Numbering scheme (row lock, blocks or a Postgres sequence) lives in slip_numbers.py
+    await slip_partitions.ensure(slip_date)
+    year2, month2 = month_key(slip_date)
+    slip_numbers = await allocator.allocate(session, year2, month2)
+    await register_numbers(session, slip_numbers)
+    return slip_numbers[0]
 
-    if seq_row is None:
-        seq_row = SlipSequence(year2=year2, month2=month2, last_seq=1)
-        session.add(seq_row)
-        seq_num = 1
-    else:
-        seq_row.last_seq += 1
-        seq_num = seq_row.last_seq
+@router.post("/ee", response_model=SlipResponse)
+@query_budget(17)  # same as POST /, without the idempotency key
+async def create_slip_ee(slip: SlipCreate, session: AsyncSession = Depends(get_session)):
+    # Older clients post here; same write path as POST / so the ledger, rollups and caches follow
+    return await _create_slip(slip, session)
 
-    slip_number = f"{year2}{month2}{str(seq_num).zfill(3)}"
-    return slip_number
+@router.post("/", response_model=SlipResponse)
+@query_budget(19)  # idempotency claim and answer, catalog lookups, numbering, insert, ledger, rollups, re-query, version bump
+async def create_slip(
+    slip: SlipCreate,
+    session: AsyncSession = Depends(get_session),
+    idempotency_key: Optional[str] = Header(None, alias=IDEMPOTENCY_HEADER),
+):
+    return await idempotent("POST /slips/", idempotency_key, slip, lambda claim: _create_slip(slip, session, claim))
 
-@router.post("/ee", response_model=SlipResponse)
-async def create_slip(slip: SlipCreate, session: AsyncSession = Depends(get_session)):
-    #logging.info(f"Received slip data: {slip}")
-    #print(slip)
-    async with session.begin():  # ensures this block is a transaction
-        slip_number = await get_next_slip_number(session, slip.slip_date)
-        db_slip = Slip(
-            slip_number=slip_number,
-            client_id=slip.client_id,
-            salesman_id=slip.salesman_id,
-            slip_date=slip.slip_date,
-            vehicle_number=slip.vehicle_number,
-            total_amount=slip.total_amount
-        )
-        session.add(db_slip)
-        await session.flush()  # ensures db_slip.id is assigned
 
-        # Add slip_details
-        for detail in slip.slip_details:
-            db_detail = SlipDetail(
-                slip_id=db_slip.id,
-                product_id=detail.product_id,
-                weight=detail.weight,
-                quantity=detail.quantity,
-                rate=detail.rate,
-                amount=detail.amount,
-                slip_date=detail.slip_date
-            )
-            session.add(db_detail)
+async def _create_slip(slip: SlipCreate, session: AsyncSession, claim=None):
+    slip = await prepared_slip(slip)
+    try:
+        inserted = await _insert_slip(slip, session, claim)
+    except DBAPIError as exc:
+        # The month was archived (by another process) after this worker created it: again, once
+        if not missing_partition(exc):
+            raise
+        slip_partitions.forget(slip.slip_date)
+        inserted = await _insert_slip(slip, session, claim)
+    if inserted is None:
+        return None
+    slip_id, slip_number, response = inserted
 
-    # No need to await session.commit() after session.begin(): block, it auto-commits on success.
-    await session.refresh(db_slip)
-    return db_slip
+    await mark_changed(session, "slips", "client_balances")
+    await search_indexes.bump_vehicles([slip.vehicle_number])
+    await publish_events(slip_event("created", slip_id, slip_number, slip))
+    return response
 
-from sqlalchemy.orm import selectinload
 
-@router.post("/", response_model=SlipResponse)
-async def create_slip(slip: SlipCreate, session: AsyncSession = Depends(get_session)):
-    print(session)
+async def _insert_slip(slip: SlipCreate, session: AsyncSession, claim=None):
+    """
+    The slip's transaction. Returns (id, slip_number, SlipResponse), or None
+    when the idempotency key was answered before.
+    """
     async with session.begin():
+        # A replayed key allocates nothing; see idempotency.py
+        if claim is not None and not await claim.take(session):
+            return None
         slip_number = await get_next_slip_number(session, slip.slip_date)
 
+        # Slip has no transport_charges column, it is already part of total_amount
         db_slip = Slip(
             slip_number=slip_number,
             client_id=slip.client_id,
             salesman_id=slip.salesman_id,
             slip_date=slip.slip_date,
             vehicle_number=slip.vehicle_number,
-            transport_charges=slip.transport_charges,
             total_amount=slip.total_amount
         )
-        print(db_slip)
         session.add(db_slip)
         await session.flush()  # ensures db_slip.id exists
 
@@ -112,24 +118,144 @@ async def create_slip(slip: SlipCreate, session: AsyncSession = Depends(get_sess
             )
             session.add(db_detail)
 
-    # ✅ Re-query with all relationships eager-loaded
-    result = await session.execute(
-        select(Slip)
-        .options(
-            selectinload(Slip.slip_details).selectinload(SlipDetail.product),  # load product
-            selectinload(Slip.client),  # load client
-            selectinload(Slip.salesman)  # load salesman
+        await record_billed(session, slip.client_id, slip.total_amount)
+        await record_slips(session, [slip])
+
+        # ✅ Re-query with all relationships eager-loaded, before commit so the
+        # idempotency key is stored with the slip
+        result = await session.execute(
+            select(Slip)
+            .options(
+                selectinload(Slip.slip_details).selectinload(SlipDetail.product),  # load product
+                selectinload(Slip.client),  # load client
+                selectinload(Slip.salesman)  # load salesman
+            )
+            .filter(Slip.id == db_slip.id, Slip.slip_date == slip.slip_date)  # one partition
+            .execution_options(populate_existing=True)
         )
-        .filter(Slip.id == db_slip.id)
+        response = SlipResponse.model_validate(result.scalar_one(), from_attributes=True)
+        if claim is not None:
+            await claim.answer(session, response)
+    return db_slip.id, slip_number, response
+
+
+
+BULK_MAX_SLIPS = 1000
+
+
+async def insert_slips(session: AsyncSession, slips: list[SlipCreate]):
+    """
+    Inserts slips and their details with multi-row INSERTs, allocating slip
+    numbers once per (year2, month2). Returns (id, slip_number) per slip in
+    order. The caller owns the transaction.
+    """
+    await slip_partitions.ensure(*(slip.slip_date for slip in slips))
+    numbers = [None] * len(slips)
+    by_month = {}
+    for index, slip in enumerate(slips):
+        key = month_key(slip.slip_date)
+        by_month.setdefault(key, []).append(index)
+    for (year2, month2), indexes in sorted(by_month.items()):  # stable lock order
+        reserved = await allocator.allocate(session, year2, month2, len(indexes))
+        for index, slip_number in zip(indexes, reserved):
+            numbers[index] = slip_number
+    await register_numbers(session, numbers)
+
+    result = await session.execute(
+        insert(Slip).returning(Slip.id, sort_by_parameter_order=True),
+        [
+            {
+                "slip_number": slip_number,
+                "client_id": slip.client_id,
+                "salesman_id": slip.salesman_id,
+                "slip_date": slip.slip_date,
+                "vehicle_number": slip.vehicle_number,
+                "total_amount": slip.total_amount,
+            }
+            for slip, slip_number in zip(slips, numbers)
+        ],
     )
-    slip_with_details = result.scalar_one()
+    slip_ids = result.scalars().all()
+
+    details = [
+        {
+            "slip_id": slip_id,
+            "product_id": detail.product_id,
+            "weight": detail.weight,
+            "quantity": detail.quantity,
+            "rate": detail.rate,
+            "amount": detail.amount,
+            "slip_date": detail.slip_date,
+        }
+        for slip, slip_id in zip(slips, slip_ids)
+        for detail in slip.slip_details
+    ]
+    if details:
+        await session.execute(insert(SlipDetail), details)
 
-    # ✅ Convert to Pydantic model (safe now)
-    return SlipResponse.model_validate(slip_with_details, from_attributes=True)
+    deltas = {}
+    for slip in slips:
+        billed, paid = deltas.get(slip.client_id, (0.0, 0.0))
+        deltas[slip.client_id] = (billed + slip.total_amount, paid)
+    await apply_balance_deltas(session, deltas)
+    await record_slips(session, slips)
 
+    return list(zip(slip_ids, numbers))
+
+
+@router.post("/bulk", response_model=SlipBulkResponse)
+@query_budget(None)  # the savepoint fallback runs one round per slip
+async def create_slips_bulk(slips: list[SlipCreate], session: AsyncSession = Depends(get_session)):
+    """
+    Creates many slips at once, e.g. a driver's day synced in one go.
+    Each item is reported separately; a bad item does not stop the others.
+    """
+    if len(slips) > BULK_MAX_SLIPS:
+        raise HTTPException(status_code=413, detail=f"At most {BULK_MAX_SLIPS} slips per request")
+
+    results = [{"index": index, "ok": False} for index in range(len(slips))]
+    errors, priced = await prepare_slips(slips) if slips else ({}, [])
+    for index, (_, error) in errors.items():
+        results[index]["error"] = error
+    slips = [priced_slip or slip for priced_slip, slip in zip(priced, slips)]
+    pending = [index for index in range(len(slips)) if index not in errors]
+
+    try:
+        async with session.begin():
+            created = await insert_slips(session, [slips[index] for index in pending])
+        for index, (slip_id, slip_number) in zip(pending, created):
+            results[index].update(ok=True, id=slip_id, slip_number=slip_number)
+    except DBAPIError as exc:
+        if missing_partition(exc):
+            # A month archived by another process; insert_slips creates it again
+            for index in pending:
+                slip_partitions.forget(slips[index].slip_date)
+        # Something got past validation, retry one savepoint per slip so
+        # only the offending items fail.
+        async with session.begin():
+            for index in pending:
+                try:
+                    async with session.begin_nested():
+                        (slip_id, slip_number), = await insert_slips(session, [slips[index]])
+                    results[index].update(ok=True, id=slip_id, slip_number=slip_number)
+                except DBAPIError as exc:
+                    results[index]["error"] = str(exc.orig)
+
+    created_count = sum(1 for result in results if result["ok"])
+    if created_count:
+        await mark_changed(session, "slips", "client_balances")
+        await search_indexes.bump_vehicles(
+            [slips[result["index"]].vehicle_number for result in results if result["ok"]]
+        )
+        await publish_events(*[
+            slip_event("created", result["id"], result["slip_number"], slips[result["index"]])
+            for result in results if result["ok"]
+        ])
+    return {"created": created_count, "failed": len(slips) - created_count, "results": results}
 
 
 @router.get("/generate_slip_number")
+@query_budget(2)
 async def generate_slip_number(
     date: str = Query(..., description="Date in ISO format (YYYY-MM-DD)"),
     session: AsyncSession = Depends(get_session)
@@ -142,38 +268,26 @@ async def generate_slip_number(
     try:
         slip_date = datetime.fromisoformat(date).date()
     except Exception:
-        return "Invalid date format", 400
-
-    year_str = slip_date.strftime("%y")  # last 2 digits of year
-    month_str = slip_date.strftime("%m") # 2-digit month
-
-    # Pattern to match slip_numbers starting with year+month
-    like_pattern = f"{year_str}{month_str}%"
+        raise HTTPException(status_code=400, detail="Invalid date format")
 
-    # Query the highest slip number in this year/month
-    result = await session.execute(
-        select(func.max(Slip.slip_number)).where(Slip.slip_number.like(like_pattern))
-    )
-    max_slip_number = result.scalar_one_or_none()
-
-    if max_slip_number:
-        seq = int(max_slip_number[-3:]) + 1  # increment sequence
-    else:
-        seq = 1
+    # Reads the same source the allocator hands numbers out from
+    year2, month2 = month_key(slip_date)
+    return await allocator.peek(session, year2, month2)
 
-    slip_number = f"{year_str}{month_str}{str(seq).zfill(3)}"
-    return slip_number
 
 
 
 
-
-@router.get("/vehicle_numbers/", response_model=list[str])
-async def get_vehicle_numbers(session: AsyncSession = Depends(get_session)):
+@router.get("/vehicle_numbers/", response_model=list[str], dependencies=[conditional("slips")])
+@query_budget(2)
+async def get_vehicle_numbers(session: AsyncSession = Depends(get_read_session)):
     """
     Returns a list of distinct vehicle numbers used in previously saved slips.
-    Excludes null or empty strings.
+    Excludes null or empty strings. Served from the search index when there is
+    one (see search.py); typeahead should use /search/vehicles instead.
     """
+    if SEARCH_BACKEND == "memory":
+        return await search_indexes.vehicle_numbers()
     result = await session.execute(
         select(distinct(Slip.vehicle_number))
         .where(Slip.vehicle_number.isnot(None))
@@ -182,33 +296,165 @@ async def get_vehicle_numbers(session: AsyncSession = Depends(get_session)):
     vehicle_numbers = [row[0] for row in result.all()]
     return vehicle_numbers
 
-@router.get("/", response_model=list[SlipResponse])
-async def get_slips(session: AsyncSession = Depends(get_session)):
+def filter_slips(
+    query,
+    client_id: Optional[int] = None,
+    salesman_id: Optional[int] = None,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    vehicle_number: Optional[str] = None,
+):
+    """
+    Applies the common slip list filters to a select over Slip.
+    """
+    if client_id is not None:
+        query = query.where(Slip.client_id == client_id)
+    if salesman_id is not None:
+        query = query.where(Slip.salesman_id == salesman_id)
+    if date_from is not None:
+        query = query.where(Slip.slip_date >= date_from)
+    if date_to is not None:
+        query = query.where(Slip.slip_date <= date_to)
+    if vehicle_number:
+        query = query.where(Slip.vehicle_number == vehicle_number)
+    return query
+
+
+# Flat export: one row per slip detail, slips without details get one row with empty detail columns
+EXPORT_BATCH_SIZE = 1000
+EXPORT_COLUMNS = [
+    "slip_id", "slip_number", "slip_date", "client_id", "client_name",
+    "salesman_id", "salesman_name", "vehicle_number", "total_amount",
+    "detail_id", "product_id", "product_name", "weight", "quantity", "rate", "amount",
+]
+
+
+def export_query(**filters):
+    query = (
+        select(
+            Slip.id.label("slip_id"),
+            Slip.slip_number,
+            Slip.slip_date,
+            Slip.client_id,
+            Clients.name.label("client_name"),
+            Slip.salesman_id,
+            Salesman.name.label("salesman_name"),
+            Slip.vehicle_number,
+            Slip.total_amount,
+            SlipDetail.id.label("detail_id"),
+            SlipDetail.product_id,
+            Product.name.label("product_name"),
+            SlipDetail.weight,
+            SlipDetail.quantity,
+            SlipDetail.rate,
+            SlipDetail.amount,
+        )
+        .join(Clients, Clients.id == Slip.client_id)
+        .join(Salesman, Salesman.id == Slip.salesman_id)
+        .outerjoin(SlipDetail, (SlipDetail.slip_id == Slip.id) & (SlipDetail.slip_date == Slip.slip_date))
+        .outerjoin(Product, Product.id == SlipDetail.product_id)
+    )
+    query = filter_slips(query, **filters)
+    return query.order_by(Slip.slip_date, Slip.id, SlipDetail.id)
+
+
+async def stream_export(session_factory, query, fmt: str):
+    """
+    Yields the export in chunks of EXPORT_BATCH_SIZE rows read from a server-side cursor.
+    Opens its own session so the cursor lives exactly as long as the response body.
+    """
+    async with session_factory() as session:
+        result = await session.stream(query.execution_options(yield_per=EXPORT_BATCH_SIZE))
+
+        if fmt == "csv":
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(EXPORT_COLUMNS)
+            yield buffer.getvalue()
+
+        async for rows in result.partitions():
+            if fmt == "csv":
+                buffer = io.StringIO()
+                writer = csv.writer(buffer)
+                writer.writerows(rows)
+                yield buffer.getvalue()
+            else:
+                yield "".join(
+                    json.dumps(dict(row._mapping), default=str) + "\n" for row in rows
+                )
+
+
+@router.get("/export", dependencies=[conditional("slips", "clients", "salesman", "products")])
+@query_budget(2)
+async def export_slips(
+    request: Request,
+    fmt: str = Query("ndjson", alias="format", pattern="^(ndjson|csv)$"),
+    client_id: Optional[int] = None,
+    salesman_id: Optional[int] = None,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+):
     """
-    Returns all slips with their slip details (eager loaded).
+    Streams slips joined to their details, product, client and salesman as NDJSON or CSV.
+    Memory stays flat regardless of how many rows match.
     """
+    query = export_query(
+        client_id=client_id,
+        salesman_id=salesman_id,
+        date_from=date_from,
+        date_to=date_to,
+    )
+    if fmt == "csv":
+        return StreamingResponse(
+            stream_export(read_sessionmaker(request), query, fmt),
+            media_type="text/csv",
+            headers={"Content-Disposition": 'attachment; filename="slips.csv"'},
+        )
+    return StreamingResponse(stream_export(read_sessionmaker(request), query, fmt), media_type="application/x-ndjson")
+
+
+@router.get("/", response_model=SlipPage, dependencies=[conditional("slips", "clients", "salesman", "products")])
+@query_budget(3)
+async def get_slips(
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    limit: int = Query(50, ge=1, le=500),
+    client_id: Optional[int] = None,
+    salesman_id: Optional[int] = None,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    vehicle_number: Optional[str] = None,
+    session: AsyncSession = Depends(get_read_session)
+):
+    """
+    Returns one page of slips, newest first, with their slip details.
+    Pages are keyed on (slip_date, id) so every page costs the same no matter
+    how deep into the ledger it is. Pass next_cursor back to get the next page;
+    it is null on the last page.
+    """
+    query = filter_slips(slip_page_query(), client_id, salesman_id, date_from, date_to, vehicle_number)
+
+    if cursor:
+        try:
+            last_date, last_id = decode_cursor(cursor)
+            last_date = date.fromisoformat(last_date)
+            last_id = int(last_id)
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        # The plain bound lets the planner skip the newer months' partitions
+        query = query.where(Slip.slip_date <= last_date)
+        query = query.where(tuple_(Slip.slip_date, Slip.id) < tuple_(last_date, last_id))
+
+    # One extra row tells us whether there is a next page.
     result = await session.execute(
-        select(Slip).options(
-            selectinload(Slip.client),
-            selectinload(Slip.salesman),
-            selectinload(Slip.slip_details).selectinload(SlipDetail.product))  # Eager load slip_details
+        query.order_by(Slip.slip_date.desc(), Slip.id.desc()).limit(limit + 1)
     )
-    slips = result.scalars().unique().all()
-    # for slip in slips:
-    #     slip_dict = {
-    #         "id": slip.id,
-    #         "slip_number": slip.slip_number,
-    #         "slip_details": [
-    #             {
-    #                 "id": detail.id,
-    #                 "product_id": detail.product_id,
-    #                 "product_name": detail.product.name if detail.product else None,
-    #                 "quantity": detail.quantity,
-    #                 "rate": detail.rate,
-    #                 "amount": detail.amount,
-    #             }
-    #             for detail in slip.slip_details
-    #         ],
-    #     }
-    #     print(json.dumps(slip_dict, indent=2))
-    return slips
\ No newline at end of file
+    rows = result.all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].slip_date.isoformat(), rows[-1].id)
+
+    # Column rows straight to JSON bytes, same output as response_model=SlipPage
+    items = await slip_dicts(session, rows)
+    return json_response({"items": items, "next_cursor": next_cursor})
@@ -0,0 +1,33 @@
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.ext.asyncio import AsyncSession
+from schemas import SyncResponse
+from database import get_session
+from slip_json import json_response
+from sync import read_changes, TokenExpired
+from budget import query_budget
+
+router = APIRouter(prefix="/sync", tags=["sync"])
+
+
+# Reads the primary: a token is an xmin of one server's snapshots, and a page
+# served by a replica lagging behind that server could skip rows for good.
+@router.get("", response_model=SyncResponse)
+@query_budget(8)  # snapshot xmin and one query per stream
+async def sync_changes(
+    since: Optional[str] = Query(None, description="token from the previous sync, none for a full load"),
+    limit: int = Query(500, ge=1, le=5000, description="rows per table per response"),
+    session: AsyncSession = Depends(get_session)
+):
+    """
+    Rows created or changed and ids deleted since the token, for every synced
+    table. Apply changes in key order, then deletes, keep the new token, and
+    call again straight away while more is true.
+    """
+    try:
+        changes = await read_changes(session, since, limit)
+    except TokenExpired:
+        raise HTTPException(status_code=410, detail="Sync token expired, reload without since")
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid sync token")
+    return json_response(changes)
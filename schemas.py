@@ -1,4 +1,4 @@
-from pydantic import BaseModel,Field
+from pydantic import BaseModel,Field,model_validator
 from datetime import date
 from datetime import date as DateType
 from typing import List, Optional
@@ -98,6 +98,14 @@ class SlipBase(BaseModel):
 class SlipCreate(SlipBase):
     slip_details: List[SlipDetailCreate]
 
+    # Details are stored in their slip's month partition (see partitions.py),
+    # so they always take the slip's date, whatever the client sent
+    @model_validator(mode="after")
+    def details_on_slip_date(self):
+        for detail in self.slip_details:
+            detail.slip_date = self.slip_date
+        return self
+
 class SlipResponse(SlipBase):
     id: int
     slip_details: List[SlipDetailResponse]
@@ -107,6 +115,24 @@ class SlipResponse(SlipBase):
     class Config:
         from_attributes = True
 
+# One page of GET /slips/, pass next_cursor back to get the following page
+class SlipPage(BaseModel):
+    items: List[SlipResponse]
+    next_cursor: Optional[str] = None
+
+# POST /slips/bulk reports every item on its own, in request order
+class SlipBulkItemResult(BaseModel):
+    index: int
+    ok: bool
+    id: Optional[int] = None
+    slip_number: Optional[str] = None
+    error: Optional[str] = None
+
+class SlipBulkResponse(BaseModel):
+    created: int
+    failed: int
+    results: List[SlipBulkItemResult]
+
 #for row locking and number increment
 class SlipSequenceBase(BaseModel):
     year2: str
@@ -137,4 +163,77 @@ class PaymentResponse(PaymentBase):
         from_attributes = True  # For loading from ORM model
 
 
+class ClientBalanceResponse(BaseModel):
+    client_id: int
+    billed: float
+    paid: float
+    outstanding: float
+
+
+# Client statement: slips are debits, payments credits
+class StatementEntry(BaseModel):
+    date: DateType
+    kind: str  # "slip" or "payment"
+    id: int
+    reference: Optional[str] = None  # slip number or payment notes
+    debit: float
+    credit: float
+    balance: float
+
+class ClientStatement(BaseModel):
+    client_id: int
+    date_from: Optional[DateType] = None
+    date_to: Optional[DateType] = None
+    opening_balance: float  # balance before the first entry of this page
+    entries: List[StatementEntry]
+    next_cursor: Optional[str] = None
+
+
+# Sales reports, one row per period and salesman/product
+class SalesmanReportRow(BaseModel):
+    period: date
+    salesman_id: int
+    salesman_name: str
+    slips: int
+    total_amount: float
+    quantity: float
+    weight: float
+    commission: float
+
+class ProductReportRow(BaseModel):
+    period: date
+    product_id: int
+    product_name: str
+    lines: int
+    quantity: float
+    weight: float
+    amount: float
+
+
+# POST /clients/import, /products/import, /salesmen/import; row counts data rows from 1
+class ImportRowError(BaseModel):
+    row: int
+    error: str
+
+class ImportReport(BaseModel):
+    rows: int
+    inserted: int
+    updated: int
+    failed: int
+    errors: List[ImportRowError]  # the first IMPORT_MAX_ERRORS of them
+
+
+# GET /sync: changed rows per table name, deleted ids per table name
+class SyncResponse(BaseModel):
+    token: str
+    more: bool  # call again with token right away
+    changes: dict[str, list[dict]]
+    deleted: dict[str, list[int]]
+
 
+# Typeahead hit; id is None for vehicle numbers
+class SearchHit(BaseModel):
+    id: Optional[int] = None
+    label: str
+    detail: Optional[str] = None
+    score: float
@@ -0,0 +1,372 @@
+"""
+Typeahead search for clients, products and vehicle numbers.
+
+SEARCH_BACKEND picks where /search/{kind} looks:
+
+    memory (default) per-worker prefix + trigram index, loaded lazily from the
+                     primary and kept current by the write handlers
+    pg               ILIKE prefix / pg_trgm similarity queries; needs the
+                     extension and indexes from alembic revision 0002
+
+The write handlers call search_indexes.put/remove/bump_vehicles after they
+commit. The change is applied to this worker's index straight away and
+published on SEARCH_CHANNEL for the others; a pubsub RESYNC drops every index
+so it reloads on next use.
+"""
+import asyncio
+import bisect
+import heapq
+import json
+import os
+import re
+import uuid
+from typing import NamedTuple, Optional
+
+from sqlalchemy import select, func, case, or_, literal
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import AsyncSessionLocal
+from models import Clients, Product, Slip
+from pubsub import pubsub, RESYNC
+
+SEARCH_BACKEND = os.getenv("SEARCH_BACKEND", "memory")
+SEARCH_CHANNEL = "archie_search"
+SEARCH_KINDS = ("clients", "products", "vehicles")
+SEARCH_LIMIT = 10
+# Share of the query's trigrams a text must contain (pg_trgm word_similarity);
+# pg's own word_similarity_threshold is 0.6, 0.5 lets one transposition through
+MIN_SIMILARITY = 0.5
+NOTIFY_BATCH = 100  # docs per notification, pg_notify payloads stop at 8000 bytes
+
+# Ranking: exact match, then prefix of the whole text, then prefix of a word,
+# then trigram similarity scaled below all of them
+EXACT, PREFIX, WORD_PREFIX, FUZZY = 1.0, 0.9, 0.8, 0.7
+
+WORKER = uuid.uuid4().hex[:12]  # lets a worker skip its own notifications
+
+
+class Doc(NamedTuple):
+    key: object  # row id, or the vehicle number itself
+    id: Optional[int]
+    label: str
+    detail: Optional[str]
+    weight: int = 0  # ties go to the heavier doc (slips per vehicle)
+
+
+def normalize(text: str) -> str:
+    return " ".join(re.findall(r"\w+", text.lower()))
+
+
+def compact(text: str) -> str:
+    return re.sub(r"\W+", "", text.lower())
+
+
+def trigrams(text: str) -> set:
+    """
+    pg_trgm style: each word padded with two leading blanks and one trailing.
+    """
+    grams = set()
+    for word in normalize(text).split():
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def doc_texts(doc: Doc):
+    return [text for text in (doc.label, doc.detail) if text]
+
+
+class PrefixIndex:
+    """
+    Sorted (token, key) pairs for prefix lookups plus trigram postings for
+    fuzzy matches. Tokens are each whole text, each of its words and its
+    compacted form, so "mh12" finds "MH 12 AB 1234".
+    """
+
+    def __init__(self):
+        self.docs = {}  # key -> Doc
+        self._tokens = []  # sorted [(token, key)]
+        self._full = {}  # key -> set of whole-text tokens
+        self._grams = {}  # trigram -> set of keys
+        self._doc_grams = {}  # key -> set of trigrams
+
+    def __len__(self):
+        return len(self.docs)
+
+    @classmethod
+    def build(cls, docs) -> "PrefixIndex":
+        """
+        An index of docs, sorting the tokens once instead of inserting them
+        one by one like put().
+        """
+        index = cls()
+        for doc in docs:
+            index.docs[doc.key] = doc
+        for doc in index.docs.values():
+            for token in index._add(doc):
+                index._tokens.append((token, doc.key))
+        index._tokens.sort()
+        return index
+
+    def _add(self, doc: Doc) -> set:
+        """
+        Records the doc's whole texts and trigrams; returns its tokens.
+        """
+        full, tokens, grams = set(), set(), set()
+        for text in doc_texts(doc):
+            whole = normalize(text)
+            full.update((whole, compact(text)))
+            tokens.update(whole.split())
+            grams |= trigrams(text)
+        self._full[doc.key] = full
+        self._doc_grams[doc.key] = grams
+        for gram in grams:
+            self._grams.setdefault(gram, set()).add(doc.key)
+        return {token for token in tokens | full if token}
+
+    def put(self, doc: Doc):
+        self.remove(doc.key)
+        self.docs[doc.key] = doc
+        for token in self._add(doc):
+            bisect.insort(self._tokens, (token, doc.key))
+
+    def remove(self, key):
+        doc = self.docs.pop(key, None)
+        if doc is None:
+            return
+        full = self._full.pop(key)
+        tokens = set(full)
+        for text in doc_texts(doc):
+            tokens.update(normalize(text).split())
+        for token in tokens:
+            i = bisect.bisect_left(self._tokens, (token, key))
+            if i < len(self._tokens) and self._tokens[i] == (token, key):
+                del self._tokens[i]
+        for gram in self._doc_grams.pop(key):
+            keys = self._grams[gram]
+            keys.discard(key)
+            if not keys:
+                del self._grams[gram]
+
+    def bump(self, key, label: str, count: int):
+        doc = self.docs.get(key)
+        if doc is None:
+            self.put(Doc(key, None, label, None, count))
+        else:
+            self.docs[key] = doc._replace(weight=doc.weight + count)
+
+    def search(self, q: str, limit: int = SEARCH_LIMIT):
+        """
+        Returns [(score, Doc)] best first.
+        """
+        query, squashed = normalize(q), compact(q)
+        if not squashed:
+            return []
+        scores = {}
+        for prefix in {query, squashed} - {""}:
+            i = bisect.bisect_left(self._tokens, (prefix,))
+            while i < len(self._tokens) and self._tokens[i][0].startswith(prefix):
+                token, key = self._tokens[i]
+                full = self._full[key]
+                if token == prefix and token in full:
+                    score = EXACT
+                elif token in full:
+                    score = PREFIX
+                else:
+                    score = WORD_PREFIX
+                scores[key] = max(scores.get(key, 0.0), score)
+                i += 1
+
+        if len(scores) < limit and len(squashed) >= 3:
+            wanted = trigrams(q)
+            shared = {}
+            for gram in wanted:
+                for key in self._grams.get(gram, ()):
+                    shared[key] = shared.get(key, 0) + 1
+            for key, count in shared.items():
+                if key in scores:
+                    continue
+                similarity = count / len(wanted)
+                if similarity >= MIN_SIMILARITY:
+                    scores[key] = FUZZY * similarity
+
+        docs = self.docs
+        best = heapq.nsmallest(
+            limit, scores.items(),
+            key=lambda item: (-item[1], -docs[item[0]].weight, len(docs[item[0]].label), docs[item[0]].label),
+        )
+        return [(score, docs[key]) for key, score in best]
+
+
+# How each kind is loaded and how a written row becomes a Doc
+LOADERS = {
+    "clients": select(Clients.id, Clients.name, Clients.phone),
+    "products": select(Product.id, Product.name),
+    "vehicles": (
+        select(Slip.vehicle_number, func.count().label("slips"))
+        .where(Slip.vehicle_number.isnot(None))
+        .where(Slip.vehicle_number != "")
+        .group_by(Slip.vehicle_number)
+    ),
+}
+
+
+def to_doc(kind: str, row) -> Doc:
+    if kind == "clients":
+        return Doc(row["id"], row["id"], row["name"], row.get("phone"))
+    if kind == "products":
+        return Doc(row["id"], row["id"], row["name"], None)
+    return Doc(row["vehicle_number"], None, row["vehicle_number"], None, row["slips"])
+
+
+class SearchIndexes:
+    def __init__(self):
+        self._indexes = {}  # kind -> PrefixIndex
+        self._loading = {}  # kind -> load task
+        self._pending = {}  # kind -> changes received while loading
+
+    def warm(self):
+        """
+        Starts loading every index in the background (called from the lifespan).
+        """
+        if SEARCH_BACKEND != "memory":
+            return
+        for kind in SEARCH_KINDS:
+            self._load_task(kind)
+
+    def _load_task(self, kind: str):
+        task = self._loading.get(kind)
+        if task is None:
+            task = self._loading[kind] = asyncio.get_running_loop().create_task(self._load(kind))
+        return task
+
+    async def index(self, kind: str) -> PrefixIndex:
+        index = self._indexes.get(kind)
+        if index is None:
+            index = await asyncio.shield(self._load_task(kind))
+        return index
+
+    async def _load(self, kind: str) -> PrefixIndex:
+        pending = self._pending[kind] = []
+        try:
+            # primary, for the same reason as cache.cached_list_response
+            async with AsyncSessionLocal() as session:
+                rows = (await session.execute(LOADERS[kind])).mappings().all()
+            docs = [to_doc(kind, dict(row)) for row in rows]
+            # In a thread: a big table takes seconds to index and the loop keeps serving meanwhile
+            index = await asyncio.to_thread(PrefixIndex.build, docs)
+            if RESYNC in pending:
+                return index  # missed notifications; serve it once, load again next time
+            for change in pending:
+                self._apply(index, change)
+            self._indexes[kind] = index
+            return index
+        finally:
+            self._pending.pop(kind, None)
+            self._loading.pop(kind, None)
+
+    @staticmethod
+    def _apply(index: PrefixIndex, change: dict):
+        for doc in change.get("put", ()):
+            index.put(Doc(*doc))
+        for key in change.get("remove", ()):
+            index.remove(key)
+        for key, count in change.get("bump", ()):
+            index.bump(key, key, count)
+
+    def receive(self, payload: str):
+        if payload == RESYNC:
+            self._indexes.clear()
+            for pending in self._pending.values():
+                pending.append(RESYNC)
+            return
+        change = json.loads(payload)
+        if change["from"] != WORKER:
+            self._change(change)
+
+    def _change(self, change: dict):
+        kind = change["kind"]
+        if kind in self._indexes:
+            self._apply(self._indexes[kind], change)
+        elif kind in self._pending:
+            self._pending[kind].append(change)
+
+    async def _publish(self, kind: str, field: str, items: list):
+        if SEARCH_BACKEND != "memory" or not items:
+            return
+        for start in range(0, len(items), NOTIFY_BATCH):
+            change = {"from": WORKER, "kind": kind, field: items[start:start + NOTIFY_BATCH]}
+            self._change(change)
+            await pubsub.publish(SEARCH_CHANNEL, json.dumps(change, default=str))
+
+    async def put(self, kind: str, *rows):
+        """
+        Adds or replaces written rows (dicts as returned by the writes helpers).
+        """
+        await self._publish(kind, "put", [list(to_doc(kind, row)) for row in rows])
+
+    async def remove(self, kind: str, *ids):
+        await self._publish(kind, "remove", list(ids))
+
+    async def bump_vehicles(self, vehicle_numbers):
+        counts = {}
+        for number in vehicle_numbers:
+            if number:
+                counts[number] = counts.get(number, 0) + 1
+        await self._publish("vehicles", "bump", sorted(counts.items()))
+
+    async def vehicle_numbers(self):
+        index = await self.index("vehicles")
+        return sorted(index.docs)
+
+
+search_indexes = SearchIndexes()
+pubsub.subscribe(SEARCH_CHANNEL, search_indexes.receive)
+
+
+def _escape_like(text: str) -> str:
+    return re.sub(r"([\\%_])", r"\\\1", text)
+
+
+async def search_pg(session: AsyncSession, kind: str, q: str, limit: int = SEARCH_LIMIT):
+    """
+    The pg_trgm fallback, same scores as PrefixIndex.search.
+    """
+    if kind == "clients":
+        key, label, detail, weight = Clients.id, Clients.name, Clients.phone, literal(0)
+    elif kind == "products":
+        key, label, detail, weight = Product.id, Product.name, literal(None), literal(0)
+    else:
+        key, label, detail, weight = literal(None), Slip.vehicle_number, literal(None), func.count()
+
+    q = q.strip()
+    prefix = _escape_like(q) + "%"
+    columns = [label, detail] if kind == "clients" else [label]
+    starts = or_(*[column.ilike(prefix) for column in columns])
+    word_starts = or_(*[column.ilike("% " + prefix) for column in columns])
+    similarity = func.greatest(*[func.word_similarity(q, func.coalesce(column, "")) for column in columns])
+    score = case(
+        (func.lower(label) == q.lower(), EXACT),
+        (starts, PREFIX),
+        (word_starts, WORD_PREFIX),
+        else_=FUZZY * similarity,
+    ).label("score")
+    # %> is the indexable word_similarity(q, column) >= pg_trgm.word_similarity_threshold
+    match = or_(starts, word_starts, *[column.op("%>")(q) for column in columns])
+
+    query = select(key.label("id"), label.label("label"), detail.label("detail"), score).where(match)
+    if kind == "vehicles":
+        query = query.group_by(Slip.vehicle_number)
+    query = query.order_by(score.desc(), weight.desc(), func.length(label), label).limit(limit)
+    result = await session.execute(query)
+    return result.mappings().all()
+
+
+async def search(kind: str, q: str, limit: int = SEARCH_LIMIT, session: AsyncSession = None):
+    if SEARCH_BACKEND == "pg":
+        return await search_pg(session, kind, q, limit)
+    index = await search_indexes.index(kind)
+    return [
+        {"id": doc.id, "label": doc.label, "detail": doc.detail, "score": round(score, 3)}
+        for score, doc in index.search(q, limit)
+    ]
@@ -0,0 +1,205 @@
+"""
+Slip number allocation.
+
+Slip numbers look like YYMMnnn: two digit year and month, then a per-month
+sequence. Where the sequence comes from is pluggable, picked with
+SLIP_NUMBER_MODE:
+
+    row_lock  (default) one slip_sequences row per month, bumped inside the
+              slip's own transaction. Numbers are gapless and in commit order,
+              but every slip of the month queues on that row until commit.
+    block     each worker claims SLIP_NUMBER_BLOCK_SIZE numbers at a time from
+              slip_sequences in its own short transaction and hands them out
+              from memory. No lock is held by the slip transaction. Numbers
+              from rolled back slips or an unfinished block are skipped, and
+              two workers interleave their blocks.
+    sequence  one native Postgres SEQUENCE per month (slip_seq_YYMM). nextval
+              never blocks and is increasing, but rolled back slips leave gaps.
+
+SLIP_NUMBER_POLICY says which of those trade-offs are acceptable and is checked
+against the mode at import time:
+
+    gapless   no skipped numbers, increasing in commit order (row_lock only)
+    ordered   gaps allowed, numbers still increase over time (row_lock, sequence)
+    gaps_ok   gaps and interleaving allowed (any mode)
+
+Whatever the mode, every number is registered in slip_numbers (see
+register_numbers) in the slip's transaction; its primary key is the unique
+key on slip numbers that the month-partitioned slips table cannot have.
+
+row_lock and block share slip_sequences, so switching between them is safe.
+The first use of a month in sequence mode starts the sequence after
+slip_sequences.last_seq; going back from sequence mode needs last_seq bumped
+past the numbers the sequence handed out.
+"""
+import asyncio
+import os
+
+from sqlalchemy import select, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import engine
+from models import SlipSequence, SlipNumber
+
+SLIP_NUMBER_MODE = os.getenv("SLIP_NUMBER_MODE", "row_lock")
+SLIP_NUMBER_POLICY = os.getenv("SLIP_NUMBER_POLICY", "gapless")
+SLIP_NUMBER_BLOCK_SIZE = int(os.getenv("SLIP_NUMBER_BLOCK_SIZE", "20"))
+
+ALLOWED_MODES = {
+    "gapless": {"row_lock"},
+    "ordered": {"row_lock", "sequence"},
+    "gaps_ok": {"row_lock", "block", "sequence"},
+}
+
+
+def month_key(slip_date):
+    return slip_date.strftime("%y"), slip_date.strftime("%m")
+
+
+def format_slip_number(year2: str, month2: str, seq: int) -> str:
+    return f"{year2}{month2}{str(seq).zfill(3)}"
+
+
+async def register_numbers(session: AsyncSession, numbers: list[str]):
+    """
+    Records numbers in slip_numbers inside the caller's transaction; a
+    number handed out twice fails there instead of being stored twice.
+    """
+    await session.execute(insert(SlipNumber), [{"slip_number": number} for number in numbers])
+
+
+async def bump_sequence_row(conn, year2: str, month2: str, count: int) -> int:
+    """
+    Adds count to slip_sequences.last_seq for the month (creating the row)
+    and returns the new last_seq. Works on a session or a connection.
+    """
+    stmt = insert(SlipSequence).values(year2=year2, month2=month2, last_seq=count)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[SlipSequence.year2, SlipSequence.month2],
+        set_={"last_seq": SlipSequence.last_seq + count},
+    ).returning(SlipSequence.last_seq)
+    return (await conn.execute(stmt)).scalar_one()
+
+
+async def read_last_seq(conn, year2: str, month2: str) -> int:
+    result = await conn.execute(
+        select(SlipSequence.last_seq).where(
+            SlipSequence.year2 == year2,
+            SlipSequence.month2 == month2,
+        )
+    )
+    return result.scalar_one_or_none() or 0
+
+
+class RowLockAllocator:
+    """
+    The original scheme: the month's slip_sequences row is bumped in the
+    caller's transaction and stays locked until it commits.
+    """
+
+    async def allocate(self, session: AsyncSession, year2: str, month2: str, count: int = 1):
+        last_seq = await bump_sequence_row(session, year2, month2, count)
+        return [
+            format_slip_number(year2, month2, seq)
+            for seq in range(last_seq - count + 1, last_seq + 1)
+        ]
+
+    async def peek(self, session: AsyncSession, year2: str, month2: str) -> str:
+        return format_slip_number(year2, month2, await read_last_seq(session, year2, month2) + 1)
+
+
+class BlockAllocator:
+    """
+    Hi/lo allocation: claim a block of numbers from slip_sequences in a short
+    transaction of our own, then hand them out locally.
+    """
+
+    def __init__(self, block_size: int):
+        self.block_size = block_size
+        self._blocks = {}  # (year2, month2) -> [next_seq, last_seq]
+        self._lock = asyncio.Lock()
+
+    async def _claim(self, year2: str, month2: str, count: int):
+        async with engine.begin() as conn:
+            last_seq = await bump_sequence_row(conn, year2, month2, count)
+        return [last_seq - count + 1, last_seq]
+
+    async def allocate(self, session: AsyncSession, year2: str, month2: str, count: int = 1):
+        numbers = []
+        async with self._lock:
+            while len(numbers) < count:
+                block = self._blocks.get((year2, month2))
+                if block is None or block[0] > block[1]:
+                    block = await self._claim(year2, month2, max(self.block_size, count - len(numbers)))
+                    self._blocks[(year2, month2)] = block
+                take = min(count - len(numbers), block[1] - block[0] + 1)
+                numbers.extend(range(block[0], block[0] + take))
+                block[0] += take
+        return [format_slip_number(year2, month2, seq) for seq in numbers]
+
+    async def peek(self, session: AsyncSession, year2: str, month2: str) -> str:
+        block = self._blocks.get((year2, month2))
+        if block is not None and block[0] <= block[1]:
+            return format_slip_number(year2, month2, block[0])
+        return format_slip_number(year2, month2, await read_last_seq(session, year2, month2) + 1)
+
+
+class SequenceAllocator:
+    """
+    One Postgres SEQUENCE per month, created on first use.
+    """
+
+    def __init__(self):
+        self._known = set()
+
+    @staticmethod
+    def sequence_name(year2: str, month2: str) -> str:
+        return f"slip_seq_{year2}{month2}"
+
+    async def _ensure(self, year2: str, month2: str):
+        if (year2, month2) in self._known:
+            return
+        # DDL in its own transaction so the slip transaction never waits on it
+        async with engine.begin() as conn:
+            start = await read_last_seq(conn, year2, month2) + 1
+            await conn.execute(text(
+                f"CREATE SEQUENCE IF NOT EXISTS {self.sequence_name(year2, month2)} START WITH {start}"
+            ))
+        self._known.add((year2, month2))
+
+    async def allocate(self, session: AsyncSession, year2: str, month2: str, count: int = 1):
+        await self._ensure(year2, month2)
+        result = await session.execute(
+            text("SELECT nextval(CAST(:name AS regclass)) FROM generate_series(1, :count)"),
+            {"name": self.sequence_name(year2, month2), "count": count},
+        )
+        return [format_slip_number(year2, month2, seq) for seq in sorted(result.scalars())]
+
+    async def peek(self, session: AsyncSession, year2: str, month2: str) -> str:
+        # pg_sequence_last_value is NULL both for a missing and a never used sequence
+        result = await session.execute(
+            text("SELECT pg_sequence_last_value(to_regclass(:name))"),
+            {"name": self.sequence_name(year2, month2)},
+        )
+        last_value = result.scalar_one_or_none()
+        if last_value is None:
+            last_value = await read_last_seq(session, year2, month2)
+        return format_slip_number(year2, month2, last_value + 1)
+
+
+def get_allocator():
+    if SLIP_NUMBER_POLICY not in ALLOWED_MODES:
+        raise RuntimeError(f"Unknown SLIP_NUMBER_POLICY {SLIP_NUMBER_POLICY!r}")
+    if SLIP_NUMBER_MODE not in ALLOWED_MODES[SLIP_NUMBER_POLICY]:
+        raise RuntimeError(
+            f"SLIP_NUMBER_MODE={SLIP_NUMBER_MODE!r} cannot honour SLIP_NUMBER_POLICY={SLIP_NUMBER_POLICY!r}"
+        )
+    if SLIP_NUMBER_MODE == "block":
+        return BlockAllocator(SLIP_NUMBER_BLOCK_SIZE)
+    if SLIP_NUMBER_MODE == "sequence":
+        return SequenceAllocator()
+    return RowLockAllocator()
+
+
+allocator = get_allocator()
@@ -0,0 +1,151 @@
+"""
+Changes-since feed for offline clients (GET /sync).
+
+Every synced table carries row_version, the id of the transaction that last
+wrote the row (models.row_version), and deletes leave a row in tombstones.
+A sync token remembers the oldest transaction that could still have been in
+flight when the client last synced: the xmin of that request's snapshot.
+Everything older was already visible then, so the next sync only reads rows
+with row_version >= that xmin, straight off the (row_version, id) indexes.
+Rows committed around the boundary may come twice; clients upsert by id.
+
+Large backlogs come in pages: while "more" is true the token also holds a
+(row_version, id) position per table, and the xmin of the first page is only
+promoted once every table has been drained.
+
+Tombstones older than SYNC_TOMBSTONE_DAYS can be dropped with
+
+    python sync.py purge
+
+and a token older than that is answered with 410 so the client reloads.
+"""
+import argparse
+import asyncio
+import os
+import time
+
+from sqlalchemy import select, func, delete, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import Salesman, Clients, Product, Slip, SlipDetail, Payment, Tombstone
+from pagination import encode_cursor, decode_cursor
+
+# Table name -> model, in the order a client should apply them
+SYNC_ENTITIES = {
+    "salesman": Salesman,
+    "clients": Clients,
+    "products": Product,
+    "slips": Slip,
+    "slip_details": SlipDetail,
+    "payments": Payment,
+}
+DELETED = "tombstones"  # the deletes stream, paged like a table
+SYNC_TOMBSTONE_DAYS = int(os.getenv("SYNC_TOMBSTONE_DAYS", "90"))
+DONE = 0  # position of a stream drained in the current pass
+
+
+class TokenExpired(Exception):
+    """The token predates the tombstone retention; a full reload is needed."""
+
+
+async def record_deleted(session: AsyncSession, entity: str, *row_ids: int):
+    """
+    Leaves tombstones for deleted rows. Call in the deleting transaction.
+    """
+    if row_ids:
+        session.add_all([Tombstone(entity=entity, row_id=row_id) for row_id in row_ids])
+        await session.flush()
+
+
+def parse_token(token: str | None):
+    """
+    Returns (since, since_at, floor, floor_at, positions).
+    Raises ValueError for a malformed token and TokenExpired for a stale one.
+    """
+    if not token:
+        return 0, None, None, None, {}
+    try:
+        since, since_at, floor, floor_at, positions = decode_cursor(token)
+        since, since_at = int(since), float(since_at)
+        floor = int(floor) if floor is not None else None
+        floor_at = float(floor_at) if floor_at is not None else None
+        positions = {
+            name: DONE if position == DONE else (int(position[0]), int(position[1]))
+            for name, position in positions.items()
+        }
+    except (TypeError, ValueError, AttributeError, IndexError) as exc:
+        raise ValueError("Invalid sync token") from exc
+    if time.time() - since_at > SYNC_TOMBSTONE_DAYS * 86400:
+        raise TokenExpired()
+    return since, since_at, floor, floor_at, positions
+
+
+def changes_query(table, since: int, position, limit: int):
+    query = select(*table.columns).where(table.c.row_version >= since)
+    if position:
+        query = query.where(tuple_(table.c.row_version, table.c.id) > tuple_(*position))
+    return query.order_by(table.c.row_version, table.c.id).limit(limit + 1)
+
+
+async def read_changes(session: AsyncSession, token: str | None, limit: int) -> dict:
+    """
+    Up to limit changed rows per table (and tombstones) since token.
+    """
+    since, since_at, floor, floor_at, positions = parse_token(token)
+    # One snapshot for every table, so a slip never arrives without its details
+    await session.connection(execution_options={"isolation_level": "REPEATABLE READ"})
+    if floor is None:
+        # xmin of the snapshot the tables below are read with
+        floor = (await session.execute(
+            select(func.txid_snapshot_xmin(func.txid_current_snapshot()))
+        )).scalar_one()
+        floor_at = time.time()
+
+    changes, deleted, more = {}, {}, False
+    for name, table in [*((name, model.__table__) for name, model in SYNC_ENTITIES.items()),
+                        (DELETED, Tombstone.__table__)]:
+        position = positions.get(name)
+        if position == DONE:
+            continue
+        rows = (await session.execute(changes_query(table, since, position, limit))).mappings().all()
+        if len(rows) > limit:
+            rows = rows[:limit]
+            positions[name] = (rows[-1]["row_version"], rows[-1]["id"])
+            more = True
+        else:
+            positions[name] = DONE
+        if name == DELETED:
+            for row in rows:
+                deleted.setdefault(row["entity"], []).append(row["row_id"])
+        elif rows:
+            changes[name] = [{key: value for key, value in row.items() if key != "row_version"} for row in rows]
+
+    if more:
+        next_token = encode_cursor(since, since_at or floor_at, floor, floor_at, positions)
+    else:
+        next_token = encode_cursor(floor, floor_at, None, None, {})
+    return {"token": next_token, "more": more, "changes": changes, "deleted": deleted}
+
+
+async def purge_tombstones(session: AsyncSession, days: int = SYNC_TOMBSTONE_DAYS) -> int:
+    async with session.begin():
+        result = await session.execute(
+            delete(Tombstone).where(Tombstone.deleted_at < func.now() - func.make_interval(0, 0, 0, days))
+        )
+    return result.rowcount
+
+
+async def _main(args):
+    from database import AsyncSessionLocal
+
+    async with AsyncSessionLocal() as session:
+        purged = await purge_tombstones(session, args.days)
+    print(f"{purged} tombstones purged")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sync feed maintenance")
+    sub = parser.add_subparsers(dest="command", required=True)
+    purge = sub.add_parser("purge", help="drop tombstones past the retention")
+    purge.add_argument("--days", type=int, default=SYNC_TOMBSTONE_DAYS)
+    asyncio.run(_main(parser.parse_args()))
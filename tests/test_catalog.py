@@ -0,0 +1,29 @@
+from datetime import date
+
+from catalog import price_mismatch
+from schemas import SlipCreate
+
+
+def slip(total: float, amount: float = 35.0, transport: float = 0.0) -> SlipCreate:
+    return SlipCreate(
+        slip_number="", client_id=1, salesman_id=1, slip_date=date(2026, 10, 18),
+        total_amount=total, transport_charges=transport,
+        slip_details=[{
+            "product_id": 1, "quantity": 3.5, "rate": 10.0, "amount": amount, "slip_date": date(2026, 10, 18),
+        }],
+    )
+
+
+def test_consistent_slip_passes():
+    assert price_mismatch(slip(35.0)) is None
+    assert price_mismatch(slip(40.0, transport=5.0)) is None
+
+
+def test_total_mismatch_is_named():
+    assert price_mismatch(slip(100.0)) == (
+        "total_amount is 100.0, the amounts and transport charges add up to 35.0"
+    )
+
+
+def test_line_mismatch_is_named():
+    assert price_mismatch(slip(36.0, amount=36.0)) == "slip_details[0].amount is 36.0, quantity * rate is 35.0"
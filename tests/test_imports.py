@@ -0,0 +1,58 @@
+import asyncio
+import io
+import os
+import uuid
+
+import pytest
+
+from imports import SALESMAN_IMPORT, import_csv
+
+# Writes to the database: only with ARCHIE_DB_TESTS=1 and DATABASE_URL pointing at a scratch database
+needs_database = pytest.mark.skipif(
+    os.getenv("ARCHIE_DB_TESTS") != "1", reason="set ARCHIE_DB_TESTS=1 and DATABASE_URL to a scratch database"
+)
+
+
+class Upload:
+    def __init__(self, text: str):
+        self._file = io.BytesIO(text.encode())
+
+    async def read(self, size: int = -1) -> bytes:
+        return self._file.read(size)
+
+
+@needs_database
+def test_out_of_range_number_fails_its_row_only():
+    from sqlalchemy import delete
+
+    from database import AsyncSessionLocal, engine
+    from models import Base, Salesman
+
+    phones = [uuid.uuid4().hex[:12] for _ in range(3)]
+    upload = Upload(
+        "name,commission,phone\n"
+        f"A,1e400,{phones[0]}\n"
+        f"B,2,{phones[1]}\n"
+        f"C,1e-400,{phones[2]}\n"
+    )
+
+    async def run():
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        try:
+            async with AsyncSessionLocal() as session:
+                return await import_csv(session, SALESMAN_IMPORT, upload)
+        finally:
+            async with AsyncSessionLocal() as session:
+                async with session.begin():
+                    await session.execute(delete(Salesman).where(Salesman.phone.in_(phones)))
+            await engine.dispose()
+
+    report, written = asyncio.run(run())
+    assert report["rows"] == 3
+    assert (report["inserted"], report["failed"]) == (1, 2)
+    assert report["errors"] == [
+        {"row": 1, "error": "commission is out of range"},
+        {"row": 3, "error": "commission is out of range"},
+    ]
+    assert [row["phone"] for row in written] == [phones[1]]
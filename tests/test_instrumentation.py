@@ -0,0 +1,38 @@
+import pytest
+from fastapi import APIRouter, FastAPI
+from fastapi.testclient import TestClient
+
+import metrics
+from budget import query_budget, check_budgets
+
+
+def test_router_endpoints_are_timed():
+    from main import app
+
+    path = "/slips/generate_slip_number"
+    before = metrics.routes.get(("GET", path))
+    count = before.latency.count if before else 0
+    # Rejected before the session touches the database
+    response = TestClient(app).get(path, params={"date": "not a date"})
+    assert response.status_code == 400
+    after = metrics.routes[("GET", path)]
+    assert after.latency.count == count + 1
+    assert after.serialize_seconds > 0
+
+
+def test_router_routes_without_a_budget_are_refused():
+    router = APIRouter(prefix="/things")
+
+    @router.get("/budgeted")
+    @query_budget(1)
+    async def budgeted():
+        return {}
+
+    @router.get("/forgotten")
+    async def forgotten():
+        return {}
+
+    app = FastAPI()
+    app.include_router(router)
+    with pytest.raises(RuntimeError, match="GET /things/forgotten"):
+        check_budgets(app)
@@ -0,0 +1,20 @@
+from search import PrefixIndex, Doc
+
+DOCS = [
+    Doc(1, 1, "Sharma Traders", "9876543210"),
+    Doc(2, 2, "Sharma & Sons", None),
+    Doc(3, 3, "Verma Hardware", "9123456789"),
+    Doc("MH 12 AB 1234", None, "MH 12 AB 1234", None, 4),
+]
+
+
+def test_build_matches_put():
+    built = PrefixIndex.build(DOCS)
+    put = PrefixIndex()
+    for doc in DOCS:
+        put.put(doc)
+    assert built._tokens == put._tokens
+    assert built._full == put._full
+    assert built._grams == put._grams
+    assert built.search("sharma") == put.search("sharma")
+    assert [doc.key for _, doc in built.search("mh12")] == ["MH 12 AB 1234"]
@@ -0,0 +1,44 @@
+from datetime import date
+from types import SimpleNamespace
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from schemas import SlipPage
+from slip_json import slip_dict, json_response
+
+EDGE_FLOATS = [1e-5, 1e-7, 1e16, 1e17, 0.1 + 0.2, 1e-4, -1e-5, 2.5e15, 5e-324, 1e300, 0.0, -0.0, 123456789.123]
+
+
+def page(value: float) -> dict:
+    row = SimpleNamespace(
+        id=7, slip_number="2610001", client_id=1, salesman_id=2, slip_date=date(2026, 10, 18),
+        vehicle_number="VH-1", total_amount=value, client_name="Client", salesman_name="Salesman",
+    )
+    detail = {
+        "product_id": 3, "weight": value, "quantity": value, "rate": value, "amount": value,
+        "slip_date": date(2026, 10, 18), "transport_charges": 0.0, "id": 11,
+        "product": {"name": "Product", "weight": value, "rate": value, "id": 3},
+    }
+    return {"items": [slip_dict(row, [detail])], "next_cursor": None}
+
+
+@pytest.fixture(scope="module")
+def client():
+    app = FastAPI()
+
+    @app.get("/model/{index}", response_model=SlipPage)
+    async def through_response_model(index: int):
+        return page(EDGE_FLOATS[index])
+
+    @app.get("/fast/{index}")
+    async def through_slip_json(index: int):
+        return json_response(page(EDGE_FLOATS[index]))
+
+    return TestClient(app)
+
+
+@pytest.mark.parametrize("index", range(len(EDGE_FLOATS)), ids=[repr(value) for value in EDGE_FLOATS])
+def test_bytes_match_response_model(client, index):
+    assert client.get(f"/fast/{index}").content == client.get(f"/model/{index}").content
@@ -0,0 +1,111 @@
+"""
+Per-table change counters and conditional GET.
+
+Every write handler calls mark_changed() once its transaction has committed,
+which bumps table_versions for the tables it touched. GET routes declare the
+tables their payload is built from with conditional(); the versions of those
+tables form the ETag, so a matching If-None-Match is answered with 304 before
+the handler runs any query or serializes anything.
+
+Bumping after the commit (never before) means a reader can at worst see new
+data under the old tag, which only costs the client one extra full response.
+"""
+import hashlib
+from email.utils import format_datetime, parsedate_to_datetime
+
+from fastapi import Depends, HTTPException, Request
+from sqlalchemy import select, func
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from cache import reference_cache
+from database import get_read_session
+from models import TableVersion
+
+# Tables whose list responses live in the reference cache
+CACHED_TABLES = {"products", "clients", "salesman"}
+
+
+async def mark_changed(session: AsyncSession, *tables: str):
+    """
+    Bumps the version of each table and drops any cached list for it.
+    Call after the write has committed; commits the bump on the same session.
+    """
+    names = sorted(set(tables))
+    stmt = insert(TableVersion).values([{"name": name, "version": 1} for name in names])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[TableVersion.name],
+        set_={"version": TableVersion.version + 1, "updated_at": func.now()},
+    )
+    await session.execute(stmt)
+    await session.commit()
+
+    for name in names:
+        if name in CACHED_TABLES:
+            await reference_cache.invalidate(name)
+
+
+async def read_versions(session: AsyncSession, tables):
+    result = await session.execute(
+        select(TableVersion.name, TableVersion.version, TableVersion.updated_at)
+        .where(TableVersion.name.in_(tables))
+    )
+    return {name: (version, updated_at) for name, version, updated_at in result.all()}
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    candidates = [tag.strip() for tag in header.split(",")]
+    return "*" in candidates or etag in [tag.removeprefix("W/") for tag in candidates]
+
+
+def _not_modified_since(header: str, last_modified) -> bool:
+    try:
+        since = parsedate_to_datetime(header)
+    except (TypeError, ValueError):
+        return False
+    return last_modified.replace(microsecond=0) <= since
+
+
+def conditional(*tables: str):
+    """
+    Route dependency: computes the ETag/Last-Modified for a payload built from
+    tables and short-circuits with 304 when the client already has it.
+    """
+    tables = tuple(sorted(set(tables)))
+
+    # Same session as a handler on get_read_session, so the tag and the body
+    # always come from the same server
+    async def check(request: Request, session: AsyncSession = Depends(get_read_session)):
+        versions = await read_versions(session, tables)
+        await session.rollback()  # hand the connection back until the handler needs one
+
+        token = ";".join(f"{name}:{versions.get(name, (0, None))[0]}" for name in tables)
+        etag = '"' + hashlib.sha1(token.encode()).hexdigest()[:20] + '"'
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        stamps = [updated_at for _, updated_at in versions.values()]
+        last_modified = max(stamps) if stamps else None
+        if last_modified is not None:
+            headers["Last-Modified"] = format_datetime(last_modified, usegmt=True)
+
+        # picked up by etag_middleware once the handler has produced a 200
+        request.state.validators = headers
+
+        if_none_match = request.headers.get("if-none-match")
+        if_modified_since = request.headers.get("if-modified-since")
+        if if_none_match is not None:
+            not_modified = _etag_matches(if_none_match, etag)
+        else:
+            not_modified = bool(if_modified_since and last_modified
+                                and _not_modified_since(if_modified_since, last_modified))
+        if not_modified:
+            raise HTTPException(status_code=304, headers=headers)
+
+    return Depends(check)
+
+
+async def etag_middleware(request: Request, call_next):
+    response = await call_next(request)
+    validators = getattr(request.state, "validators", None)
+    if validators and response.status_code == 200:
+        response.headers.update(validators)
+    return response
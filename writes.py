@@ -0,0 +1,103 @@
+"""
+Single-statement writes.
+
+Each helper sends one INSERT/UPDATE/DELETE ... RETURNING and hands back the
+written row as a dict ready for the response model, instead of the usual
+select, mutate, commit, refresh, re-select dance. Nested mini-objects
+(e.g. PaymentResponse.client) are joined onto the returned row in the same
+statement through a data-modifying CTE.
+
+The helpers never commit; the caller does, once, after any ledger updates.
+"""
+from sqlalchemy import select, update, delete
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+
+async def _execute_returning(session: AsyncSession, stmt, model, nested=None, extra=()):
+    """
+    nested maps a response field to (related model, foreign key column name),
+    e.g. {"client": (Clients, "client_id")}; the related row comes back as
+    {"id": ..., "name": ...} or None.
+    """
+    stmt = stmt.returning(*model.__table__.columns, *extra)
+    if nested:
+        written = stmt.cte("written")
+        query = select(written)
+        for field, (related, fk) in nested.items():
+            joined = related.__table__.alias(field)
+            query = query.add_columns(
+                joined.c.id.label(f"{field}__id"),
+                joined.c.name.label(f"{field}__name"),
+            ).outerjoin(joined, joined.c.id == written.c[fk])
+        stmt = query
+
+    row = (await session.execute(stmt)).mappings().first()
+    if row is None:
+        return None
+
+    data = {}
+    for key, value in row.items():
+        field, _, column = key.partition("__")
+        if column:
+            data.setdefault(field, {})[column] = value
+        else:
+            data[key] = value
+    for field in nested or ():
+        if data[field]["id"] is None:
+            data[field] = None
+    return data
+
+
+async def insert_returning(session: AsyncSession, model, values: dict, nested=None):
+    stmt = insert(model.__table__).values(**values)
+    return await _execute_returning(session, stmt, model, nested)
+
+
+async def upsert_returning(session: AsyncSession, model, values: dict, conflict: list[str], update_columns: list[str], nested=None):
+    """
+    INSERT ... ON CONFLICT (conflict) DO UPDATE SET update_columns ... RETURNING.
+    Columns with an onupdate (row_version) are restamped on the update branch,
+    which Core does not do by itself for ON CONFLICT.
+    """
+    table = model.__table__
+    stmt = insert(table).values(**values)
+    set_ = {column: stmt.excluded[column] for column in update_columns}
+    for column in table.columns:
+        if column.onupdate is not None and column.name not in set_:
+            set_[column.name] = column.onupdate.arg
+    stmt = stmt.on_conflict_do_update(index_elements=conflict, set_=set_)
+    return await _execute_returning(session, stmt, model, nested)
+
+
+async def update_returning(session: AsyncSession, model, row_id: int, values: dict, nested=None, previous=()):
+    """
+    UPDATE ... RETURNING for one row, None if it does not exist.
+    previous names columns whose pre-update values should come back too, as
+    old_<column>; they are read from a FOR UPDATE subquery in the same statement.
+    """
+    table = model.__table__
+    extra = ()
+    stmt = update(table)
+    if previous:
+        old = (
+            select(table.c.id, *[table.c[column] for column in previous])
+            .where(table.c.id == row_id)
+            .with_for_update()
+            .subquery("old")
+        )
+        stmt = stmt.where(table.c.id == old.c.id)
+        extra = [old.c[column].label(f"old_{column}") for column in previous]
+    else:
+        stmt = stmt.where(table.c.id == row_id)
+    return await _execute_returning(session, stmt.values(**values), model, nested, extra)
+
+
+async def delete_returning(session: AsyncSession, model, row_id: int, columns=("id",)):
+    """
+    DELETE ... RETURNING columns, None if the row did not exist.
+    """
+    table = model.__table__
+    stmt = delete(table).where(table.c.id == row_id).returning(*[table.c[column] for column in columns])
+    row = (await session.execute(stmt)).mappings().first()
+    return dict(row) if row else None